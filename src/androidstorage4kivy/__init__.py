@@ -1,3 +1,23 @@
-from .sharedstorage import SharedStorage
-from .chooser import Chooser
-from .sharesheet import ShareSheet
+# Classes are imported on first use, so that importing this package
+# does not import the modules (and Java classes) an app does not use.
+
+_classes = {'SharedStorage' : '.sharedstorage',
+            'Chooser' : '.chooser',
+            'ShareSheet' : '.sharesheet',
+            'TransferEngine' : '.transferengine'}
+
+__all__ = list(_classes)
+
+
+def __getattr__(name):
+    if name in _classes:
+        from importlib import import_module
+        value = getattr(import_module(_classes[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' +
+                         repr(name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,111 @@
+from kivy.logger import Logger
+from os.path import exists, getsize, dirname
+from os import remove, rmdir
+from time import time
+from .jsonstore import JSONStore, get_store
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# An index of the files copied to the cache by copy_from_shared().
+# Maps a source (uri or path) to its cache file and the source's
+# size/date_modified/generation when it was copied. A file is only copied
+# again if one of these changed. The least recently used files are
+# removed when the cache is larger than max_bytes.
+
+INDEX_NAME = '.cache_index.json'
+
+
+# One CacheIndex per cache directory, shared by all SharedStorage instances
+def get_cache_index(cache_dir):
+    return get_store(CacheIndex, cache_dir)
+
+
+class CacheIndex(JSONStore):
+
+    file_name = INDEX_NAME
+
+    ###################
+    # Public methods
+    ###################
+
+    # Returns the cache file if it is a copy of the current source, else None
+    # If the source has no date_modified and no generation it is
+    # assumed changed.
+    def lookup(self, key, size, date_modified, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            if (date_modified == None and generation == None) or\
+               entry['size'] != size or\
+               entry['date_modified'] != date_modified or\
+               entry['generation'] != generation or\
+               not exists(entry['file']) or\
+               (size != None and getsize(entry['file']) != size):
+                return None
+            # Saved with the next add() or discard(), a hit does not
+            # rewrite the index
+            entry['used'] = time()
+            return entry['file']
+
+    # Record a new cache file, and evict to the byte budget.
+    # max_bytes None or 0 is no limit.
+    def add(self, key, cache_file, size, date_modified, generation,
+            max_bytes = None):
+        try:
+            nbytes = getsize(cache_file)
+        except OSError:
+            return
+        with self._lock:
+            # A cache file belongs to one source
+            for k in [k for k, e in self._entries.items()
+                      if e['file'] == cache_file]:
+                del self._entries[k]
+            self._entries[key] = {'file' : cache_file,
+                                  'size' : size,
+                                  'date_modified' : date_modified,
+                                  'generation' : generation,
+                                  'bytes' : nbytes,
+                                  'used' : time()}
+            if max_bytes:
+                self._evict(max_bytes, key)
+            self._save()
+
+    def discard(self, key):
+        with self._lock:
+            if self._entries.pop(key, None):
+                self._save()
+
+    def total_bytes(self):
+        with self._lock:
+            return sum([e['bytes'] for e in self._entries.values()])
+
+    ###################
+    # Private
+    ###################
+
+    # Remove least recently used files, but never keep_key
+    def _evict(self, max_bytes, keep_key):
+        total = sum([e['bytes'] for e in self._entries.values()])
+        by_age = sorted(self._entries.items(), key = lambda i: i[1]['used'])
+        for key, entry in by_age:
+            if total <= max_bytes:
+                break
+            if key == keep_key:
+                continue
+            try:
+                if exists(entry['file']):
+                    remove(entry['file'])
+            except OSError as e:
+                Logger.warning('CacheIndex._evict():')
+                Logger.warning(str(e))
+                continue
+            total -= entry['bytes']
+            del self._entries[key]
+            # Each source has its own directory
+            directory = dirname(entry['file'])
+            if directory != self.directory:
+                try:
+                    rmdir(directory)
+                except OSError:
+                    pass
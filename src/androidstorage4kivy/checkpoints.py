@@ -0,0 +1,65 @@
+from time import time
+from .jsonstore import JSONStore, get_store
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# The progress of resumable copies, see copy_to_shared_resumable().
+# Maps a copy (source and destination) to the source version, the
+# destination, the number of bytes written and verified, and the hash of
+# those bytes. Saved after each chunk, so a copy interrupted by the app
+# being stopped continues from its last checkpoint.
+
+CHECKPOINTS_NAME = '.transfer_checkpoints.json'
+# Checkpoints not updated for this long are removed (seconds)
+MAX_CHECKPOINT_AGE = 7 * 24 * 60 * 60
+
+
+# One Checkpoints per directory, shared by all SharedStorage instances
+def get_checkpoints(directory):
+    return get_store(Checkpoints, directory)
+
+
+class Checkpoints(JSONStore):
+
+    file_name = CHECKPOINTS_NAME
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self._expire()
+
+    ###################
+    # Public methods
+    ###################
+
+    # Returns a copy of the checkpoint, or None
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry) if entry else None
+
+    def put(self, key, entry):
+        with self._lock:
+            entry = dict(entry)
+            entry['updated'] = time()
+            self._entries[key] = entry
+            self._save()
+
+    def discard(self, key):
+        with self._lock:
+            if self._entries.pop(key, None):
+                self._save()
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    ###################
+    # Private
+    ###################
+
+    # Android removes pending MediaStore items after a week
+    def _expire(self):
+        now = time()
+        for key in [k for k, e in self._entries.items()
+                    if now - e.get('updated', 0) > MAX_CHECKPOINT_AGE]:
+            del self._entries[key]
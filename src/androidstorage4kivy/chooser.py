@@ -1,11 +1,10 @@
 from kivy.logger import Logger
 from kivy.app import App
 from kivy.clock import mainthread
-from kivy.core.window import Window
 from android import activity, mActivity
-from jnius import autoclass
+from .javaclass import JavaClass
 
-Intent = autoclass('android.content.Intent')
+Intent = JavaClass('android.content.Intent')
 
 # Source https://github.com/Android-for-Python/androidstorage4kivy
 
@@ -15,23 +14,34 @@ Intent = autoclass('android.content.Intent')
 
 class Chooser():
     
-    def __init__(self, callback = None, **kwargs):
+    # If prefetch is True, the chosen files are copied to private storage
+    # on max_workers threads, as soon as they are chosen.
+    # file_callback(shared_file, private_file) is called as each file is
+    # ready, prefetch_callback(private_file_list) when all are done.
+    # Both are called on the Kivy main thread.
+    def __init__(self, callback = None, prefetch = False, max_workers = 4,
+                 file_callback = None, prefetch_callback = None, **kwargs):
         self.REQUEST_CODE_SINGLE = 42434445 
         self.REQUEST_CODE_MULTIPLE = 42434446 
         self.callback=callback
+        self.prefetch = prefetch
+        self.max_workers = max_workers
+        self.file_callback = file_callback
+        self.prefetch_callback = prefetch_callback
+        self.engine = None
         
     def choose_content(self, MIME_type = '*/*', multiple = False):
         try:
             activity.bind(on_activity_result=self.intent_callback)
             App.get_running_app().bind(on_resume = self.begone_you_black_screen)
-            self.intent = Intent(Intent.ACTION_GET_CONTENT)
-            self.intent.putExtra(Intent.EXTRA_ALLOW_MULTIPLE, multiple);
+            intent = Intent(Intent.ACTION_GET_CONTENT)
+            intent.putExtra(Intent.EXTRA_ALLOW_MULTIPLE, multiple);
             REQUEST_CODE = self.REQUEST_CODE_SINGLE
             if multiple:
                 REQUEST_CODE = self.REQUEST_CODE_MULTIPLE
-            self.intent.setType(MIME_type)
-            self.intent2 = Intent.createChooser(self.intent, None)
-            mActivity.startActivityForResult(self.intent2, REQUEST_CODE)
+            intent.setType(MIME_type)
+            chooser = Intent.createChooser(intent, None)
+            mActivity.startActivityForResult(chooser, REQUEST_CODE)
         except Exception as e:
             Logger.warning('Chooser.choose_content():')
             Logger.warning(str(e))        
@@ -40,9 +50,10 @@ class Chooser():
         activity.unbind(on_activity_result=self.intent_callback)
         if resultCode == -1: # Activity.RESULT_OK
             try:
-                if intent and self.callback:
+                if intent and (self.callback or self.prefetch):
+                    shared_file_list = None
                     if requestCode == self.REQUEST_CODE_SINGLE:
-                        self.callback([intent.getData()])
+                        shared_file_list = [intent.getData()]
                     elif requestCode == self.REQUEST_CODE_MULTIPLE:
                         shared_file_list = []
                         data = intent.getData()
@@ -53,17 +64,47 @@ class Chooser():
                             for i in range(clipData.getItemCount()):
                                 shared_file = clipData.getItemAt(i).getUri()
                                 shared_file_list.append(shared_file)
-                        self.callback(shared_file_list)
+                    if shared_file_list != None:
+                        if self.prefetch:
+                            self._prefetch(shared_file_list)
+                        if self.callback:
+                            self.callback(shared_file_list)
             except Exception as e:
                 Logger.warning('Chooser.intent_callback():')
                 Logger.warning(str(e))        
 
+    # Copy the chosen files to private storage in parallel
+    def _prefetch(self, shared_file_list):
+        if not self.engine:
+            from .transferengine import TransferEngine
+            # The user chose these files, and is waiting for them
+            self.engine = TransferEngine(max_workers = self.max_workers,
+                                         priority = 'interactive')
+        private_file_list = [None] * len(shared_file_list)
+        remaining = [len(shared_file_list)]
+
+        def file_done(index, job):
+            private_file_list[index] = job.result
+            remaining[0] -= 1
+            if self.file_callback:
+                self.file_callback(shared_file_list[index], job.result)
+            if remaining[0] == 0 and self.prefetch_callback:
+                self.prefetch_callback(private_file_list)
+
+        if not shared_file_list and self.prefetch_callback:
+            self.prefetch_callback(private_file_list)
+        for index, shared_file in enumerate(shared_file_list):
+            self.engine.copy_from_shared(shared_file,
+                callback = lambda job, index = index: file_done(index, job))
+
     # On return from the Chooser this Kivy app sometimes has a black screen,
     # but its event loop is running.
     # This workaround is scheduled in choose_content() to occur on_resume
     @mainthread
     def begone_you_black_screen(self, arg):
         App.get_running_app().unbind(on_resume = self.begone_you_black_screen)
+        # Imported here, importing creates the Window
+        from kivy.core.window import Window
         Window.update_viewport()
                 
 
@@ -0,0 +1,83 @@
+from contextlib import contextmanager
+from .jsonstore import JSONStore, get_store
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# An index of the files written by copy_to_shared(skip_unchanged = True).
+# Maps a shared file to the private file's size and date modified, the
+# shared file's version (size, date_modified, generation) after it was
+# written, and a hash of the contents. If neither file changed since,
+# the copy is skipped.
+
+INDEX_NAME = '.export_index.json'
+
+
+# One ExportIndex per directory, shared by all SharedStorage instances
+def get_export_index(directory):
+    return get_store(ExportIndex, directory)
+
+
+class ExportIndex(JSONStore):
+
+    file_name = INDEX_NAME
+
+    def __init__(self, directory):
+        self._batches = 0
+        self._dirty = False
+        super().__init__(directory)
+
+    ###################
+    # Public methods
+    ###################
+
+    # Returns a copy of the entry, or None
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry) if entry else None
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = dict(entry)
+            self._changed()
+
+    # Several entries, saved once
+    def put_many(self, entries):
+        if not entries:
+            return
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries[key] = dict(entry)
+            self._changed()
+
+    def discard(self, key):
+        with self._lock:
+            if self._entries.pop(key, None):
+                self._changed()
+
+    # Changes in the with block are saved once, when the outermost
+    # batch ends, rather than after each put().
+    @contextmanager
+    def batch(self):
+        with self._lock:
+            self._batches += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batches -= 1
+                if not self._batches and self._dirty:
+                    self._save()
+
+    ###################
+    # Private
+    ###################
+
+    def _changed(self):
+        self._dirty = True
+        if not self._batches:
+            self._save()
+
+    def _save(self):
+        self._dirty = False
+        super()._save()
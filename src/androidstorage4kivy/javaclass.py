@@ -0,0 +1,45 @@
+from jnius import autoclass
+from threading import Lock
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# Java classes are found with autoclass() on first use, not on import.
+# Each class is found once per process.
+
+_classes = {}
+_lock = Lock()
+
+
+def find_class(name):
+    with _lock:
+        if name not in _classes:
+            _classes[name] = autoclass(name)
+        return _classes[name]
+
+
+# Returns None if the class is not available
+def find_optional_class(name):
+    with _lock:
+        if name not in _classes:
+            try:
+                _classes[name] = autoclass(name)
+            except Exception:
+                _classes[name] = None
+        return _classes[name]
+
+
+# Stands in for a Java class, static members and constructor calls are
+# passed to the class, which is found on first use.
+class JavaClass():
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(find_class(self._name), attr)
+
+    def __call__(self, *args):
+        return find_class(self._name)(*args)
+
+    def __repr__(self):
+        return 'JavaClass(' + self._name + ')'
@@ -0,0 +1,58 @@
+from kivy.logger import Logger
+from os.path import join, exists
+from os import replace
+from threading import Lock
+import json
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# A dict of entries saved as a JSON file in a directory, the base of
+# CacheIndex, Checkpoints, and ExportIndex. The file is written to a
+# temporary file then renamed, so an interrupted save leaves the previous
+# version. A subclass sets file_name, and holds _lock while it uses
+# _entries.
+
+_stores = {}
+_stores_lock = Lock()
+
+
+# One store_class per directory, shared by all SharedStorage instances
+def get_store(store_class, directory):
+    with _stores_lock:
+        key = (store_class, directory)
+        if key not in _stores:
+            _stores[key] = store_class(directory)
+        return _stores[key]
+
+
+class JSONStore():
+
+    file_name = None
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.file_path = join(directory, self.file_name)
+        self._lock = Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            if exists(self.file_path):
+                with open(self.file_path) as f:
+                    return json.load(f)
+        except Exception as e:
+            Logger.warning(type(self).__name__ + '._load():')
+            Logger.warning(str(e))
+        return {}
+
+    def _save(self):
+        try:
+            temp_file = self.file_path + '.tmp'
+            # dumps() is the C encoder, dump() to a file is not
+            data = json.dumps(self._entries)
+            with open(temp_file, 'w') as f:
+                f.write(data)
+            replace(temp_file, self.file_path)
+        except Exception as e:
+            Logger.warning(type(self).__name__ + '._save():')
+            Logger.warning(str(e))
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from threading import Lock
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# A bounded, thread safe, least recently used cache.
+
+class LRUCache():
+
+    def __init__(self, max_size = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default = None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last = False)
+
+    def pop(self, key, default = None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    # Remove every entry for which test(key, value) is True
+    def pop_if(self, test):
+        with self._lock:
+            keys = [k for k, v in self._items.items() if test(k, v)]
+            for k in keys:
+                del self._items[k]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits' : self.hits,
+                    'misses' : self.misses,
+                    'size' : len(self._items),
+                    'max_size' : self.max_size}
+
+    # Not counted as a hit or miss
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
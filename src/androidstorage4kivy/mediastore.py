@@ -0,0 +1,121 @@
+from .javaclass import JavaClass
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# ContentResolver queries that only request the columns that are used,
+# and look up each column index once per cursor.
+
+ContentResolver = JavaClass('android.content.ContentResolver')
+Bundle = JavaClass('android.os.Bundle')
+
+LONG = 'long'
+STRING = 'string'
+
+# SQLite limits the number of '?' arguments in a selection
+MAX_SQL_ARGS = 900
+
+# The values of the MediaStore.MediaColumns constants, so that no Java
+# class is needed on import
+ID = ('_id', LONG)
+DISPLAY_NAME = ('_display_name', STRING)
+SIZE = ('_size', LONG)
+DATE_MODIFIED = ('date_modified', LONG)
+MIME_TYPE = ('mime_type', STRING)
+# Android < 10 only
+DATA = ('_data', STRING)
+# Android >= 10 only
+RELATIVE_PATH = ('relative_path', STRING)
+IS_PENDING = ('is_pending', LONG)
+OWNER_PACKAGE_NAME = ('owner_package_name', STRING)
+WIDTH = ('width', LONG)
+HEIGHT = ('height', LONG)
+DURATION = ('duration', LONG)
+DATE_TAKEN = ('datetaken', LONG)
+# Android >= 11 only
+GENERATION_MODIFIED = ('generation_modified', LONG)
+
+
+# columns is a list of (column_name, LONG or STRING).
+# Returns a list of rows, each row a list of values in the order of
+# columns. A missing or null value is None.
+# If max_rows is given, stop reading the cursor after max_rows rows.
+# If limit is given (Android >= 8), the provider returns at most limit
+# rows starting at offset, using Bundle query arguments. Providers may
+# ignore these, if honored_args is a list the query arguments the
+# provider reports that it honored (EXTRA_HONORED_ARGS) are added to it.
+def query(cr, uri, columns, selection = None, args = None,
+          sort_order = None, max_rows = None, limit = None, offset = 0,
+          honored_args = None):
+    projection = [name for name, kind in columns]
+    if limit == None:
+        cursor = cr.query(uri, projection, selection, args, sort_order)
+    else:
+        query_args = Bundle()
+        if selection:
+            query_args.putString(ContentResolver.QUERY_ARG_SQL_SELECTION,
+                                 selection)
+        if args:
+            query_args.putStringArray(\
+                ContentResolver.QUERY_ARG_SQL_SELECTION_ARGS, args)
+        if sort_order:
+            query_args.putString(ContentResolver.QUERY_ARG_SQL_SORT_ORDER,
+                                 sort_order)
+        query_args.putInt(ContentResolver.QUERY_ARG_LIMIT, limit)
+        query_args.putInt(ContentResolver.QUERY_ARG_OFFSET, offset)
+        cursor = cr.query(uri, projection, query_args, None)
+    rows = []
+    if not cursor:
+        return rows
+    try:
+        if limit != None and honored_args != None:
+            extras = cursor.getExtras()
+            honored = extras.getStringArray(
+                ContentResolver.EXTRA_HONORED_ARGS) if extras else None
+            honored_args.extend(honored or [])
+        getters = []
+        for name, kind in columns:
+            getters.append((cursor.getColumnIndex(name), kind))
+        while (max_rows == None or len(rows) < max_rows) and\
+              cursor.moveToNext():
+            row = []
+            for index, kind in getters:
+                if index < 0:
+                    row.append(None)
+                elif kind == LONG:
+                    if cursor.isNull(index):
+                        row.append(None)
+                    else:
+                        row.append(cursor.getLong(index))
+                else:
+                    row.append(cursor.getString(index))
+            rows.append(row)
+    finally:
+        cursor.close()
+    return rows
+
+
+# True if the honored_args of a query() show limit and offset were applied
+def limit_honored(honored_args):
+    return ContentResolver.QUERY_ARG_LIMIT in honored_args and\
+        ContentResolver.QUERY_ARG_OFFSET in honored_args
+
+
+# (selection, args) for the files in the directory base (a RELATIVE_PATH
+# with no trailing '/') and its sub directories
+def like_subtree(base):
+    escaped = base.replace('\\', '\\\\').replace('%', '\\%').\
+        replace('_', '\\_')
+    return RELATIVE_PATH[0] + " LIKE ? ESCAPE '\\'", [escaped + '/%']
+
+
+# Yields (selection, args) for "column IN (?,...)" of values, each with
+# no more than MAX_SQL_ARGS args. If where is given, it is
+# "where AND column IN (?,...)", and where_args are first in each args.
+def in_chunks(column, values, where = None, where_args = ()):
+    step = MAX_SQL_ARGS - len(where_args)
+    for start in range(0, len(values), step):
+        chunk = [str(v) for v in values[start:start + step]]
+        selection = column[0] + " IN (" + ','.join(['?'] * len(chunk)) + ")"
+        if where:
+            selection = where + " AND " + selection
+        yield selection, list(where_args) + chunk
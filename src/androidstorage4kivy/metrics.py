@@ -0,0 +1,226 @@
+from kivy.logger import Logger
+from threading import local, Lock
+from collections import deque
+from functools import wraps
+from time import perf_counter
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# Per operation timings, bytes copied, copy path, and ContentResolver
+# calls for SharedStorage and ShareSheet.
+#
+#     def listener(event):
+#         print(event.operation, event.duration, event.bytes)
+#     metrics.add_listener(listener)
+#
+# A listener is called on the thread that ran the operation. With no
+# listener, an operation only checks an empty list.
+# Only the outermost operation on a thread reports, for example
+# share_file_list() reports the resolver calls of the share_file() it uses.
+
+_listeners = []
+_local = local()
+
+
+class MetricsEvent():
+    __slots__ = ('operation', 'duration', 'bytes', 'copy_path',
+                 'resolver_calls', 'succeeded')
+
+    def __init__(self, operation):
+        self.operation = operation
+        # seconds
+        self.duration = 0
+        self.bytes = 0
+        # 'FileUtils', 'StreamCopy', 'java_loop', 'sendfile', 'read_write',
+        # 'shutil', 'chunked', or None if nothing was copied
+        self.copy_path = None
+        self.resolver_calls = 0
+        self.succeeded = False
+
+    def __repr__(self):
+        return 'MetricsEvent(' + self.operation + ', ' +\
+            str(round(self.duration * 1000, 3)) + ' ms, ' +\
+            str(self.bytes) + ' bytes, ' + str(self.copy_path) + ', ' +\
+            str(self.resolver_calls) + ' resolver calls)'
+
+
+###################
+# Listeners
+###################
+
+def add_listener(listener):
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+# with metrics.listening(aggregator):
+class listening():
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def __enter__(self):
+        add_listener(self.listener)
+        return self.listener
+
+    def __exit__(self, *args):
+        remove_listener(self.listener)
+
+
+###################
+# Used by SharedStorage and ShareSheet
+###################
+
+# Decorates a method, the event is reported when it returns.
+# If returns_result, a result of None or False is not succeeded,
+# else only an exception is not succeeded.
+def measure(operation, returns_result = True):
+    def decorator(function):
+        @wraps(function)
+        def measured(*args, **kwargs):
+            if not _listeners or getattr(_local, 'event', None) != None:
+                return function(*args, **kwargs)
+            event = MetricsEvent(operation)
+            _local.event = event
+            start = perf_counter()
+            try:
+                result = function(*args, **kwargs)
+                event.succeeded = not returns_result or\
+                    (result is not None and result is not False)
+                return result
+            finally:
+                event.duration = perf_counter() - start
+                _local.event = None
+                _report(event)
+        return measured
+    return decorator
+
+
+# Returns cr, counting its calls if an operation is measured
+def track_resolver(cr):
+    event = getattr(_local, 'event', None)
+    if event == None:
+        return cr
+    return _CountingResolver(cr, event)
+
+
+def set_copy_path(copy_path):
+    event = getattr(_local, 'event', None)
+    if event != None:
+        event.copy_path = copy_path
+
+
+def add_bytes(num):
+    event = getattr(_local, 'event', None)
+    if event != None and num:
+        event.bytes += num
+
+
+def measuring():
+    return getattr(_local, 'event', None) != None
+
+
+###################
+# Aggregator
+###################
+
+# A listener that keeps the last max_samples events per operation.
+#     aggregator = MetricsAggregator()
+#     metrics.add_listener(aggregator)
+#     ...
+#     aggregator.log_report()
+class MetricsAggregator():
+
+    def __init__(self, max_samples = 1000):
+        self.max_samples = max_samples
+        self._events = {}
+        self._lock = Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            if event.operation not in self._events:
+                self._events[event.operation] =\
+                    deque(maxlen = self.max_samples)
+            self._events[event.operation].append(event)
+
+    # {operation : {'count', 'p50_ms', 'p95_ms', 'bytes',
+    #               'resolver_calls', 'failed', 'copy_paths'}}
+    def report(self):
+        with self._lock:
+            events = {k: list(v) for k, v in self._events.items()}
+        report = {}
+        for operation, samples in sorted(events.items()):
+            durations = sorted([e.duration for e in samples])
+            copy_paths = {}
+            for e in samples:
+                if e.copy_path:
+                    copy_paths[e.copy_path] =\
+                        copy_paths.get(e.copy_path, 0) + 1
+            report[operation] = {
+                'count' : len(samples),
+                'p50_ms' : _percentile(durations, 50) * 1000,
+                'p95_ms' : _percentile(durations, 95) * 1000,
+                'bytes' : sum([e.bytes for e in samples]),
+                'resolver_calls' : sum([e.resolver_calls for e in samples]),
+                'failed' : len([e for e in samples if not e.succeeded]),
+                'copy_paths' : copy_paths}
+        return report
+
+    def log_report(self):
+        for operation, r in self.report().items():
+            Logger.info('Metrics: ' + operation +
+                        ' count=' + str(r['count']) +
+                        ' p50=' + str(round(r['p50_ms'], 2)) + 'ms' +
+                        ' p95=' + str(round(r['p95_ms'], 2)) + 'ms' +
+                        ' bytes=' + str(r['bytes']) +
+                        ' resolver_calls=' + str(r['resolver_calls']) +
+                        ' failed=' + str(r['failed']) +
+                        ' copy_paths=' + str(r['copy_paths']))
+
+    def clear(self):
+        with self._lock:
+            self._events = {}
+
+
+###################
+# Private
+###################
+
+def _report(event):
+    for listener in list(_listeners):
+        try:
+            listener(event)
+        except Exception as e:
+            Logger.warning('metrics listener:')
+            Logger.warning(str(e))
+
+
+# Nearest rank
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class _CountingResolver():
+
+    def __init__(self, cr, event):
+        self._cr = cr
+        self._event = event
+
+    def __getattr__(self, name):
+        attr = getattr(self._cr, name)
+        if not callable(attr):
+            return attr
+        event = self._event
+
+        def call(*args):
+            event.resolver_calls += 1
+            return attr(*args)
+        return call
@@ -0,0 +1,361 @@
+from jnius import PythonJavaClass, java_method
+from threading import Condition, Event, Lock, local, current_thread,\
+    main_thread
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from time import monotonic, sleep
+from .metrics import _percentile
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# Coordinates the I/O of SharedStorage and ShareSheet, so that a
+# background export does not delay the file the user is waiting for.
+#
+# Each copy is a job in a priority class:
+#   'interactive'  the user is waiting: copy_from_shared(), ShareSheet,
+#                  Chooser prefetch, and any call on the Kivy main thread
+#   'prefetch'     get_thumbnail()
+#   'bulk'         copies to shared storage, resumable copies,
+#                  and TransferEngine copies
+# A job runs on the thread that called the operation, when its class has
+# fewer than its limit of jobs running and no job of a higher class is
+# waiting. An operation called by another is part of the outer job.
+# A job the same as one that is waiting (the same operation and
+# arguments) is not queued again, it shares the result of the first.
+# The copies of bulk jobs may be limited to bulk_bytes_per_second, in
+# total. Queue depths and wait times are kept for stats().
+#
+#     from androidstorage4kivy import scheduler
+#     s = scheduler.get_scheduler()
+#     s.set_limit('bulk', 1)
+#     s.bulk_bytes_per_second = 4 * 1024 * 1024
+#     with s.priority('interactive'):
+#         ss.copy_to_shared(private_file)
+
+PRIORITIES = ['interactive', 'prefetch', 'bulk']
+DEFAULT_LIMITS = {'interactive' : 4, 'prefetch' : 2, 'bulk' : 2}
+# Wait times kept per class, for stats()
+WAIT_SAMPLES = 1000
+# A throttled copy checks for cancel at least this often (seconds)
+THROTTLE_SLICE = 0.1
+
+_scheduler = None
+_scheduler_lock = Lock()
+# The job this thread is running, and the priority set by priority()
+_local = local()
+
+
+# One IOScheduler per process
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler == None:
+            _scheduler = IOScheduler()
+        return _scheduler
+
+
+# Decorates a method, each call is a job of priority.
+# Calls with the same arguments are the same job.
+def scheduled(priority):
+    def decorator(function):
+        @wraps(function)
+        def run(*args, **kwargs):
+            return get_scheduler().run(priority, function, args, kwargs)
+        return run
+    return decorator
+
+
+# Used by FileUtils.copy() to report progress
+class ProgressListener(PythonJavaClass):
+    __javainterfaces__ = ['android/os/FileUtils$ProgressListener']
+    __javacontext__ = 'app'
+
+    def __init__(self, monitor):
+        super().__init__()
+        self.monitor = monitor
+
+    @java_method('(J)V')
+    def onProgress(self, progress):
+        self.monitor.set_progress(progress)
+
+
+# Run the ProgressListener on the copying thread
+class DirectExecutor(PythonJavaClass):
+    __javainterfaces__ = ['java/util/concurrent/Executor']
+    __javacontext__ = 'app'
+
+    @java_method('(Ljava/lang/Runnable;)V')
+    def execute(self, runnable):
+        runnable.run()
+
+
+class IOScheduler():
+
+    def __init__(self, limits = None, bulk_bytes_per_second = None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        # None is no limit
+        self.bulk_bytes_per_second = bulk_bytes_per_second
+        self._condition = Condition()
+        self._queues = {p : deque() for p in PRIORITIES}
+        self._running = {p : 0 for p in PRIORITIES}
+        # key : waiting job
+        self._waiting = {}
+        self._throttle_lock = Lock()
+        self._throttle_next = 0
+        self.reset_stats()
+
+    ###################
+    # Public methods
+    ###################
+
+    # At most limit jobs of priority run at once
+    def set_limit(self, priority, limit):
+        with self._condition:
+            self.limits[priority] = max(1, limit)
+            self._condition.notify_all()
+
+    # Operations called by this thread in the with block are jobs of
+    # priority, rather than their default.
+    @contextmanager
+    def priority(self, priority):
+        previous = getattr(_local, 'priority', None)
+        _local.priority = priority
+        try:
+            yield self
+        finally:
+            _local.priority = previous
+
+    # {priority : {'queue_depth', 'max_queue_depth', 'running',
+    #              'submitted', 'deduplicated', 'completed',
+    #              'wait_p50', 'wait_p95', 'wait_max', 'throttled'}}
+    # Times are in seconds, 'throttled' is the time bulk copies slept.
+    def stats(self):
+        with self._condition:
+            report = {}
+            for p in PRIORITIES:
+                stats = dict(self._stats[p])
+                waits = sorted(stats.pop('waits'))
+                stats['queue_depth'] = len(self._queues[p])
+                stats['running'] = self._running[p]
+                stats['wait_p50'] = _percentile(waits, 50)
+                stats['wait_p95'] = _percentile(waits, 95)
+                stats['wait_max'] = waits[-1] if waits else 0
+                report[p] = stats
+            return report
+
+    def reset_stats(self):
+        with self._condition:
+            self._stats = {p : {'max_queue_depth' : len(self._queues[p]),
+                                'submitted' : 0,
+                                'deduplicated' : 0,
+                                'completed' : 0,
+                                'throttled' : 0,
+                                'waits' : deque(maxlen = WAIT_SAMPLES)}
+                           for p in PRIORITIES}
+
+    ###################
+    # Used by SharedStorage and ShareSheet
+    ###################
+
+    # Returns function(*args, **kwargs), run when priority allows
+    def run(self, priority, function, args, kwargs):
+        if getattr(_local, 'job', None) != None:
+            # Part of the outer job
+            return function(*args, **kwargs)
+        priority = getattr(_local, 'priority', None) or\
+            self._thread_priority(priority)
+        job, owner = self._submit(priority, self._key(function, args,
+                                                      kwargs))
+        if not owner:
+            job.done.wait()
+            if job.error != None:
+                raise job.error
+            return job.result
+        self._start(job)
+        _local.job = job
+        try:
+            job.result = function(*args, **kwargs)
+        except BaseException as e:
+            job.error = e
+            raise
+        finally:
+            _local.job = None
+            with self._condition:
+                self._running[job.priority] -= 1
+                self._stats[job.priority]['completed'] += 1
+                self._condition.notify_all()
+            job.done.set()
+        return job.result
+
+    # The monitor for a copy by this thread, if it is a throttled bulk
+    # job the copy's progress is throttled. reported is the progress
+    # already reported, that was not copied now.
+    def throttled(self, monitor, reported = 0):
+        job = getattr(_local, 'job', None)
+        if job == None or job.priority != 'bulk' or\
+           not self.bulk_bytes_per_second or\
+           isinstance(monitor, ThrottledMonitor):
+            return monitor
+        return ThrottledMonitor(monitor, self, reported)
+
+    ###################
+    # Private
+    ###################
+
+    # Kivy's UI runs on the main thread, the user waits for any operation
+    # it calls, so the call is not queued behind background copies.
+    def _thread_priority(self, priority):
+        if current_thread() is main_thread():
+            return 'interactive'
+        return priority
+
+    # Arguments that can't be compared are not deduplicated
+    def _key(self, function, args, kwargs):
+        # Not self
+        key = (function.__qualname__, args[1:],
+               tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    # Returns (job, True), or (the waiting job, False)
+    def _submit(self, priority, key):
+        with self._condition:
+            job = self._waiting.get(key) if key != None else None
+            if job:
+                self._stats[priority]['deduplicated'] += 1
+                if PRIORITIES.index(priority) <\
+                   PRIORITIES.index(job.priority):
+                    # Not delayed by the lower priority of the first
+                    self._queues[job.priority].remove(job)
+                    job.priority = priority
+                    self._queue(job)
+                return job, False
+            job = _Job(priority, key)
+            if key != None:
+                self._waiting[key] = job
+            self._stats[priority]['submitted'] += 1
+            self._queue(job)
+            return job, True
+
+    def _queue(self, job):
+        queue = self._queues[job.priority]
+        queue.append(job)
+        stats = self._stats[job.priority]
+        stats['max_queue_depth'] = max(stats['max_queue_depth'], len(queue))
+        self._condition.notify_all()
+
+    # Wait for the job's turn
+    def _start(self, job):
+        with self._condition:
+            while not self._can_start(job):
+                self._condition.wait()
+            self._queues[job.priority].popleft()
+            if job.key != None:
+                del self._waiting[job.key]
+            self._running[job.priority] += 1
+            self._stats[job.priority]['waits'].append(monotonic() -
+                                                      job.queued)
+
+    def _can_start(self, job):
+        queue = self._queues[job.priority]
+        if not queue or queue[0] is not job or\
+           self._running[job.priority] >= self.limits[job.priority]:
+            return False
+        for p in PRIORITIES[:PRIORITIES.index(job.priority)]:
+            if self._queues[p]:
+                return False
+        return True
+
+    # num bytes were copied by a bulk job, sleep until that is within
+    # bulk_bytes_per_second of all bulk copies
+    def _throttle(self, num, monitor):
+        rate = self.bulk_bytes_per_second
+        if not rate or num <= 0:
+            return
+        with self._throttle_lock:
+            now = monotonic()
+            self._throttle_next = max(self._throttle_next, now) + num / rate
+            end = self._throttle_next
+        with self._condition:
+            self._stats['bulk']['throttled'] += end - now
+        while not monitor.cancelled:
+            remaining = end - monotonic()
+            if remaining <= 0:
+                break
+            sleep(min(remaining, THROTTLE_SLICE))
+
+
+class _Job():
+
+    def __init__(self, priority, key):
+        self.priority = priority
+        self.key = key
+        self.queued = monotonic()
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+# A copy's monitor (see TransferJob), or for a copy with no monitor,
+# a monitor that only throttles. Progress is reported to the monitor,
+# then the copy sleeps if the bulk copies are faster than the limit.
+class ThrottledMonitor():
+
+    def __init__(self, monitor, scheduler, reported = 0):
+        self.monitor = monitor
+        self._scheduler = scheduler
+        self._reported = reported
+        self._total_bytes = -1
+        self._executor = None
+        self._listener = None
+
+    @property
+    def cancelled(self):
+        return self.monitor != None and self.monitor.cancelled
+
+    @property
+    def total_bytes(self):
+        if self.monitor:
+            return self.monitor.total_bytes
+        return self._total_bytes
+
+    # FileUtils.copy() accepts no CancellationSignal
+    @property
+    def signal(self):
+        if self.monitor:
+            return self.monitor.signal
+        return None
+
+    @property
+    def executor(self):
+        if not self._executor:
+            self._executor = DirectExecutor()
+        return self._executor
+
+    @property
+    def listener(self):
+        if not self._listener:
+            self._listener = ProgressListener(self)
+        return self._listener
+
+    def check_cancelled(self):
+        if self.monitor:
+            self.monitor.check_cancelled()
+
+    def set_total(self, total_bytes):
+        self._total_bytes = total_bytes
+        if self.monitor:
+            self.monitor.set_total(total_bytes)
+
+    def set_progress(self, bytes_transferred):
+        num = bytes_transferred - self._reported
+        self._reported = bytes_transferred
+        if self.monitor:
+            self.monitor.set_progress(bytes_transferred)
+        self._scheduler._throttle(num, self)
+
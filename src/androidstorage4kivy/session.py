@@ -0,0 +1,100 @@
+from android import mActivity
+from threading import Lock
+from . import metrics
+from .javaclass import JavaClass
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# The Java objects that live as long as the app, found once per process
+# and shared by SharedStorage and ShareSheet: the application Context,
+# its ContentResolver, the MediaStore collection uris, and static fields.
+# Each is otherwise a JNI call (and a new JNI reference) per use.
+# Short lived Java objects (ContentValues, Intent, ArrayList) are not
+# kept here, or in SharedStorage or ShareSheet attributes.
+
+MediaStoreFiles = JavaClass('android.provider.MediaStore$Files')
+MediaStoreDownloads = JavaClass('android.provider.MediaStore$Downloads')
+MediaStoreAudioMedia = JavaClass('android.provider.MediaStore$Audio$Media')
+MediaStoreImagesMedia =JavaClass('android.provider.MediaStore$Images$Media')
+MediaStoreVideoMedia = JavaClass('android.provider.MediaStore$Video$Media')
+
+_session = None
+_session_lock = Lock()
+
+
+# One StorageSession per process
+def get_session():
+    global _session
+    with _session_lock:
+        if _session == None:
+            _session = StorageSession()
+        return _session
+
+
+class StorageSession():
+
+    def __init__(self):
+        self.context = mActivity.getApplicationContext()
+        self._resolver = self.context.getContentResolver()
+        self._package_name = None
+        self._storage = None
+        # (class name, field name) : value
+        self._statics = {}
+
+    ###################
+    # Public methods
+    ###################
+
+    # The ContentResolver, its calls are counted if an operation is measured
+    @property
+    def resolver(self):
+        return metrics.track_resolver(self._resolver)
+
+    # The ContentResolver itself, for an argument of a Java method
+    @property
+    def raw_resolver(self):
+        return self._resolver
+
+    @property
+    def package_name(self):
+        if self._package_name == None:
+            self._package_name = self.context.getPackageName()
+        return self._package_name
+
+    # A SharedStorage, for helpers such as get_file_MIME_type()
+    @property
+    def storage(self):
+        if self._storage == None:
+            from .sharedstorage import SharedStorage
+            self._storage = SharedStorage()
+        return self._storage
+
+    # A static final field of a Java class, read once.
+    #     session.static(Environment, 'DIRECTORY_PICTURES')
+    def static(self, java_class, name):
+        key = (java_class._name, name)
+        value = self._statics.get(key)
+        if value == None:
+            value = getattr(java_class, name)
+            self._statics[key] = value
+        return value
+
+    # The MediaStore collection uris.
+    # kind is 'files', 'downloads' (Android >= 10), 'images', 'video',
+    # or 'audio'
+    def root_uri(self, kind):
+        key = ('root_uri', kind)
+        uri = self._statics.get(key)
+        if uri == None:
+            if kind == 'files':
+                uri = MediaStoreFiles.getContentUri('external')
+            elif kind == 'downloads':
+                uri = MediaStoreDownloads.EXTERNAL_CONTENT_URI
+            elif kind == 'images':
+                uri = MediaStoreImagesMedia.EXTERNAL_CONTENT_URI
+            elif kind == 'video':
+                uri = MediaStoreVideoMedia.EXTERNAL_CONTENT_URI
+            else:
+                uri = MediaStoreAudioMedia.EXTERNAL_CONTENT_URI
+            self._statics[key] = uri
+        return uri
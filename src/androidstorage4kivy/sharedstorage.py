@@ -1,117 +1,272 @@
 from kivy.logger import Logger
-from android import mActivity, autoclass, cast, api_version
-from os.path import splitext,join, basename, exists
-from os import mkdir, remove 
+from kivy.clock import mainthread
+from android import mActivity, activity, cast, api_version
+from jnius import detach
+from os.path import splitext,join, basename, exists, getsize, getmtime,\
+    relpath, dirname
+from os import mkdir, makedirs, remove, fdopen, close, replace, read, write,\
+    walk, stat, rmdir, fstat, pread, pwrite, fsync, ftruncate, O_RDONLY, O_RDWR,\
+    O_CREAT, scandir
+from os import open as open_fd
+try:
+    from os import sendfile
+except ImportError:
+    sendfile = None
+from contextlib import contextmanager, nullcontext
 from shutil import copyfile
+from mmap import mmap as MemoryMap, ACCESS_READ, ACCESS_WRITE
+from hashlib import sha1, blake2b, new as new_hash
+from threading import Event, Lock, Thread, get_ident
+from .lrucache import LRUCache
+from . import mediastore
+from . import metrics
+from . import scheduler
+from . import thumbnails
+from .cacheindex import get_cache_index
+from .checkpoints import get_checkpoints
+from .exportindex import get_export_index
+from .javaclass import JavaClass, find_optional_class
+from .session import get_session
 
-FileOutputStream = autoclass('java.io.FileOutputStream')
-FileInputStream = autoclass('java.io.FileInputStream')
-Environment = autoclass('android.os.Environment')
-MediaStoreMediaColumns = autoclass('android.provider.MediaStore$MediaColumns')
-ContentUris = autoclass('android.content.ContentUris')
-MimeTypeMap = autoclass('android.webkit.MimeTypeMap')
-StreamCopy = None
-if api_version > 28:
-    FileUtils        = autoclass('android.os.FileUtils')
-    MediaStoreFiles = autoclass('android.provider.MediaStore$Files')
-    MediaStoreDownloads = autoclass('android.provider.MediaStore$Downloads')
-    MediaStoreAudioMedia = autoclass('android.provider.MediaStore$Audio$Media')
-    MediaStoreImagesMedia =autoclass('android.provider.MediaStore$Images$Media')
-    MediaStoreVideoMedia = autoclass('android.provider.MediaStore$Video$Media')
-    ContentValues = autoclass('android.content.ContentValues')
-else:
-    try:
-        StreamCopy = autoclass('org.kivy.sharedstorage.StreamCopy')
-    except:
-        pass
+# Java classes are found on first use
+FileOutputStream = JavaClass('java.io.FileOutputStream')
+FileInputStream = JavaClass('java.io.FileInputStream')
+Environment = JavaClass('android.os.Environment')
+ContentUris = JavaClass('android.content.ContentUris')
+MimeTypeMap = JavaClass('android.webkit.MimeTypeMap')
+# Android >= 10
+FileUtils        = JavaClass('android.os.FileUtils')
+ContentValues = JavaClass('android.content.ContentValues')
+ContentProviderOperation = JavaClass('android.content.ContentProviderOperation')
+ArrayList = JavaClass('java.util.ArrayList')
+MediaStore = JavaClass('android.provider.MediaStore')
+Integer = JavaClass('java.lang.Integer')
+Uri = JavaClass('android.net.Uri')
+
+
+# Optional, Android < 10 only. See README faster_copy
+def get_stream_copy():
+    if api_version > 28:
+        return None
+    return find_optional_class('org.kivy.sharedstorage.StreamCopy')
 
 # Source https://github.com/Android-for-Python/androidsatorage4kivy
 
+# startIntentSenderForResult() request code, for delete confirmation
+DELETE_REQUEST_CODE = 42434447
+# Number of shared file path to uri mappings remembered
+URI_CACHE_SIZE = 512
+# Number of file extension to MIME type mappings remembered
+MIME_CACHE_SIZE = 256
+# Python file mode to ContentResolver.openFileDescriptor() mode
+FILE_DESCRIPTOR_MODES = {'rb' : 'r', 'r' : 'r',
+                         'wb' : 'wt', 'w' : 'wt',
+                         'ab' : 'wa', 'a' : 'wa',
+                         'r+b' : 'rw', 'rb+' : 'rw', 'r+' : 'rw',
+                         'w+b' : 'rwt', 'wb+' : 'rwt', 'w+' : 'rwt'}
+
+# Files being written on Android < 10, by create_shared() and resumable copies
+PARTIAL_SUFFIXES = ('.pending', '.partial')
+
+# get_metadata() keys, and the MediaStore columns they are read from
+METADATA_COLUMNS = [('name', mediastore.DISPLAY_NAME),
+                    ('size', mediastore.SIZE),
+                    ('MIME_type', mediastore.MIME_TYPE),
+                    ('date_modified', mediastore.DATE_MODIFIED),
+                    # Android >= 10
+                    ('date_taken', mediastore.DATE_TAKEN),
+                    ('width', mediastore.WIDTH),
+                    ('height', mediastore.HEIGHT),
+                    ('duration', mediastore.DURATION)]
+METADATA_KEYS = [key for key, column in METADATA_COLUMNS]
+
+# list_shared() sort orders
+SORT_COLUMNS = {'name' : mediastore.DISPLAY_NAME[0],
+                'date_modified' : mediastore.DATE_MODIFIED[0],
+                'size' : mediastore.SIZE[0]}
+
+
+# A shared file, as listed by list_shared()
+class SharedFileInfo():
+    __slots__ = ('name', 'shared_file', 'path', 'size', 'date_modified',
+                 'MIME_type')
+
+    def __init__(self, name, shared_file, path, size, date_modified,
+                 MIME_type):
+        self.name = name
+        # A uri on Android >= 10, else a string
+        self.shared_file = shared_file
+        # '<collection>/<app-Title>/sub_dir/name.ext'
+        self.path = path
+        self.size = size
+        # seconds since the epoch
+        self.date_modified = date_modified
+        self.MIME_type = MIME_type
+
+    def __repr__(self):
+        return 'SharedFileInfo(' + self.path + ')'
+
 
 class SharedStorage:
 
+    # Buffer size for copies made in Python, may be set per instance
+    copy_buffer_size = 1024 * 1024
+    # copy_from_shared() cache budget, least recently used files are
+    # removed to stay within this. None is no limit.
+    cache_max_bytes = 512 * 1024 * 1024
+    # get_thumbnail() cache budget, None is no limit.
+    thumbnail_cache_max_bytes = 32 * 1024 * 1024
+    # Resumable copies, bytes between checkpoints and the hashlib algorithm
+    resumable_chunk_size = 8 * 1024 * 1024
+    resumable_hash = 'sha256'
+
+    # Shared by all instances, filled by _get_uri() and by inserts
+    _uri_cache = LRUCache(URI_CACHE_SIZE)
+    # Cache copies in progress, by source
+    _in_flight = {}
+    _in_flight_lock = Lock()
+    # Values that don't change while the app runs, see clear_memoized()
+    _memoized = {}
+    _MIME_cache = LRUCache(MIME_CACHE_SIZE)
+
     ###################
     # Public methods
     ###################
 
-    def copy_to_shared(self, private_file, collection = None, filepath = None):
-        if private_file == None or not exists(private_file):
-            return None
-        file_name = basename(private_file)
-        MIME_type = self.get_file_MIME_type(file_name)
-        auto_collection = self._get_auto_collection(MIME_type)
-        if not self._legal_collection(auto_collection, collection):
-            collection = auto_collection
-        path = [collection, self.get_app_title()]
-        if filepath:
-            sfp = filepath.split('/')
-            file_name = sfp[-1]
-            for f in sfp[:-1]:
-                path.append(f)
+    # If skip_unchanged, a shared file with the same contents is not
+    # written again, and returns (shared_file, skipped).
+    def copy_to_shared(self, private_file, collection = None, filepath = None,
+                       skip_unchanged = False):
+        if not skip_unchanged:
+            return self._copy_to_shared(private_file, collection, filepath)
+        skipped = []
+        shared_file = self._copy_to_shared(private_file, collection, filepath,
+                                           skipped = skipped)
+        return shared_file, len(skipped) > 0
+
+    # files is a list of private_file, or (private_file, filepath) tuples.
+    # Returns a list of shared_file (or None), in the order of files.
+    # If skip_unchanged, returns (shared_file list, skipped private_file list)
+    def copy_many_to_shared(self, files, collection = None,
+                            skip_unchanged = False):
+        if not skip_unchanged:
+            return self._copy_many_to_shared(files, collection)
+        skipped = []
+        with self._export_batch():
+            results = self._copy_many_to_shared(files, collection, skipped)
+        return results, skipped
+
+    def copy_from_shared(self, shared_file):
+        return self._copy_from_shared(shared_file)
 
+    # Chunked copies that continue from their last checkpoint if the copy
+    # was interrupted, for example because the app was stopped.
+    # The data is hashed as it is copied.
+    # Returns the shared_file (or cache file), or if return_hash
+    # (shared_file, hexdigest). Else None.
+    def copy_to_shared_resumable(self, private_file, collection = None,
+                                 filepath = None, return_hash = False):
+        return self._copy_to_shared_resumable(private_file, collection,
+                                              filepath, return_hash)
+
+    def copy_from_shared_resumable(self, shared_file, return_hash = False):
+        return self._copy_from_shared_resumable(shared_file, return_hash)
+
+    # Write a new shared file, without first writing a private file.
+    #     with ss.create_shared('data.csv') as f:
+    #         f.write(data)
+    # Yields a Python binary stream, or None if the file can't be created.
+    # The shared file is only published if the with block completes,
+    # then f.shared_file is the shared_file (as copy_to_shared() returns).
+    @contextmanager
+    def create_shared(self, name, collection = None, filepath = None):
+        if name == None:
+            yield None
+            return
+        file_name, MIME_type, path =\
+            self._get_shared_path(name, collection, filepath)
         if api_version > 28:
-            sub_directory = ''
-            for d in path:
-                sub_directory = join(sub_directory,d)
-            uri = self._get_uri(join(sub_directory, file_name))
-            context = mActivity.getApplicationContext()
-            try:
-                cr =  context.getContentResolver()
-                ws = None
-                if uri:
-                    try:
-                        ws  = cr.openOutputStream(uri,"rwt")
-                    except:
-                        Logger.info('File replace permission not granted.')
-                        Logger.info('A new file version will be created.')
-                        uri = None
-                if not ws:
-                    cv = ContentValues()
-                    cv.put(MediaStoreMediaColumns.DISPLAY_NAME, file_name)
-                    cv.put(MediaStoreMediaColumns.MIME_TYPE, MIME_type)  
-                    cv.put(MediaStoreMediaColumns.RELATIVE_PATH, sub_directory)
-                    root_uri = self._get_root_uri(path[0], MIME_type)
-                    uri = cr.insert(root_uri, cv)
-                    ws  = cr.openOutputStream(uri)
-                # copy file contents
-                rs = FileInputStream(private_file)
-                FileUtils.copy(rs,ws) 
-                ws.flush()
-                ws.close()
-                rs.close()
-            except Exception as e:
-                Logger.warning('SharedStorage.copy_to_shared():')
-                Logger.warning(str(e))
-                uri = None
-            return uri
+            with self._create_shared_uri(file_name, MIME_type, path) as f:
+                yield f
         else:
+            with self._create_shared_file(file_name, path) as f:
+                yield f
+
+    # Open a shared file without copying it to the cache.
+    # Returns a Python file object, or if mmap is True a memory map;
+    # read only, or writable for a '+' mode. Else None.
+    @metrics.measure('open_shared')
+    def open_shared(self, shared_file, mode = 'rb', mmap = False):
+        if shared_file == None or mode not in FILE_DESCRIPTOR_MODES:
+            return None
+        if api_version <= 28 and type(shared_file) == str:
             root_directory = self._get_legacy_storage_location()
             if root_directory == None:
                 return None
-            sub_directory = root_directory
-            for d in path:
-                sub_directory = join(sub_directory,d) 
-                if not exists(sub_directory):
-                    mkdir(sub_directory)
-            public_path = join(sub_directory, file_name)
-            self.delete_shared(public_path)
-            copyfile(private_file, public_path)
-            return public_path
-
-    
-    def copy_from_shared(self, shared_file):
-        if shared_file == None:
+            path = join(root_directory, shared_file)
+            if 'r' in mode and not exists(path):
+                return None
+            try:
+                f = open(path, mode)
+                if not mmap:
+                    return f
+                with f:
+                    return self._mmap(f.fileno(), mode)
+            except Exception as e:
+                Logger.warning('SharedStorage.open_shared():')
+                Logger.warning(str(e))
+                return None
+        uri = self._get_uri(shared_file)
+        if not uri:
+            return None
+        fd = None
+        try:
+            try:
+                cr = get_session().resolver
+                pfd = cr.openFileDescriptor(\
+                    uri, FILE_DESCRIPTOR_MODES[mode])
+            except:
+                self._uncache_uri(uri)
+                raise
+            if not pfd:
+                return None
+            # The Python file (or mmap) now owns the fd
+            fd = pfd.detachFd()
+            pfd.close()
+            if not mmap:
+                f = fdopen(fd, mode)
+                fd = None
+                return f
+            return self._mmap(fd, mode)
+        except Exception as e:
+            Logger.warning('SharedStorage.open_shared():')
+            Logger.warning(str(e))
             return None
+        finally:
+            # mmap has its own reference to the file
+            if fd != None:
+                close(fd)
+
+    # A generator of SharedFileInfo, for the files this app has in a
+    # collection (optionally in subpath of the app's directory, including
+    # sub directories). On Android >= 10 the MediaStore is queried
+    # page_size rows at a time.
+    # sort_order is 'name', 'date_modified', or 'size'.
+    def list_shared(self, collection, subpath = None, page_size = 100,
+                    sort_order = 'name', descending = False):
+        if collection == None or sort_order not in SORT_COLUMNS:
+            return
+        base = join(collection, self.get_app_title())
+        if subpath:
+            base = join(base, subpath.strip('/'))
         if api_version > 28:
-            uri = self._get_uri(shared_file)
-            cache_file = self._copy_uri_to_cache(uri)
+            yield from self._list_shared_uris(collection, base,
+                                              max(1, page_size),
+                                              sort_order, descending)
         else:
-            if type(shared_file) == str:
-                cache_file = self._copy_file_to_cache(shared_file)
-            else:
-                cache_file = self._copy_uri_to_cache(shared_file)
-        return cache_file
+            yield from self._list_shared_files(base, sort_order, descending)
 
+    @metrics.measure('delete_shared')
     def delete_shared(self, shared_file):
         if shared_file == None:
             return False
@@ -119,27 +274,268 @@ class SharedStorage:
             uri = self._get_uri(shared_file)
             if not uri:
                 return False
-            context = mActivity.getApplicationContext()
             try:
-                return context.getContentResolver().delete(uri,None,None) == 1
+                cr = get_session().resolver
+                deleted = cr.delete(uri,None,None) == 1
             except:
                 Logger.info('File delete permission not granted, ignored.')
                 return False
+            self._uncache_uri(uri)
+            return deleted
         elif type(shared_file) == str:
             path = join(self._get_legacy_storage_location(), shared_file)
+            self._uri_cache.pop(shared_file)
             if exists(path):
                 remove(path)
                 return True
         return False
 
 
+    # Delete several shared files, on Android >= 10 with one MediaStore
+    # query and one delete per collection (per MAX_SQL_ARGS files).
+    # Returns {shared_file : status}, uri keys are uri strings.
+    # status is 'deleted', 'not_found', 'failed', 'not_permitted' (Android
+    # 10, the file is not owned by this app), or 'requested' (Android >= 11,
+    # the user is asked to confirm the delete of files not owned by this
+    # app). callback(confirmed) is called on the Kivy main thread when the
+    # user answers.
+    @metrics.measure('delete_shared_many')
+    def delete_shared_many(self, shared_files, callback = None):
+        report = {}
+        if not shared_files:
+            return report
+        if api_version <= 28:
+            for shared_file in shared_files:
+                if shared_file == None:
+                    continue
+                key = self._report_key(shared_file)
+                if type(shared_file) == str and not exists(join(
+                        self._get_legacy_storage_location(), shared_file)):
+                    report[key] = 'not_found'
+                else:
+                    report[key] = 'deleted' if self.delete_shared(shared_file)\
+                        else 'failed'
+            return report
+        cr = get_session().resolver
+        # root uri string : {'root_uri', 'ids' : {id : key},
+        #                    'locations' : {relative_path : {name : key}}}
+        groups = {}
+        for shared_file in shared_files:
+            if shared_file == None:
+                continue
+            key = self._report_key(shared_file)
+            report[key] = 'not_found'
+            uri = None
+            if type(shared_file) == str:
+                uri = self._uri_cache.get(shared_file)
+            else:
+                uri = self._get_uri(shared_file)
+                if not uri:
+                    continue
+            if uri:
+                root_string = uri.toString().rsplit('/', 1)[0]
+                group = self._delete_group(groups, root_string)
+                group['ids'][ContentUris.parseId(uri)] = key
+            else:
+                path = shared_file.split('/')
+                root_uri = self._get_root_uri(path[0],
+                    self.get_file_MIME_type(path[-1]))
+                group = self._delete_group(groups, root_uri.toString(),
+                                           root_uri)
+                location = '/'.join(path[:-1]) + '/'
+                group['locations'].setdefault(location, {})[path[-1]] = key
+        foreign = []
+        for group in groups.values():
+            rows = self._find_delete_rows(cr, group)
+            self._delete_rows(cr, group['root_uri'], rows, report, foreign)
+        self._request_delete(foreign, report, callback)
+        return report
+
+    # Delete the files this app has in a collection (optionally in subpath
+    # of the app's directory), including sub directories.
+    # On Android >= 10 with one MediaStore query and one delete.
+    # Returns {path : status}, path and status as list_shared() and
+    # delete_shared_many().
+    @metrics.measure('delete_shared_tree')
+    def delete_shared_tree(self, collection, subpath = None, callback = None):
+        report = {}
+        if collection == None:
+            return report
+        base = join(collection, self.get_app_title())
+        if subpath:
+            base = join(base, subpath.strip('/'))
+        if api_version <= 28:
+            return self._delete_legacy_tree(base)
+        root_uri = self._get_collection_root_uri(collection)
+        selection, args = mediastore.like_subtree(base)
+        cr = get_session().resolver
+        try:
+            rows = mediastore.query(cr, root_uri,
+                                    [mediastore.ID, mediastore.DISPLAY_NAME,
+                                     mediastore.RELATIVE_PATH,
+                                     mediastore.OWNER_PACKAGE_NAME],
+                                    selection, args)
+        except Exception as e:
+            Logger.warning('SharedStorage.delete_shared_tree():')
+            Logger.warning(str(e))
+            return report
+        rows = [(join(relative_path.rstrip('/'), name), id, owner)
+                for id, name, relative_path, owner in rows]
+        foreign = []
+        self._delete_rows(cr, root_uri, rows, report, foreign,
+                          selection, args)
+        self._request_delete(foreign, report, callback)
+        return report
+
+    # Make the app's directory in a collection (optionally subpath of it)
+    # a copy of private_dir, including sub directories.
+    # The shared side is listed once, and compared with the private files.
+    # Only new and changed files are copied, by up to max_workers threads.
+    # If delete_extraneous, shared files that are not in private_dir are
+    # deleted (see delete_shared_many(), for callback).
+    # Files with a MIME type that does not belong in collection are ignored.
+    # Returns {'copied' : [], 'unchanged' : [], 'deleted' : [],
+    #          'delete_requested' : [], 'failed' : [], 'ignored' : []}
+    # of paths relative to private_dir (or for deletes, to subpath).
+    @metrics.measure('sync_tree')
+    def sync_tree(self, private_dir, collection, subpath = None,
+                  delete_extraneous = False, max_workers = 2,
+                  callback = None):
+        summary = {'copied' : [], 'unchanged' : [], 'deleted' : [],
+                   'delete_requested' : [], 'failed' : [], 'ignored' : []}
+        if collection == None or private_dir == None or\
+           not exists(private_dir):
+            return summary
+        prefix = subpath.strip('/') + '/' if subpath else ''
+        base = join(collection, self.get_app_title(), prefix).rstrip('/')
+        try:
+            shared = self._list_sync_tree(collection, base)
+        except Exception as e:
+            Logger.warning('SharedStorage.sync_tree():')
+            Logger.warning(str(e))
+            return summary
+        cr = None
+        if api_version > 28:
+            cr = get_session().resolver
+
+        # Compare
+        changed = []
+        local = set()
+        legal = {}
+        with self._export_batch():
+            for path, private_file in self._scan_tree(private_dir):
+                local.add(path)
+                MIME_type = self.get_file_MIME_type(basename(path))
+                if MIME_type not in legal:
+                    legal[MIME_type] = self._legal_collection(
+                        self._get_auto_collection(MIME_type), collection)
+                if not legal[MIME_type]:
+                    summary['ignored'].append(path)
+                    continue
+                if path in shared:
+                    shared_file, key, version = shared[path]
+                    if self._sync_unchanged(cr, shared_file, key,
+                                            private_file, version):
+                        summary['unchanged'].append(path)
+                        continue
+                    if api_version > 28:
+                        # Found, no query to find it again
+                        self._uri_cache.put(key, shared_file)
+                changed.append((path, private_file))
+
+            # Copy
+            results = self._sync_copy([(private_file, prefix + path)
+                                       for path, private_file in changed],
+                                      collection, max(1, max_workers))
+        for (path, private_file), result in zip(changed, results):
+            summary['copied' if result else 'failed'].append(path)
+
+        # Delete
+        if delete_extraneous:
+            extraneous = [path for path in shared if path not in local]
+            report = self.delete_shared_many(
+                [shared[path][0] for path in extraneous], callback)
+            for path in extraneous:
+                status = report.get(self._report_key(shared[path][0]))
+                if status == 'deleted':
+                    summary['deleted'].append(path)
+                elif status == 'requested':
+                    summary['delete_requested'].append(path)
+                else:
+                    summary['failed'].append(path)
+        return summary
+
+    # A preview of an image or video (Android >= 10, also the album art of
+    # audio) without copying the file. Returns the path of a JPEG, or if
+    # format is 'png' a PNG, no more than size pixels wide or high, in
+    # the thumbnail cache. Else None.
+    @metrics.measure('get_thumbnail')
+    @scheduler.scheduled('prefetch')
+    def get_thumbnail(self, shared_file, size = 256, format = 'jpeg'):
+        thumbnail_dir = self._get_thumbnail_dir()
+        if not thumbnail_dir:
+            return None
+        cr = get_session().resolver
+        try:
+            source = self._media_source(cr, shared_file)
+        except Exception as e:
+            Logger.warning('SharedStorage.get_thumbnail():')
+            Logger.warning(str(e))
+            return None
+        if not source:
+            return None
+        extension = '.png' if format == 'png' else '.jpg'
+        file_name = splitext(source['name'])[0] + extension
+        # The cache file's size is not the source's size, so the source
+        # is identified by date_modified and generation
+        date_modified, generation = source['version']
+
+        def write_thumbnail(temp_file):
+            thumbnails.write_thumbnail(cr, source, size, format, temp_file)
+            if metrics.measuring():
+                metrics.add_bytes(getsize(temp_file))
+
+        return self._fill_cache(thumbnail_dir,
+                                source['key'] + '#' + str(size) + extension,
+                                file_name, None, date_modified, generation,
+                                write_thumbnail,
+                                self.thumbnail_cache_max_bytes,
+                                operation = 'get_thumbnail')
+
+    # What the MediaStore (Android < 10, the file system) knows of a
+    # shared file, and the dimensions and duration of media, without
+    # copying the file. Returns {'name', 'size', 'MIME_type',
+    # 'date_modified', 'date_taken', 'width', 'height', 'duration'}
+    # with None for a value that is not known, or None.
+    @metrics.measure('get_metadata')
+    def get_metadata(self, shared_file):
+        cr = get_session().resolver
+        try:
+            source = self._media_source(cr, shared_file)
+        except Exception as e:
+            Logger.warning('SharedStorage.get_metadata():')
+            Logger.warning(str(e))
+            return None
+        if not source:
+            return None
+        metadata = {key : source[key] for key in METADATA_KEYS}
+        try:
+            thumbnails.read_metadata(cr, source, metadata)
+        except Exception as e:
+            # Not media, or not a format Android reads
+            Logger.warning('SharedStorage.get_metadata():')
+            Logger.warning(str(e))
+        return metadata
+
     ###################
     # Public utilities
     ###################
 
     def get_cache_dir(self):
-        context = mActivity.getApplicationContext()
-        result =  context.getExternalCacheDir()
+        new_file_loc = self._memoized.get('cache_dir')
+        if new_file_loc:
+            return new_file_loc
+        result =  get_session().context.getExternalCacheDir()
         if not result:
             return None
         new_file_loc =  str(result.toString())
@@ -148,15 +544,49 @@ class SharedStorage:
         new_file_loc = join(new_file_loc,"FromSharedStorage")
         if not exists(new_file_loc):
             mkdir(new_file_loc)
+        self._memoized['cache_dir'] = new_file_loc
         return new_file_loc
     
+    # Abandon the interrupted resumable copies, and remove their partial
+    # files. Returns the number of copies abandoned.
+    def discard_checkpoints(self):
+        cache_dir = self.get_cache_dir()
+        if not cache_dir:
+            return 0
+        checkpoints = get_checkpoints(cache_dir)
+        keys = checkpoints.keys()
+        for key in keys:
+            checkpoint = checkpoints.get(key)
+            if checkpoint:
+                self._remove_partial(checkpoint['destination'])
+            checkpoints.discard(key)
+        return len(keys)
+
+    # How many MediaStore queries the uri cache saved
+    def get_uri_cache_stats(self):
+        return self._uri_cache.stats()
+
+    def clear_uri_cache(self):
+        self._uri_cache.clear()
+
+    # The app title, cache directory, legacy storage location, and MIME
+    # types are looked up once. Call this if one of these changes,
+    # for example if external storage is remounted.
+    def clear_memoized(self):
+        self._memoized.clear()
+        self._MIME_cache.clear()
+
     def get_app_title(self):
-        context = mActivity.getApplicationContext()
+        name = self._memoized.get('app_title')
+        if name:
+            return name
+        context = get_session().context
         appinfo = context.getApplicationInfo()
         if appinfo.labelRes:
             name = context.getString(appinfo.labelRes)
         else:
             name = appinfo.nonLocalizedLabel.toString()
+        self._memoized['app_title'] = name
         return name
 
     def get_file_MIME_type(self,file_name):
@@ -168,8 +598,12 @@ class SharedStorage:
                 file_ext_no_dot = file_ext[1:]
             if file_ext_no_dot:
                 lower_ext  = file_ext_no_dot.lower()
-                mtm = MimeTypeMap.getSingleton()
-                MIME_type = mtm.getMimeTypeFromExtension(lower_ext)
+                # '' is a remembered unknown extension
+                MIME_type = self._MIME_cache.get(lower_ext)
+                if MIME_type == None:
+                    mtm = MimeTypeMap.getSingleton()
+                    MIME_type = mtm.getMimeTypeFromExtension(lower_ext)
+                    self._MIME_cache.put(lower_ext, MIME_type or '')
                 if not MIME_type:
                     MIME_type = 'application/' + file_ext_no_dot
         except Exception as e:
@@ -185,29 +619,1426 @@ class SharedStorage:
         root, ext = MIME_type.split('/')
         root = root.lower()
         if root == 'image':
-            root_dir = Environment.DIRECTORY_PICTURES
+            root_dir = self._directory('PICTURES')
         elif root == 'video':
-            root_dir = Environment.DIRECTORY_MOVIES
+            root_dir = self._directory('MOVIES')
         elif root == 'audio':
-            root_dir = Environment.DIRECTORY_MUSIC
+            root_dir = self._directory('MUSIC')
         else:
-            root_dir = Environment.DIRECTORY_DOCUMENTS
+            root_dir = self._directory('DOCUMENTS')
         return root_dir
 
+    # Environment.DIRECTORY_<name>
+    def _directory(self, name):
+        return get_session().static(Environment, 'DIRECTORY_' + name)
+
+    @metrics.measure('copy_many_to_shared')
+    @scheduler.scheduled('bulk')
+    def _copy_many_to_shared(self, files, collection, skipped = None):
+        if files == None:
+            return []
+        if api_version <= 28:
+            results = []
+            for f in files:
+                private_file, filepath = self._split_file_item(f)
+                results.append(self._copy_to_shared(private_file, collection,
+                                                    filepath,
+                                                    skipped = skipped))
+            return results
+
+        results = [None] * len(files)
+        # Each shared file is a target, if several files have the same
+        # target the last one wins (as with sequential copy_to_shared()).
+        groups = {}
+        targets = {}
+        for i, f in enumerate(files):
+            private_file, filepath = self._split_file_item(f)
+            if private_file == None or not exists(private_file):
+                continue
+            file_name, MIME_type, path =\
+                self._get_shared_path(private_file, collection, filepath)
+            sub_directory = ''
+            for d in path:
+                sub_directory = join(sub_directory,d)
+            root_uri = self._get_root_uri(path[0], MIME_type)
+            root_key = root_uri.toString()
+            key = (root_key, sub_directory, file_name)
+            if key in targets:
+                target = targets[key]
+                target['private_file'] = private_file
+                target['MIME_type'] = MIME_type
+                target['indexes'].append(i)
+                continue
+            target = {'indexes' : [i],
+                      'shared_file' : join(sub_directory, file_name),
+                      'private_file' : private_file,
+                      'file_name' : file_name,
+                      'MIME_type' : MIME_type,
+                      'sub_directory' : sub_directory,
+                      'root_uri' : root_uri,
+                      'uri' : None,
+                      'inserted' : False,
+                      'skipped' : False,
+                      'failed' : False}
+            targets[key] = target
+            groups.setdefault(root_key, []).append(target)
+        cr = get_session().resolver
+
+        # Find existing shared files, one query per collection directory
+        for group in groups.values():
+            for target in group:
+                target['uri'] = self._uri_cache.get(target['shared_file'])
+            uncached = [t for t in group if t['uri'] == None]
+            if not uncached:
+                continue
+            try:
+                self._get_many_uris(cr, uncached)
+            except Exception as e:
+                Logger.warning('SharedStorage.copy_many_to_shared():')
+                Logger.warning(str(e))
+                # Never insert a file that may already exist
+                for target in uncached:
+                    try:
+                        target['uri'] = self._get_uri(target['shared_file'])
+                    except Exception:
+                        target['failed'] = True
+
+        # Create the missing shared files, in one batch
+        missing = [t for t in targets.values()
+                   if t['uri'] == None and not t['failed']]
+        if missing:
+            operations = ArrayList()
+            for target in missing:
+                operations.add(ContentProviderOperation.\
+                               newInsert(target['root_uri']).\
+                               withValues(self._content_values(target)).\
+                               build())
+            authority = get_session().static(MediaStore, 'AUTHORITY')
+            try:
+                batch = cr.applyBatch(authority, operations)
+                for target, result in zip(missing, batch):
+                    target['uri'] = result.uri
+                    target['inserted'] = True
+            except Exception as e:
+                Logger.warning('SharedStorage.copy_many_to_shared():')
+                Logger.warning(str(e))
+                self._insert_each(cr, groups, missing)
+
+        if skipped != None:
+            self._skip_unchanged_targets(cr, groups, skipped)
+
+        # Copy the file contents
+        for target in targets.values():
+            if target['skipped']:
+                uri = target['uri']
+            else:
+                uri = self._write_target(cr, target)
+                target['written'] = uri != None
+            if uri:
+                for i in target['indexes']:
+                    results[i] = uri
+        if skipped != None:
+            self._record_targets(cr, groups)
+        return results
+
+    # monitor (optional) reports progress, and cancels a copy.
+    # It is a TransferJob, see transferengine.py
+    # If skipped is a list, an unchanged file is not written and is
+    # added to skipped.
+    @metrics.measure('copy_to_shared')
+    @scheduler.scheduled('bulk')
+    def _copy_to_shared(self, private_file, collection, filepath,
+                        monitor = None, skipped = None):
+        if private_file == None or not exists(private_file):
+            return None
+        file_name, MIME_type, path =\
+            self._get_shared_path(private_file, collection, filepath)
+
+        if api_version > 28:
+            sub_directory = ''
+            for d in path:
+                sub_directory = join(sub_directory,d)
+            shared_file = join(sub_directory, file_name)
+            uri = self._get_uri(shared_file)
+            try:
+                cr = get_session().resolver
+                if skipped != None and uri and\
+                   self._uri_unchanged(cr, uri, shared_file, private_file):
+                    skipped.append(private_file)
+                    return uri
+                ws = None
+                if uri:
+                    try:
+                        ws  = cr.openOutputStream(uri,"rwt")
+                    except:
+                        Logger.info('File replace permission not granted.')
+                        Logger.info('A new file version will be created.')
+                        self._uri_cache.pop(shared_file)
+                        uri = None
+                if not ws:
+                    cv = ContentValues()
+                    cv.put(mediastore.DISPLAY_NAME[0], file_name)
+                    cv.put(mediastore.MIME_TYPE[0], MIME_type)  
+                    cv.put(mediastore.RELATIVE_PATH[0], sub_directory)
+                    root_uri = self._get_root_uri(path[0], MIME_type)
+                    uri = cr.insert(root_uri, cv)
+                    ws  = cr.openOutputStream(uri)
+                    self._uri_cache.put(shared_file, uri)
+                # copy file contents
+                if monitor:
+                    monitor.set_total(getsize(private_file))
+                rs = FileInputStream(private_file)
+                self._copy_stream(rs, ws, monitor)
+                ws.flush()
+                ws.close()
+                rs.close()
+                if skipped != None:
+                    self._record_export(shared_file, private_file,
+                                        self._uri_version(cr, uri))
+            except Exception as e:
+                if not (monitor and monitor.cancelled):
+                    Logger.warning('SharedStorage.copy_to_shared():')
+                    Logger.warning(str(e))
+                elif uri:
+                    # Don't leave a truncated shared file
+                    try:
+                        cr.delete(uri, None, None)
+                    except Exception:
+                        pass
+                    self._uri_cache.pop(shared_file)
+                uri = None
+            return uri
+        else:
+            sub_directory = self._make_legacy_directory(path)
+            if sub_directory == None:
+                return None
+            public_path = join(sub_directory, file_name)
+            if skipped != None and exists(public_path) and\
+               self._unchanged(public_path, private_file,
+                               self._file_version(public_path),
+                               lambda: open(public_path, 'rb')):
+                skipped.append(private_file)
+                return public_path
+            self.delete_shared(public_path)
+            try:
+                self._copy_file(private_file, public_path, monitor)
+            except Exception as e:
+                if not (monitor and monitor.cancelled):
+                    Logger.warning('SharedStorage.copy_to_shared():')
+                    Logger.warning(str(e))
+                if exists(public_path):
+                    remove(public_path)
+                return None
+            if skipped != None:
+                self._record_export(public_path, private_file,
+                                    self._file_version(public_path))
+            return public_path
+
+    # The file is written to a new row inserted with IS_PENDING, so other
+    # apps don't see it until it is complete. An existing file is only
+    # replaced when the new one is published.
+    @contextmanager
+    def _create_shared_uri(self, file_name, MIME_type, path):
+        shared_file = join(*path, file_name)
+        cr = get_session().resolver
+        uri = None
+        try:
+            uri = self._insert_pending(cr, file_name, MIME_type, path)
+            pfd = cr.openFileDescriptor(uri, "w")
+            fd = pfd.detachFd()
+            pfd.close()
+            f = fdopen(fd, 'wb')
+            f.shared_file = None
+        except Exception as e:
+            Logger.warning('SharedStorage.create_shared():')
+            Logger.warning(str(e))
+            if uri:
+                self._delete_uri(cr, uri)
+            yield None
+            return
+        try:
+            yield f
+            f.close()
+            self._publish_pending(cr, uri, shared_file, file_name)
+            f.shared_file = uri
+        except:
+            if not f.closed:
+                f.close()
+            # Never publish a partial file
+            self._delete_uri(cr, uri)
+            raise
+
+    # A new row for a shared file, pending until _publish_pending()
+    def _insert_pending(self, cr, file_name, MIME_type, path):
+        cv = ContentValues()
+        cv.put(mediastore.DISPLAY_NAME[0], file_name)
+        cv.put(mediastore.MIME_TYPE[0], MIME_type)
+        cv.put(mediastore.RELATIVE_PATH[0], join(*path))
+        cv.put(mediastore.IS_PENDING[0], Integer.valueOf(1))
+        root_uri = self._get_root_uri(path[0], MIME_type)
+        return cr.insert(root_uri, cv)
+
+    # Publish a pending row as shared_file. Then the file it replaces is
+    # deleted, and the new row (the MediaStore named it " (N)") is given
+    # its name. If the old file can't be deleted, the new one is a new
+    # file version. The old file is not changed until the new one is
+    # published, so a failed copy never loses it.
+    def _publish_pending(self, cr, uri, shared_file, file_name):
+        old_uri = self._get_uri(shared_file)
+        cv = ContentValues()
+        cv.put(mediastore.IS_PENDING[0], Integer.valueOf(0))
+        cr.update(uri, cv, None, None)
+        self._uri_cache.put(shared_file, uri)
+        if not old_uri or old_uri.toString() == uri.toString():
+            return
+        try:
+            cr.delete(old_uri, None, None)
+        except Exception:
+            Logger.info('File replace permission not granted.')
+            Logger.info('A new file version was created.')
+            return
+        try:
+            cv = ContentValues()
+            cv.put(mediastore.DISPLAY_NAME[0], file_name)
+            cr.update(uri, cv, None, None)
+        except Exception as e:
+            Logger.info('SharedStorage: the new file version was not renamed.')
+            Logger.info(str(e))
+
+    # Written to a temporary file, renamed when complete.
+    @contextmanager
+    def _create_shared_file(self, file_name, path):
+        try:
+            sub_directory = self._make_legacy_directory(path)
+            if sub_directory == None:
+                yield None
+                return
+            public_path = join(sub_directory, file_name)
+            temp_path = public_path + '.pending'
+            f = open(temp_path, 'wb')
+            f.shared_file = None
+        except Exception as e:
+            Logger.warning('SharedStorage.create_shared():')
+            Logger.warning(str(e))
+            yield None
+            return
+        try:
+            yield f
+            f.close()
+            replace(temp_path, public_path)
+            f.shared_file = public_path
+        except:
+            if not f.closed:
+                f.close()
+            if exists(temp_path):
+                remove(temp_path)
+            raise
+
+    def _delete_uri(self, cr, uri):
+        try:
+            cr.delete(uri, None, None)
+        except Exception:
+            pass
+
+    @metrics.measure('copy_from_shared')
+    @scheduler.scheduled('interactive')
+    def _copy_from_shared(self, shared_file, monitor = None):
+        if shared_file == None:
+            return None
+        if api_version > 28:
+            cache_file = self._with_uri(shared_file, lambda uri:
+                                        self._copy_uri_to_cache(uri, monitor))
+        else:
+            if type(shared_file) == str:
+                cache_file = self._copy_file_to_cache(shared_file, monitor)
+            else:
+                cache_file = self._copy_uri_to_cache(shared_file, monitor)
+        return cache_file
+
+    # Returns the number of bytes copied, -1 if not known
+    def _copy_stream(self, rs, ws, monitor = None):
+        monitor = scheduler.get_scheduler().throttled(monitor)
+        if api_version > 28:
+            # fastest
+            metrics.set_copy_path('FileUtils')
+            if monitor:
+                total = FileUtils.copy(rs, ws, monitor.signal,
+                                       monitor.executor, monitor.listener)
+            else:
+                total = FileUtils.copy(rs,ws)
+        elif get_stream_copy():
+            # pretty fast, progress is only known at the end
+            metrics.set_copy_path('StreamCopy')
+            if monitor:
+                monitor.check_cancelled()
+            get_stream_copy()(rs, ws) 
+            if monitor:
+                monitor.set_progress(monitor.total_bytes)
+            return -1
+        else:
+            # slow, only used if a file descriptor is not available
+            metrics.set_copy_path('java_loop')
+            jbytes = bytearray(self.copy_buffer_size)
+            total = 0
+            while True:
+                if monitor:
+                    monitor.check_cancelled()
+                num = rs.read(jbytes) 
+                if num == -1:
+                    break
+                ws.write(jbytes, 0, num)
+                total += num
+                if monitor:
+                    monitor.set_progress(total)
+        metrics.add_bytes(total)
+        return total
+
+    def _copy_file(self, source, destination, monitor = None):
+        monitor = scheduler.get_scheduler().throttled(monitor)
+        if not monitor:
+            copyfile(source, destination)
+            if metrics.measuring():
+                metrics.set_copy_path('shutil')
+                metrics.add_bytes(getsize(destination))
+            return
+        monitor.set_total(getsize(source))
+        with open(source, 'rb') as rs, open(destination, 'wb') as ws:
+            self._copy_fd(rs.fileno(), ws.fileno(), monitor)
+
+    # Copy between two OS file descriptors, from their current positions
+    def _copy_fd(self, in_fd, out_fd, monitor = None):
+        monitor = scheduler.get_scheduler().throttled(monitor)
+        total = 0
+        use_sendfile = sendfile != None
+        buffer_size = self.copy_buffer_size
+        metrics.set_copy_path('sendfile' if use_sendfile else 'read_write')
+        while True:
+            if monitor:
+                monitor.check_cancelled()
+            if use_sendfile:
+                # In kernel copy, not available for some providers (pipes)
+                try:
+                    num = sendfile(out_fd, in_fd, None, buffer_size)
+                except OSError:
+                    use_sendfile = False
+                    metrics.set_copy_path('read_write')
+                    continue
+            else:
+                data = read(in_fd, buffer_size)
+                num = len(data)
+                view = memoryview(data)
+                while view:
+                    view = view[write(out_fd, view):]
+            if num == 0:
+                break
+            total += num
+            if monitor:
+                monitor.set_progress(total)
+        metrics.add_bytes(total)
+
+    ###################
+    # Thumbnails and metadata
+    ###################
+
+    # get_thumbnail() files, next to cache_dir
+    def _get_thumbnail_dir(self):
+        thumbnail_dir = self._memoized.get('thumbnail_dir')
+        if thumbnail_dir:
+            return thumbnail_dir
+        cache_dir = self.get_cache_dir()
+        if not cache_dir:
+            return None
+        thumbnail_dir = join(dirname(cache_dir), 'Thumbnails')
+        makedirs(thumbnail_dir, exist_ok = True)
+        self._memoized['thumbnail_dir'] = thumbnail_dir
+        return thumbnail_dir
+
+    # A shared file's uri (Android < 10, perhaps its path) and what the
+    # MediaStore has of it, from one query.
+    # Returns a dict of METADATA_KEYS, and 'uri', 'path', 'key' (the cache
+    # key), and 'version' (date_modified, generation). Or None.
+    def _media_source(self, cr, shared_file):
+        if shared_file == None:
+            return None
+        if api_version > 28:
+            return self._with_uri(shared_file, lambda uri:
+                                  self._uri_media_source(cr, uri))
+        elif type(shared_file) == str:
+            path = join(self._get_legacy_storage_location(), shared_file)
+        else:
+            uri = cast('android.net.Uri', shared_file)
+            if uri.getScheme().lower() != 'file':
+                return self._uri_media_source(cr, uri)
+            path = uri.getPath()
+        if not exists(path):
+            return None
+        st = stat(path)
+        source = dict.fromkeys(METADATA_KEYS + ['uri', 'path'])
+        source.update({'path' : path,
+                       'key' : path,
+                       'name' : basename(path),
+                       'MIME_type' : self.get_file_MIME_type(path),
+                       'size' : st.st_size,
+                       'date_modified' : int(st.st_mtime),
+                       'version' : (st.st_mtime, None)})
+        return source
+
+    def _uri_media_source(self, cr, uri):
+        if not uri:
+            return None
+        columns = [column for key, column in METADATA_COLUMNS]
+        if api_version < 29:
+            columns = columns[:4]
+        if api_version > 29:
+            columns.append(mediastore.GENERATION_MODIFIED)
+        try:
+            rows = mediastore.query(cr, uri, columns, max_rows = 1)
+        except Exception:
+            # Not every provider has every column
+            columns = columns[:2]
+            rows = mediastore.query(cr, uri, columns, max_rows = 1)
+        if not rows:
+            self._uncache_uri(uri)
+            return None
+        source = dict.fromkeys(METADATA_KEYS + ['uri', 'path'])
+        values = dict(zip([name for name, kind in columns], rows[0]))
+        for key, (name, kind) in METADATA_COLUMNS:
+            source[key] = values.get(name)
+        source.update({'uri' : uri,
+                       'key' : uri.toString(),
+                       'version' : (source['date_modified'], values.get(
+                           mediastore.GENERATION_MODIFIED[0]))})
+        if not source['MIME_type']:
+            source['MIME_type'] = self.get_file_MIME_type(source['name'])
+        return source
+
+    ###################
+    # Skip unchanged
+    ###################
+
+    # A shared file's [size, date_modified, generation]
+    def _uri_version(self, cr, uri):
+        columns = [mediastore.SIZE, mediastore.DATE_MODIFIED]
+        if api_version > 29:
+            columns.append(mediastore.GENERATION_MODIFIED)
+        rows = mediastore.query(cr, uri, columns, max_rows = 1)
+        if not rows:
+            return None
+        return (rows[0] + [None])[:3]
+
+    def _file_version(self, path):
+        st = stat(path)
+        return [st.st_size, st.st_mtime, None]
+
+    # {id : version} for ids in root_uri, one query per MAX_SQL_ARGS ids
+    def _query_versions(self, cr, root_uri, ids):
+        columns = [mediastore.ID, mediastore.SIZE, mediastore.DATE_MODIFIED]
+        if api_version > 29:
+            columns.append(mediastore.GENERATION_MODIFIED)
+        versions = {}
+        for selection, args in mediastore.in_chunks(mediastore.ID, ids):
+            for row in mediastore.query(cr, root_uri, columns, selection,
+                                        args):
+                versions[row[0]] = (row[1:] + [None])[:3]
+        return versions
+
+    def _uri_unchanged(self, cr, uri, key, private_file):
+        try:
+            version = self._uri_version(cr, uri)
+        except Exception:
+            return False
+
+        return self._unchanged(key, private_file, version,
+                               lambda: self._open_uri_reader(cr, uri))
+
+    def _open_uri_reader(self, cr, uri):
+        pfd = cr.openFileDescriptor(uri, 'r')
+        fd = pfd.detachFd()
+        pfd.close()
+        return fdopen(fd, 'rb')
+
+    # True if the shared file (key) has the private file's contents.
+    # The sizes are compared, then if the export index says neither file
+    # changed since the last export there is no more I/O. Else the hash
+    # of the private file is compared with the index, or if the index
+    # has no entry, with the hash of the shared file.
+    def _unchanged(self, key, private_file, version, open_shared):
+        cache_dir = self.get_cache_dir()
+        if not cache_dir or not version:
+            return False
+        st = stat(private_file)
+        if version[0] != st.st_size:
+            return False
+        index = get_export_index(cache_dir)
+        entry = index.get(key)
+        try:
+            private_hash = None
+            if entry and entry['shared'] == version:
+                if entry['private'] == [st.st_size, st.st_mtime]:
+                    return True
+                private_hash = self._export_hash(private_file)
+                same = private_hash == entry['hash']
+            else:
+                private_hash = self._export_hash(private_file)
+                with open_shared() as f:
+                    same = private_hash == self._export_hash_stream(f)
+        except Exception as e:
+            Logger.warning('SharedStorage.copy_to_shared():')
+            Logger.warning(str(e))
+            return False
+        if same:
+            index.put(key, {'private' : [st.st_size, st.st_mtime],
+                            'shared' : version,
+                            'hash' : private_hash})
+        return same
+
+    def _record_export(self, key, private_file, version):
+        cache_dir = self.get_cache_dir()
+        if not cache_dir or not version:
+            return
+        get_export_index(cache_dir).put(key,
+                                        self._export_entry(private_file,
+                                                           version))
+
+    def _export_entry(self, private_file, version):
+        st = stat(private_file)
+        return {'private' : [st.st_size, st.st_mtime],
+                'shared' : version,
+                'hash' : self._export_hash(private_file)}
+
+    # copy_many_to_shared(), one query per collection for the versions
+    def _skip_unchanged_targets(self, cr, groups, skipped):
+        for group in groups.values():
+            existing = [t for t in group
+                        if t['uri'] and not t['inserted'] and not t['failed']]
+            if not existing:
+                continue
+            try:
+                versions = self._query_versions(
+                    cr, group[0]['root_uri'],
+                    [ContentUris.parseId(t['uri']) for t in existing])
+            except Exception as e:
+                Logger.warning('SharedStorage.copy_many_to_shared():')
+                Logger.warning(str(e))
+                continue
+            for target in existing:
+                uri = target['uri']
+                if self._unchanged(target['shared_file'],
+                                   target['private_file'],
+                                   versions.get(ContentUris.parseId(uri)),
+                                   lambda uri = uri:
+                                       self._open_uri_reader(cr, uri)):
+                    target['skipped'] = True
+                    skipped.append(target['private_file'])
+
+    # After copy_many_to_shared() writes, one query per collection
+    def _record_targets(self, cr, groups):
+        cache_dir = self.get_cache_dir()
+        if not cache_dir:
+            return
+        entries = {}
+        for group in groups.values():
+            written = [t for t in group if t.get('written')]
+            if not written:
+                continue
+            try:
+                versions = self._query_versions(
+                    cr, group[0]['root_uri'],
+                    [ContentUris.parseId(t['uri']) for t in written])
+                for target in written:
+                    version = versions.get(ContentUris.parseId(target['uri']))
+                    if version:
+                        entries[target['shared_file']] = self._export_entry(
+                            target['private_file'], version)
+            except Exception as e:
+                Logger.warning('SharedStorage.copy_many_to_shared():')
+                Logger.warning(str(e))
+        get_export_index(cache_dir).put_many(entries)
+
+    # Save the export index once, for many files
+    def _export_batch(self):
+        cache_dir = self.get_cache_dir()
+        if not cache_dir:
+            return nullcontext()
+        return get_export_index(cache_dir).batch()
+
+    def _export_hash(self, file_path):
+        with open(file_path, 'rb') as f:
+            return self._export_hash_stream(f)
+
+    # Fast, not cryptographic
+    def _export_hash_stream(self, f):
+        hash = blake2b(digest_size = 16)
+        while True:
+            data = f.read(self.copy_buffer_size)
+            if not data:
+                break
+            hash.update(data)
+        return hash.hexdigest()
+
+    ###################
+    # Delete many
+    ###################
+
+    def _report_key(self, shared_file):
+        if type(shared_file) == str:
+            return shared_file
+        return cast('android.net.Uri', shared_file).toString()
+
+    def _delete_group(self, groups, root_string, root_uri = None):
+        if root_string not in groups:
+            groups[root_string] = {'root_uri' : root_uri or
+                                   Uri.parse(root_string),
+                                   'ids' : {}, 'locations' : {}}
+        return groups[root_string]
+
+    # Returns a list of (key, id, owner) for the files in group,
+    # one query per MAX_SQL_ARGS ids and per MAX_SQL_ARGS names in a
+    # location.
+    def _find_delete_rows(self, cr, group):
+        root_uri = group['root_uri']
+        found = []
+        ids = sorted(group['ids'])
+        for selection, args in mediastore.in_chunks(mediastore.ID, ids):
+            rows = mediastore.query(cr, root_uri,
+                                    [mediastore.ID,
+                                     mediastore.OWNER_PACKAGE_NAME],
+                                    selection, args)
+            for id, owner in rows:
+                found.append((group['ids'][id], id, owner))
+        columns = [mediastore.ID, mediastore.DISPLAY_NAME,
+                   mediastore.OWNER_PACKAGE_NAME]
+        for location, by_name in group['locations'].items():
+            matched = set()
+            for selection, args in mediastore.in_chunks(
+                    mediastore.DISPLAY_NAME, sorted(by_name),
+                    mediastore.RELATIVE_PATH[0] + "=?", [location]):
+                rows = mediastore.query(cr, root_uri, columns, selection,
+                                        args, mediastore.ID[0] + ' ASC')
+                # As _get_uri(), the first file with the name
+                for id, name, owner in rows:
+                    if name not in matched:
+                        matched.add(name)
+                        found.append((by_name[name], id, owner))
+        return found
+
+    # rows is a list of (key, id, owner). The files owned by this app are
+    # deleted, by selection if given, else by id; the others are
+    # added to foreign.
+    def _delete_rows(self, cr, root_uri, rows, report, foreign,
+                     selection = None, args = None):
+        package = get_session().package_name
+        owned = [(key, id) for key, id, owner in rows if owner == package]
+        try:
+            if selection:
+                if owned:
+                    cr.delete(root_uri, selection + ' AND ' +
+                              mediastore.OWNER_PACKAGE_NAME[0] + '=?',
+                              args + [package])
+            else:
+                for selection, args in mediastore.in_chunks(
+                        mediastore.ID, [id for key, id in owned]):
+                    cr.delete(root_uri, selection, args)
+            status = 'deleted'
+        except Exception as e:
+            Logger.warning('SharedStorage.delete_shared_many():')
+            Logger.warning(str(e))
+            status = 'failed'
+        uri_strings = set()
+        for key, id in owned:
+            report[key] = status
+            if status == 'deleted':
+                self._uri_cache.pop(key)
+                uri_strings.add(root_uri.toString() + '/' + str(id))
+        if uri_strings:
+            self._uri_cache.pop_if(lambda k, v: v.toString() in uri_strings)
+        for key, id, owner in rows:
+            if owner != package:
+                if api_version > 29:
+                    foreign.append((key, ContentUris.withAppendedId(root_uri,
+                                                                    id)))
+                    report[key] = 'requested'
+                else:
+                    report[key] = 'not_permitted'
+
+    # Android >= 11, one request for the user to confirm the delete of
+    # files this app does not own. If it can't be made they are 'failed'.
+    def _request_delete(self, foreign, report, callback):
+        if not foreign:
+            return
+        uris = ArrayList()
+        for key, uri in foreign:
+            uris.add(uri)
+        try:
+            # A Java argument, not the counting resolver
+            cr = get_session().raw_resolver
+            pending_intent = MediaStore.createDeleteRequest(cr, uris)
+
+            def on_activity_result(request_code, result_code, intent):
+                if request_code != DELETE_REQUEST_CODE:
+                    return
+                activity.unbind(on_activity_result = on_activity_result)
+                confirmed = result_code == -1 # Activity.RESULT_OK
+                if confirmed:
+                    keys = set([key for key, uri in foreign])
+                    self._uri_cache.pop_if(lambda k, v: k in keys)
+                if callback:
+                    mainthread(callback)(confirmed)
+
+            activity.bind(on_activity_result = on_activity_result)
+            mActivity.startIntentSenderForResult(
+                pending_intent.getIntentSender(), DELETE_REQUEST_CODE,
+                None, 0, 0, 0)
+        except Exception as e:
+            Logger.warning('SharedStorage.delete_shared_many():')
+            Logger.warning(str(e))
+            for key, uri in foreign:
+                report[key] = 'failed'
+
+    def _delete_legacy_tree(self, base):
+        report = {}
+        root_directory = self._get_legacy_storage_location()
+        if root_directory == None:
+            return report
+        directory = join(root_directory, base)
+        for dirpath, dirnames, filenames in walk(directory, topdown = False):
+            for name in filenames:
+                path = join(dirpath, name)
+                key = relpath(path, root_directory)
+                try:
+                    remove(path)
+                    report[key] = 'deleted'
+                    self._uri_cache.pop(key)
+                except OSError as e:
+                    Logger.warning('SharedStorage.delete_shared_tree():')
+                    Logger.warning(str(e))
+                    report[key] = 'failed'
+            try:
+                rmdir(dirpath)
+            except OSError:
+                pass
+        return report
+
+    ###################
+    # Sync tree
+    ###################
+
+    # {path relative to base : (shared_file, export index key, version)}
+    # On Android >= 10 with one MediaStore query.
+    def _list_sync_tree(self, collection, base):
+        shared = {}
+        if api_version <= 28:
+            root_directory = self._get_legacy_storage_location()
+            if root_directory == None:
+                return shared
+            directory = join(root_directory, base)
+            for path, public_path in self._scan_tree(directory):
+                if not path.endswith(PARTIAL_SUFFIXES):
+                    shared[path] = (relpath(public_path, root_directory),
+                                    public_path,
+                                    self._file_version(public_path))
+            return shared
+        root_uri = self._get_collection_root_uri(collection)
+        selection, args = mediastore.like_subtree(base)
+        columns = [mediastore.ID, mediastore.DISPLAY_NAME,
+                   mediastore.RELATIVE_PATH, mediastore.SIZE,
+                   mediastore.DATE_MODIFIED]
+        if api_version > 29:
+            columns.append(mediastore.GENERATION_MODIFIED)
+        cr = get_session().resolver
+        rows = mediastore.query(cr, root_uri, columns, selection, args,
+                                mediastore.ID[0] + ' ASC')
+        for row in rows:
+            id, name, relative_path = row[:3]
+            key = join(relative_path.rstrip('/'), name)
+            path = relpath(key, base)
+            # As _get_uri(), the first file with the name
+            if path not in shared:
+                shared[path] = (ContentUris.withAppendedId(root_uri, id), key,
+                                (row[3:] + [None])[:3])
+        return shared
+
+    # Yields (path relative to directory, file path), '/' separated
+    def _scan_tree(self, directory, prefix = ''):
+        try:
+            entries = list(scandir(directory))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks = False):
+                yield from self._scan_tree(entry.path,
+                                           prefix + entry.name + '/')
+            elif entry.is_file():
+                yield prefix + entry.name, entry.path
+
+    def _sync_unchanged(self, cr, shared_file, key, private_file, version):
+        if api_version > 28:
+            return self._unchanged(key, private_file, version,
+                                   lambda: self._open_uri_reader(cr,
+                                                                 shared_file))
+        return self._unchanged(key, private_file, version,
+                               lambda: open(key, 'rb'))
+
+    # copy_many_to_shared(), files split between up to max_workers threads
+    def _sync_copy(self, files, collection, max_workers):
+        if not files:
+            return []
+        workers = min(max_workers, len(files))
+        if workers == 1:
+            return self._copy_many_to_shared(files, collection, [])
+        size = -(-len(files) // workers)
+        chunks = [files[i:i + size] for i in range(0, len(files), size)]
+        results = [None] * len(chunks)
+
+        def copy_chunk(index):
+            try:
+                results[index] = self._copy_many_to_shared(chunks[index],
+                                                           collection, [])
+            except Exception as e:
+                Logger.warning('SharedStorage.sync_tree():')
+                Logger.warning(str(e))
+            finally:
+                # Threads that used the JVM must detach before they exit
+                detach()
+
+        threads = [Thread(target = copy_chunk, args = (i,), daemon = True)
+                   for i in range(len(chunks))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        copied = []
+        for chunk, result in zip(chunks, results):
+            copied.extend(result or [None] * len(chunk))
+        return copied
+
+    ###################
+    # Resumable copies
+    ###################
+
+    @metrics.measure('copy_to_shared_resumable')
+    @scheduler.scheduled('bulk')
+    def _copy_to_shared_resumable(self, private_file, collection, filepath,
+                                  return_hash, monitor = None):
+        if private_file == None or not exists(private_file):
+            return None
+        cache_dir = self.get_cache_dir()
+        if not cache_dir:
+            return None
+        file_name, MIME_type, path =\
+            self._get_shared_path(private_file, collection, filepath)
+        st = stat(private_file)
+        version = [st.st_size, st.st_mtime, None]
+        checkpoints = get_checkpoints(cache_dir)
+        key = 'to_shared:' + private_file + ':' + '/'.join(path + [file_name])
+        checkpoint = checkpoints.get(key)
+        destination = None
+        out_fd = None
+        try:
+            if api_version > 28:
+                cr = get_session().resolver
+                uri, pfd = self._open_resumable_uri(cr, checkpoint, file_name,
+                                                    MIME_type, path)
+                if not pfd:
+                    return None
+                destination = uri.toString()
+                out_fd = pfd.detachFd()
+                pfd.close()
+            else:
+                sub_directory = self._make_legacy_directory(path)
+                if sub_directory == None:
+                    return None
+                public_path = join(sub_directory, file_name)
+                destination = public_path + '.partial'
+                out_fd = open_fd(destination, O_RDWR | O_CREAT)
+            if checkpoint and checkpoint['destination'] != destination:
+                checkpoint = None
+            with open(private_file, 'rb') as rs:
+                digest = self._copy_chunks(rs.fileno(), out_fd, checkpoints,
+                                           key, checkpoint, version,
+                                           destination, monitor)
+            close(out_fd)
+            out_fd = None
+            if api_version > 28:
+                self._publish_pending(cr, uri, join(*path, file_name),
+                                      file_name)
+                shared_file = uri
+            else:
+                replace(destination, public_path)
+                shared_file = public_path
+            checkpoints.discard(key)
+        except Exception as e:
+            if monitor and monitor.cancelled:
+                # Cancelled, so not resumed
+                checkpoints.discard(key)
+                if destination:
+                    self._remove_partial(destination)
+            else:
+                # The checkpoint is kept, the next call resumes the copy
+                Logger.warning('SharedStorage.copy_to_shared_resumable():')
+                Logger.warning(str(e))
+            return None
+        finally:
+            if out_fd != None:
+                close(out_fd)
+        if return_hash:
+            return (shared_file, digest)
+        return shared_file
+
+    # The destination is a new pending row, so other apps don't see it
+    # until it is complete, and a file it replaces is unchanged until then.
+    # Returns (uri, ParcelFileDescriptor) or (None, None)
+    def _open_resumable_uri(self, cr, checkpoint, file_name, MIME_type, path):
+        if checkpoint:
+            try:
+                uri = Uri.parse(checkpoint['destination'])
+                return uri, cr.openFileDescriptor(uri, 'rw')
+            except Exception:
+                Logger.info('Resumable copy destination not found.')
+                Logger.info('The copy will restart.')
+        uri = None
+        try:
+            uri = self._insert_pending(cr, file_name, MIME_type, path)
+            return uri, cr.openFileDescriptor(uri, 'rw')
+        except Exception as e:
+            Logger.warning('SharedStorage.copy_to_shared_resumable():')
+            Logger.warning(str(e))
+            if uri:
+                self._delete_uri(cr, uri)
+            return None, None
+
+    @metrics.measure('copy_from_shared_resumable')
+    @scheduler.scheduled('bulk')
+    def _copy_from_shared_resumable(self, shared_file, return_hash,
+                                    monitor = None):
+        if shared_file == None:
+            return None
+        cache_dir = self.get_cache_dir()
+        if not cache_dir:
+            return None
+        in_fd = None
+        try:
+            if api_version > 28 or type(shared_file) != str:
+                uri = self._get_uri(shared_file)
+                if not uri:
+                    return None
+                cr = get_session().resolver
+                columns = [mediastore.DISPLAY_NAME, mediastore.SIZE,
+                           mediastore.DATE_MODIFIED]
+                if api_version > 29:
+                    columns.append(mediastore.GENERATION_MODIFIED)
+                try:
+                    rows = mediastore.query(cr, uri, columns, max_rows = 1)
+                except Exception:
+                    # Not every provider has every column
+                    rows = mediastore.query(cr, uri, columns[:2],
+                                            max_rows = 1)
+                if not rows:
+                    return None
+                file_name, size, date_modified, generation =\
+                    (rows[0] + [None, None])[:4]
+                key = uri.toString()
+                try:
+                    pfd = cr.openFileDescriptor(uri, 'r')
+                except:
+                    self._uncache_uri(uri)
+                    raise
+                in_fd = pfd.detachFd()
+                pfd.close()
+            else:
+                path = join(self._get_legacy_storage_location(), shared_file)
+                if not exists(path):
+                    return None
+                file_name = basename(path)
+                size = getsize(path)
+                date_modified = getmtime(path)
+                generation = None
+                key = path
+                in_fd = open_fd(path, O_RDONLY)
+        except Exception as e:
+            Logger.warning('SharedStorage.copy_from_shared_resumable():')
+            Logger.warning(str(e))
+            if in_fd != None:
+                close(in_fd)
+            return None
+
+        checkpoints = get_checkpoints(cache_dir)
+        checkpoint_key = 'from_shared:' + key
+        partial = self._get_cache_file(cache_dir, key, file_name) + '.partial'
+        digest = []
+
+        def copy_source(temp_file):
+            checkpoint = checkpoints.get(checkpoint_key)
+            if checkpoint and checkpoint['destination'] != partial:
+                checkpoint = None
+            try:
+                out_fd = open_fd(partial, O_RDWR | O_CREAT)
+                try:
+                    digest.append(self._copy_chunks(
+                        in_fd, out_fd, checkpoints, checkpoint_key,
+                        checkpoint, [size, date_modified, generation],
+                        partial, monitor))
+                finally:
+                    close(out_fd)
+            except Exception:
+                if monitor and monitor.cancelled:
+                    checkpoints.discard(checkpoint_key)
+                    self._remove_partial(partial)
+                raise
+            replace(partial, temp_file)
+            checkpoints.discard(checkpoint_key)
+
+        try:
+            cache_file = self._fill_cache(cache_dir, key, file_name, size,
+                                          date_modified, generation,
+                                          copy_source, self.cache_max_bytes,
+                                          monitor,
+                                          'copy_from_shared_resumable')
+        finally:
+            close(in_fd)
+        if not cache_file:
+            return None
+        if return_hash:
+            if not digest:
+                # From the cache
+                digest.append(self._hash_file(cache_file))
+            return (cache_file, digest[0])
+        return cache_file
+
+    # Copy from the checkpoint's offset, or the start, to the end of
+    # in_fd; saving a checkpoint after each chunk.
+    # version identifies the source, a changed source is copied again.
+    # Returns the hex digest of all the data.
+    def _copy_chunks(self, in_fd, out_fd, checkpoints, key, checkpoint,
+                     version, destination, monitor = None):
+        metrics.set_copy_path('chunked')
+        chunk_size = self.resumable_chunk_size
+        hash = None
+        offset = 0
+        if checkpoint and checkpoint['version'] == version and\
+           checkpoint['hash'] == self.resumable_hash:
+            hash = self._verify_checkpoint(in_fd, out_fd, checkpoint)
+            if hash:
+                offset = checkpoint['offset']
+        if not hash:
+            hash = new_hash(self.resumable_hash)
+        ftruncate(out_fd, offset)
+        if monitor:
+            if version[0] != None:
+                monitor.set_total(version[0])
+            monitor.set_progress(offset)
+        # The bytes before offset were copied before
+        monitor = scheduler.get_scheduler().throttled(monitor, offset)
+        while True:
+            if monitor:
+                monitor.check_cancelled()
+            data = pread(in_fd, chunk_size, offset)
+            if not data:
+                break
+            view = memoryview(data)
+            position = offset
+            while view:
+                num = pwrite(out_fd, view, position)
+                view = view[num:]
+                position += num
+            hash.update(data)
+            offset += len(data)
+            # The checkpoint is only saved for data that is on disk
+            fsync(out_fd)
+            checkpoints.put(key, {'version' : version,
+                                  'destination' : destination,
+                                  'hash' : self.resumable_hash,
+                                  'offset' : offset,
+                                  'digest' : hash.hexdigest()})
+            metrics.add_bytes(len(data))
+            if monitor:
+                monitor.set_progress(offset)
+        return hash.hexdigest()
+
+    # The hash of the source up to the checkpoint, if it matches the
+    # checkpoint and the destination's last chunk matches the source.
+    # Else None.
+    def _verify_checkpoint(self, in_fd, out_fd, checkpoint):
+        offset = checkpoint['offset']
+        if fstat(out_fd).st_size < offset:
+            return None
+        chunk_size = self.resumable_chunk_size
+        last_chunk = max(0, offset - chunk_size)
+        hash = new_hash(self.resumable_hash)
+        position = 0
+        while position < offset:
+            data = pread(in_fd, min(chunk_size, offset - position), position)
+            if not data:
+                return None
+            if position + len(data) > last_chunk:
+                start = max(0, last_chunk - position)
+                written = pread(out_fd, len(data) - start, position + start)
+                if written != data[start:]:
+                    return None
+            hash.update(data)
+            position += len(data)
+        if hash.hexdigest() != checkpoint['digest']:
+            return None
+        return hash
+
+    def _hash_file(self, file_path):
+        hash = new_hash(self.resumable_hash)
+        with open(file_path, 'rb') as f:
+            while True:
+                data = f.read(self.resumable_chunk_size)
+                if not data:
+                    break
+                hash.update(data)
+        return hash.hexdigest()
+
+    # destination is a uri string or a file path.
+    # A uri is only deleted while it is pending, a published file (for
+    # example from a checkpoint saved by an older version) is kept.
+    def _remove_partial(self, destination):
+        try:
+            if '://' in destination:
+                cr = get_session().resolver
+                cr.delete(Uri.parse(destination),
+                          mediastore.IS_PENDING[0] + "=1", None)
+            elif exists(destination):
+                remove(destination)
+        except Exception as e:
+            Logger.warning('SharedStorage._remove_partial():')
+            Logger.warning(str(e))
+
+    def _list_shared_uris(self, collection, base, page_size, sort_order,
+                          descending):
+        root_uri = self._get_collection_root_uri(collection)
+        selection, args = mediastore.like_subtree(base)
+        direction = ' DESC' if descending else ' ASC'
+        order = SORT_COLUMNS[sort_order] + direction + ', ' +\
+            mediastore.ID[0] + direction
+        columns = [mediastore.ID, mediastore.DISPLAY_NAME,
+                   mediastore.RELATIVE_PATH, mediastore.SIZE,
+                   mediastore.DATE_MODIFIED, mediastore.MIME_TYPE]
+        cr = get_session().resolver
+        offset = 0
+        while True:
+            honored = []
+            try:
+                rows = mediastore.query(cr, root_uri, columns, selection,
+                                        args, order, limit = page_size,
+                                        offset = offset,
+                                        honored_args = honored)
+                paged = mediastore.limit_honored(honored)
+                if not paged and len(rows) == page_size:
+                    # All the rows, or perhaps the first page
+                    rows = mediastore.query(cr, root_uri, columns,
+                                            selection, args, order)
+            except Exception as e:
+                Logger.warning('SharedStorage.list_shared():')
+                Logger.warning(str(e))
+                return
+            for id, name, relative_path, size, date_modified, MIME in rows:
+                uri = ContentUris.withAppendedId(root_uri, id)
+                yield SharedFileInfo(name, uri,
+                                     join(relative_path.rstrip('/'), name),
+                                     size, date_modified, MIME)
+            # A provider that ignores limit and offset returns all the
+            # rows for every page
+            if not paged or len(rows) < page_size:
+                return
+            offset += page_size
+
+    def _list_shared_files(self, base, sort_order, descending):
+        root_directory = self._get_legacy_storage_location()
+        if root_directory == None:
+            return
+        directory = join(root_directory, base)
+        files = []
+        for dirpath, dirnames, filenames in walk(directory):
+            for name in filenames:
+                if name.endswith(PARTIAL_SUFFIXES):
+                    # Not complete, as a pending MediaStore item
+                    continue
+                path = relpath(join(dirpath, name), root_directory)
+                st = stat(join(dirpath, name))
+                files.append((name, path, st.st_size, int(st.st_mtime)))
+        key = {'name' : 0, 'size' : 2, 'date_modified' : 3}[sort_order]
+        files.sort(key = lambda f: (f[key], f[1]), reverse = descending)
+        for name, path, size, date_modified in files:
+            yield SharedFileInfo(name, path, path, size, date_modified,
+                                 self.get_file_MIME_type(name))
+
+    # The MediaStore collection for an Environment.DIRECTORY_ name
+    def _get_collection_root_uri(self, collection):
+        for auto_collection, MIME_type in\
+            [(self._directory('PICTURES'), 'image/*'),
+             (self._directory('MOVIES'), 'video/*'),
+             (self._directory('MUSIC'), 'audio/*')]:
+            if self._legal_collection(auto_collection, collection):
+                return self._get_root_uri(collection, MIME_type)
+        return self._get_root_uri(collection, 'application/*')
+
+    def _make_legacy_directory(self, path):
+        root_directory = self._get_legacy_storage_location()
+        if root_directory == None:
+            return None
+        sub_directory = root_directory
+        for d in path:
+            sub_directory = join(sub_directory,d) 
+            if not exists(sub_directory):
+                try:
+                    mkdir(sub_directory)
+                except FileExistsError:
+                    # Made by another thread, see sync_tree()
+                    pass
+        return sub_directory
+
+    def _mmap(self, fd, mode):
+        if '+' in mode:
+            return MemoryMap(fd, 0, access = ACCESS_WRITE)
+        return MemoryMap(fd, 0, access = ACCESS_READ)
+
+    def _get_shared_path(self, private_file, collection, filepath):
+        file_name = basename(private_file)
+        MIME_type = self.get_file_MIME_type(file_name)
+        auto_collection = self._get_auto_collection(MIME_type)
+        if not self._legal_collection(auto_collection, collection):
+            collection = auto_collection
+        path = [collection, self.get_app_title()]
+        if filepath:
+            sfp = filepath.split('/')
+            file_name = sfp[-1]
+            for f in sfp[:-1]:
+                path.append(f)
+        return file_name, MIME_type, path
+
+    def _split_file_item(self, item):
+        if type(item) in (tuple, list):
+            if len(item) == 0:
+                return None, None
+            if len(item) < 2:
+                return item[0], None
+            return item[0], item[1]
+        return item, None
+
+    def _content_values(self, target):
+        cv = ContentValues()
+        cv.put(mediastore.DISPLAY_NAME[0], target['file_name'])
+        cv.put(mediastore.MIME_TYPE[0], target['MIME_type'])
+        cv.put(mediastore.RELATIVE_PATH[0], target['sub_directory'])
+        return cv
+
+    # Set the uri of each target that already exists, all targets in
+    # a group have the same root uri.
+    # One query per RELATIVE_PATH (per MAX_SQL_ARGS names).
+    def _get_many_uris(self, cr, group):
+        root_uri = group[0]['root_uri']
+        by_location = {}
+        for target in group:
+            by_location.setdefault(target['sub_directory'], []).append(target)
+        columns = [mediastore.ID, mediastore.DISPLAY_NAME]
+        for location, location_targets in by_location.items():
+            names = sorted(set([t['file_name'] for t in location_targets]))
+            found = {}
+            for selection, args in mediastore.in_chunks(
+                    mediastore.DISPLAY_NAME, names,
+                    mediastore.RELATIVE_PATH[0] + "=?", [location + '/']):
+                rows = mediastore.query(cr, root_uri, columns, selection,
+                                        args)
+                for id, name in rows:
+                    if name not in found:
+                        found[name] = id
+            for target in location_targets:
+                id = found.get(target['file_name'])
+                if id != None:
+                    target['uri'] = ContentUris.withAppendedId(root_uri, id)
+                    self._uri_cache.put(target['shared_file'], target['uri'])
+
+    # After a failed applyBatch(), some rows may have been created.
+    # Find those, and insert the rest one at a time.
+    def _insert_each(self, cr, groups, missing):
+        for group in groups.values():
+            group_missing = [t for t in group if t in missing]
+            if not group_missing:
+                continue
+            try:
+                self._get_many_uris(cr, group_missing)
+            except Exception as e:
+                Logger.warning('SharedStorage.copy_many_to_shared():')
+                Logger.warning(str(e))
+                for target in group_missing:
+                    target['failed'] = True
+        for target in missing:
+            if target['uri'] != None or target['failed']:
+                continue
+            try:
+                target['uri'] = cr.insert(target['root_uri'],
+                                          self._content_values(target))
+                target['inserted'] = True
+            except Exception as e:
+                Logger.warning('SharedStorage.copy_many_to_shared():')
+                Logger.warning(str(e))
+                target['failed'] = True
+
+    def _write_target(self, cr, target):
+        uri = target['uri']
+        if not uri or target['failed']:
+            return None
+        rs = None
+        ws = None
+        written = False
+        try:
+            try:
+                ws = cr.openOutputStream(uri,"rwt")
+            except:
+                self._uri_cache.pop(target['shared_file'])
+                if target['inserted']:
+                    raise
+                Logger.info('File replace permission not granted.')
+                Logger.info('A new file version will be created.')
+                uri = cr.insert(target['root_uri'],
+                                self._content_values(target))
+                target['uri'] = uri
+                target['inserted'] = True
+                ws = cr.openOutputStream(uri)
+            rs = FileInputStream(target['private_file'])
+            self._copy_stream(rs, ws)
+            ws.flush()
+            written = True
+        except Exception as e:
+            Logger.warning('SharedStorage.copy_many_to_shared():')
+            Logger.warning(str(e))
+        finally:
+            for stream in (ws, rs):
+                if stream:
+                    try:
+                        stream.close()
+                    except Exception:
+                        pass
+        if written:
+            self._uri_cache.put(target['shared_file'], uri)
+            return uri
+        self._uri_cache.pop(target['shared_file'])
+        if target['inserted']:
+            # Don't leave an empty shared file behind
+            try:
+                cr.delete(uri, None, None)
+            except Exception:
+                pass
+        return None
+
     def _get_root_uri(self, root_directory, MIME_type):
-        if root_directory == Environment.DIRECTORY_DOWNLOADS:
-            root_uri = MediaStoreDownloads.EXTERNAL_CONTENT_URI
+        session = get_session()
+        if root_directory == self._directory('DOWNLOADS'):
+            root_uri = session.root_uri('downloads')
         else:
             root, ext = MIME_type.split('/')
             root = root.lower()
             if root == 'image':
-                root_uri = MediaStoreImagesMedia.EXTERNAL_CONTENT_URI
+                root_uri = session.root_uri('images')
             elif root == 'video':
-                root_uri = MediaStoreVideoMedia.EXTERNAL_CONTENT_URI
+                root_uri = session.root_uri('video')
             elif root == 'audio':
-                root_uri = MediaStoreAudioMedia.EXTERNAL_CONTENT_URI
+                root_uri = session.root_uri('audio')
             else:
-                root_uri = MediaStoreFiles.getContentUri('external')
+                root_uri = session.root_uri('files')
         return root_uri
 
     def _get_uri(self, shared_file):
@@ -225,6 +2056,9 @@ class SharedStorage:
             except:
                 return None
 
+        cached_uri = self._uri_cache.get(shared_file)
+        if cached_uri:
+            return cached_uri
         file_name = basename(shared_file)
         MIME_type = self.get_file_MIME_type(file_name)
         path = shared_file.split('/')
@@ -232,99 +2066,208 @@ class SharedStorage:
             return None
         root = path[0]
             
-        self.selection = MediaStoreMediaColumns.DISPLAY_NAME+"=? AND " 
+        selection = mediastore.DISPLAY_NAME[0]+"=? AND " 
         if api_version > 28:
             location = ''
             for d in path[:-1]:
                 location = join(location,d)
-            self.selection = self.selection +\
-                MediaStoreMediaColumns.RELATIVE_PATH+"=?" 
-            self.args = [file_name, location+'/']
+            selection = selection + mediastore.RELATIVE_PATH[0]+"=?" 
+            args = [file_name, location+'/']
         else:
-            self.selection = self.selection + MediaStoreMediaColumns.DATA+"=?"
-            self.args = [file_name, shared_file]
+            selection = selection + mediastore.DATA[0]+"=?"
+            args = [file_name, shared_file]
 
         root_uri = self._get_root_uri(root, MIME_type)
-        context = mActivity.getApplicationContext()
-        cursor = context.getContentResolver().query(root_uri, None,
-                                                    self.selection,
-                                                    self.args, None)
+        cr = get_session().resolver
+        rows = mediastore.query(cr, root_uri,
+                                [mediastore.ID, mediastore.DISPLAY_NAME],
+                                selection, args)
         fileUri = None
-        if cursor:
-            while cursor.moveToNext():
-                dn = MediaStoreMediaColumns.DISPLAY_NAME
-                index = cursor.getColumnIndex(dn)
-                fileName = cursor.getString(index)
-                if file_name == fileName:
-                    id_index = cursor.getColumnIndex(MediaStoreMediaColumns._ID)
-                    id = cursor.getLong(id_index)
-                    fileUri = ContentUris.withAppendedId(root_uri,id)
-                    break
-            cursor.close()
+        for id, fileName in rows:
+            if file_name == fileName:
+                fileUri = ContentUris.withAppendedId(root_uri,id)
+                break
+        if fileUri:
+            self._uri_cache.put(shared_file, fileUri)
         return fileUri
 
-    def _copy_uri_to_cache(self, uri):
+    # Returns function(uri) for the shared file's uri. If that is None
+    # and the cached uri was removed (its row was deleted), the file may
+    # have been created again, so it is found and tried once more.
+    def _with_uri(self, shared_file, function):
+        cached = type(shared_file) == str and shared_file in self._uri_cache
+        result = function(self._get_uri(shared_file))
+        if result == None and cached and shared_file not in self._uri_cache:
+            result = function(self._get_uri(shared_file))
+        return result
+
+    # Remove a uri that no longer opens, or was deleted
+    def _uncache_uri(self, uri):
+        try:
+            uri_string = cast('android.net.Uri', uri).toString()
+        except Exception:
+            return
+        self._uri_cache.pop_if(lambda k, v: v.toString() == uri_string)
+
+    def _copy_uri_to_cache(self, uri, monitor = None):
         if not uri:
             return uri
         uri = cast('android.net.Uri',uri)
         if uri.getScheme().lower() == 'file':
-            return self._copy_file_to_cache(uri.getPath())
-        context = mActivity.getApplicationContext()
-        cursor = context.getContentResolver().query(uri, None,
-                                                    None, None, None)
-        if not cursor:
-            return None
-        dn = MediaStoreMediaColumns.DISPLAY_NAME
-        nameIndex = cursor.getColumnIndex(dn)
-        cursor.moveToFirst()
-        file_name = cursor.getString(nameIndex)
+            return self._copy_file_to_cache(uri.getPath(), monitor)
+        cr = get_session().resolver
+        columns = [mediastore.DISPLAY_NAME, mediastore.SIZE,
+                   mediastore.DATE_MODIFIED]
+        if api_version > 29:
+            columns.append(mediastore.GENERATION_MODIFIED)
+        try:
+            rows = mediastore.query(cr, uri, columns, max_rows = 1)
+        except Exception:
+            # Not every provider has every column
+            rows = mediastore.query(cr, uri, columns[:2], max_rows = 1)
+        if not rows:
+            self._uncache_uri(uri)
+            return None
+        file_name, size, date_modified, generation =\
+            (rows[0] + [None, None])[:4]
         cache_dir = self.get_cache_dir()
         if not cache_dir:
             return None
-        cache_file= join(cache_dir, file_name)
-        if exists(cache_file):
-            remove(cache_file)
-        cr = context.getContentResolver()
+
+        def copy_source(temp_file):
+            if api_version > 28 or get_stream_copy() or\
+               not self._copy_uri_to_file(cr, uri, temp_file, monitor):
+                try:
+                    rs = cr.openInputStream(uri)
+                except:
+                    self._uncache_uri(uri)
+                    raise
+                ws = FileOutputStream(temp_file)
+                try:
+                    copied = self._copy_stream(rs, ws, monitor)
+                finally:
+                    ws.close()
+                    rs.close()
+                if copied == -1 and metrics.measuring():
+                    metrics.add_bytes(getsize(temp_file))
+
+        return self._fill_cache(cache_dir, uri.toString(), file_name,
+                                size, date_modified, generation,
+                                copy_source, self.cache_max_bytes, monitor)
+
+    # Copy using the uri's file descriptor, no Java class required.
+    # Returns False if the provider does not supply a file descriptor.
+    def _copy_uri_to_file(self, cr, uri, file_path, monitor = None):
         try:
-            rs = cr.openInputStream(uri)
-            ws = FileOutputStream(cache_file)
-            if api_version > 28:
-                # fastest
-                FileUtils.copy(rs,ws)
-            elif StreamCopy:
-                # pretty fast
-                StreamCopy(rs, ws) 
-            else:
-                # slow
-                jbytes = bytearray(2048)
-                while True:
-                    num = rs.read(jbytes) 
-                    if num == -1:
-                        break
-                    ws.write(jbytes, 0, num)
-            ws.close()
-            rs.close()
-        except Exception as e:
-            Logger.warning('SharedStorage._copy_uri_to_cache():')
-            Logger.warning(str(e))
-        cursor.close()
-        return cache_file
+            pfd = cr.openFileDescriptor(uri, "r")
+        except Exception:
+            return False
+        if not pfd:
+            return False
+        in_fd = pfd.detachFd()
+        pfd.close()
+        try:
+            with open(file_path, 'wb') as ws:
+                self._copy_fd(in_fd, ws.fileno(), monitor)
+        finally:
+            close(in_fd)
+        return True
 
-    def _copy_file_to_cache(self, shared_file):
+    def _copy_file_to_cache(self, shared_file, monitor = None):
         path = join(self._get_legacy_storage_location(), shared_file)
+        if not exists(path):
+            return None
+        cache_dir = self.get_cache_dir()
+        if not cache_dir:
+            return None
+
+        def copy_source(temp_file):
+            self._copy_file(path, temp_file, monitor)
+
+        return self._fill_cache(cache_dir, path, basename(path),
+                                getsize(path), getmtime(path), None,
+                                copy_source, self.cache_max_bytes, monitor)
+
+    # Returns a cache file that is a copy of the source identified by key.
+    # Unchanged sources are not copied again (see cacheindex.py), the
+    # cache is kept to max_bytes.
+    # Concurrent calls for the same key share one copy.
+    # copy_source(temp_file) copies the source, then it is renamed into place.
+    # A failed copy is logged as SharedStorage.<operation>().
+    def _fill_cache(self, cache_dir, key, file_name, size, date_modified,
+                    generation, copy_source, max_bytes, monitor = None,
+                    operation = '_copy_from_shared'):
+        with SharedStorage._in_flight_lock:
+            in_flight = SharedStorage._in_flight.get(key)
+            owner = in_flight == None
+            if owner:
+                in_flight = {'done' : Event(), 'result' : None}
+                SharedStorage._in_flight[key] = in_flight
+        if not owner:
+            in_flight['done'].wait()
+            cache_file = in_flight['result']
+            if monitor and cache_file:
+                monitor.set_total(size)
+                monitor.set_progress(size)
+            return cache_file
+
         cache_file = None
-        if exists(path):
-            cache_dir = self.get_cache_dir()
-            if not cache_dir:
-                return None
-            cache_file = join(cache_dir, basename(path))
-            copyfile(path, cache_file)
+        try:
+            index = get_cache_index(cache_dir)
+            cache_file = index.lookup(key, size, date_modified, generation)
+            if cache_file:
+                if monitor:
+                    monitor.set_total(size)
+                    monitor.set_progress(size)
+            else:
+                if monitor and size != None:
+                    monitor.set_total(size)
+                cache_file = self._write_cache_file(cache_dir, key,
+                                                    file_name, copy_source,
+                                                    monitor, operation)
+                if cache_file:
+                    index.add(key, cache_file, size, date_modified,
+                              generation, max_bytes)
+                else:
+                    index.discard(key)
+        finally:
+            in_flight['result'] = cache_file
+            with SharedStorage._in_flight_lock:
+                del SharedStorage._in_flight[key]
+            in_flight['done'].set()
+        return cache_file
+
+    def _write_cache_file(self, cache_dir, key, file_name, copy_source,
+                          monitor, operation):
+        cache_file = self._get_cache_file(cache_dir, key, file_name)
+        temp_file = cache_file + '.' + str(get_ident()) + '.tmp'
+        try:
+            makedirs(dirname(cache_file), exist_ok = True)
+            copy_source(temp_file)
+            replace(temp_file, cache_file)
+        except Exception as e:
+            if not (monitor and monitor.cancelled):
+                Logger.warning('SharedStorage.' + operation + '():')
+                Logger.warning(str(e))
+            if exists(temp_file):
+                remove(temp_file)
+            return None
         return cache_file
 
+    # Each source has its own directory, so files with the same name
+    # from different sources don't collide.
+    def _get_cache_file(self, cache_dir, key, file_name):
+        directory = join(cache_dir, sha1(key.encode('utf-8')).hexdigest()[:16])
+        return join(directory, file_name)
+
     def _get_legacy_storage_location(self):
+        root_dir = self._memoized.get('legacy_storage_location')
+        if root_dir:
+            return root_dir
         root = Environment.getExternalStorageDirectory()
         root_dir = str(root.getAbsolutePath())
         if exists(root_dir):
+            self._memoized['legacy_storage_location'] = root_dir
             return root_dir
         return None
 
@@ -332,23 +2275,19 @@ class SharedStorage:
         # Too many rules, dudes.
         if collection == None:
             return False
-        elif collection == Environment.DIRECTORY_DOWNLOADS:
+        elif collection == self._directory('DOWNLOADS'):
             return True
-        elif auto_collection == Environment.DIRECTORY_MUSIC:
-            return collection in [Environment.DIRECTORY_ALARMS,
-                                  Environment.DIRECTORY_AUDIOBOOKS,
-                                  Environment.DIRECTORY_MUSIC,
-                                  Environment.DIRECTORY_NOTIFICATIONS,
-                                  Environment.DIRECTORY_PODCASTS,
-                                  Environment.DIRECTORY_RECORDINGS,
-                                  Environment.DIRECTORY_RINGTONES]
-        elif auto_collection == Environment.DIRECTORY_PICTURES:
-            return collection in [Environment.DIRECTORY_DCIM,
-                                  Environment.DIRECTORY_PICTURES,
-                                  Environment.DIRECTORY_SCREENSHOTS]
-        elif auto_collection == Environment.DIRECTORY_MOVIES:
-            return collection in [Environment.DIRECTORY_MOVIES]
-        return collection in [Environment.DIRECTORY_DOCUMENTS]
+        elif auto_collection == self._directory('MUSIC'):
+            return collection in [self._directory(d) for d in
+                                  ['ALARMS', 'AUDIOBOOKS', 'MUSIC',
+                                   'NOTIFICATIONS', 'PODCASTS', 'RECORDINGS',
+                                   'RINGTONES']]
+        elif auto_collection == self._directory('PICTURES'):
+            return collection in [self._directory(d) for d in
+                                  ['DCIM', 'PICTURES', 'SCREENSHOTS']]
+        elif auto_collection == self._directory('MOVIES'):
+            return collection in [self._directory('MOVIES')]
+        return collection in [self._directory('DOCUMENTS')]
         
 
 
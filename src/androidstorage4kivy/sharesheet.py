@@ -1,124 +1,268 @@
 from kivy.logger import Logger
-from kivy.core.window import Window
-from jnius import autoclass, cast
-from android import activity, mActivity, api_version
+from kivy.clock import mainthread
+from jnius import cast, detach
+from android import mActivity, api_version
 from os.path import exists, basename
-from .sharedstorage import SharedStorage
+from threading import Thread, RLock
+from concurrent.futures import Future
+from .sharedstorage import URI_CACHE_SIZE
+from .lrucache import LRUCache
+from . import mediastore
+from . import metrics
+from . import scheduler
+from .javaclass import JavaClass
+from .session import get_session
 
-JString = autoclass('java.lang.String')
-Intent  = autoclass('android.content.Intent')
-MediaStoreFiles = autoclass('android.provider.MediaStore$Files')
-MediaStoreMediaColumns = autoclass('android.provider.MediaStore$MediaColumns')
-ContentValues = autoclass('android.content.ContentValues')
-ContentUris = autoclass('android.content.ContentUris')
-ArrayList = autoclass('java.util.ArrayList')
+JString = JavaClass('java.lang.String')
+Intent  = JavaClass('android.content.Intent')
+ContentValues = JavaClass('android.content.ContentValues')
+ContentUris = JavaClass('android.content.ContentUris')
+ArrayList = JavaClass('java.util.ArrayList')
+ContentProviderOperation = JavaClass('android.content.ContentProviderOperation')
+MediaStore = JavaClass('android.provider.MediaStore')
 
 # Source https://github.com/Android-for-Python/androidstorage4kivy
 
+# The most specific MIME type of all of MIME_types,
+# 'image/png', 'image/*', or '*/*'. An unknown (empty) type could be
+# anything, so it is '*/*'. MIME types are not case sensitive.
+def common_MIME_type(MIME_types):
+    MIME_types = [m.lower() if m else None for m in MIME_types]
+    if len(MIME_types) == 0 or None in MIME_types:
+        return '*/*'
+    MIME_types = set(MIME_types)
+    if len(MIME_types) == 1:
+        return MIME_types.pop()
+    roots = set([m.split('/')[0] for m in MIME_types])
+    if len(roots) == 1:
+        return roots.pop() + '/*'
+    return '*/*'
+
+
 class ShareSheet():
 
+    # uri string to MIME type, shared by all instances
+    _MIME_cache = LRUCache(URI_CACHE_SIZE)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.legacy_uri_list = []
+        # legacy_uri_list is also used by the worker threads
+        self._legacy_lock = RLock()
 
+    @metrics.measure('share_plain_text', returns_result = False)
     def share_plain_text(self, plain_text, app = None):
         try:
             self._cleanup_legacy_uri_list()
-            self.plain_text = plain_text 
-            self.send = Intent()
-            self.send.setAction(Intent.ACTION_SEND)  
-            self.send.setType("text/plain")
-            self.send.putExtra(Intent.EXTRA_TEXT, JString(self.plain_text))
+            send = Intent()
+            send.setAction(self._intent('ACTION_SEND'))
+            send.setType("text/plain")
+            send.putExtra(self._intent('EXTRA_TEXT'), JString(plain_text))
             if app:
-                self.send.setPackage(app)
-                mActivity.startActivity(self.send)
+                send.setPackage(app)
+                mActivity.startActivity(send)
             else:
-                self.send1 = Intent.createChooser(self.send,None)
-                mActivity.startActivity(self.send1)
+                mActivity.startActivity(Intent.createChooser(send,None))
         except Exception as e:
             Logger.warning('ShareSheet().share_plain_text()')
             Logger.warning(str(e))
 
+    @metrics.measure('share_file', returns_result = False)
     def share_file(self, shared_file, app = None):
         try:
-            self._cleanup_legacy_uri_list()
-            if shared_file == None:
-                return
-            uri = self._legacy_create_uri(shared_file)
-            if uri == None:
-                return
-            cr =  mActivity.getContentResolver()
-            self.MIME = cr.getType(uri)
-            self.parcelable = cast('android.os.Parcelable', uri)  
-            self.send = Intent()
-            self.send.setAction(Intent.ACTION_SEND)  
-            self.send.setType(self.MIME)
-            self.send.putExtra(Intent.EXTRA_STREAM, self.parcelable)
-            self.send.addFlags(Intent.FLAG_GRANT_READ_URI_PERMISSION)
-            if app:
-                self.send.setPackage(app)
-                mActivity.startActivity(self.send)
-            else:
-                self.choose = Intent.createChooser(self.send,None)
-                mActivity.startActivity(self.choose)
+            intent = self._share_file_intent(shared_file, app)
+            if intent:
+                mActivity.startActivity(intent)
         except Exception as e:
             Logger.warning('ShareSheet().share_file()')
             Logger.warning(str(e))
 
+    @metrics.measure('view_file', returns_result = False)
     def view_file(self, shared_file):
         try:
-            self._cleanup_legacy_uri_list()
-            if shared_file == None:
-                return
-            uri = self._legacy_create_uri(shared_file)
-            if uri == None:
-                return
-            cr =  mActivity.getContentResolver()
-            self.MIME = cr.getType(uri)
-            self.send = Intent()
-            self.send.setAction(Intent.ACTION_VIEW)
-            self.send.addFlags(Intent.FLAG_GRANT_READ_URI_PERMISSION)
-            self.send.setDataAndType(uri, self.MIME)
-            mActivity.startActivity(self.send)
+            intent = self._view_file_intent(shared_file)
+            if intent:
+                mActivity.startActivity(intent)
         except Exception as e:
             Logger.warning('ShareSheet().view_file()')
             Logger.warning(str(e))
 
+    # The uris and the Intent are prepared on a worker thread, the
+    # ShareSheet is started on the Kivy main thread.
     def share_file_list(self, shared_file_list, app = None):
+        self.share_file_list_async(shared_file_list, app)
+
+    ###################
+    # Asynchronous
+    ###################
+
+    # These prepare the uris and the Intent on a worker thread, and start
+    # the activity on the Kivy main thread.
+    # Each returns a concurrent.futures.Future, its result is True if the
+    # activity was started, else False.
+    # callback(result) is called on the Kivy main thread.
+
+    def share_file_async(self, shared_file, app = None, callback = None):
+        return self._submit('share_file', self._share_file_intent,
+                            (shared_file, app), callback)
+
+    def view_file_async(self, shared_file, callback = None):
+        return self._submit('view_file', self._view_file_intent,
+                            (shared_file,), callback)
+
+    def share_file_list_async(self, shared_file_list, app = None,
+                              callback = None):
+        if shared_file_list != None:
+            shared_file_list = list(shared_file_list)
+        return self._submit('share_file_list', self._share_file_list_intent,
+                            (shared_file_list, app), callback)
+
+    # Copy private files to shared storage (as copy_many_to_shared()),
+    # then share them.
+    def copy_and_share(self, private_file_list, collection = None,
+                       app = None, callback = None):
+        if private_file_list != None:
+            private_file_list = list(private_file_list)
+        return self._submit('copy_and_share', self._copy_and_share_intent,
+                            (private_file_list, collection, app), callback)
+
+    ###################
+    # Private
+    ###################
+
+    def _submit(self, operation, prepare, args, callback):
+        future = Future()
+        Thread(target = self._prepare,
+               args = (operation, prepare, args, future, callback),
+               daemon = True).start()
+        return future
+
+    # On a worker thread
+    def _prepare(self, operation, prepare, args, future, callback):
+        intent = None
         try:
-            self._cleanup_legacy_uri_list()  
-            if shared_file_list == None or len(shared_file_list) == 0:
-                return
-            if len(shared_file_list) == 1:
-                self.share_file(shared_file_list[0], app)
-                return
-            uri_list = []
-            for shared_file in shared_file_list:
-                uri = self._legacy_create_uri(shared_file)
-                if uri:
-                    uri_list.append(uri)
-            if len(uri_list) == 0:
-                return
-            cr =  mActivity.getContentResolver()
-            self.MIME = cr.getType(uri_list[0])
-            self.send = Intent()
-            self.send.setAction(Intent.ACTION_SEND_MULTIPLE)
-            self.send.setType(self.MIME)
-            self.parcelable = ArrayList()
-            for uri in uri_list:
-                 self.parcelable.add(uri)
-            self.send.putParcelableArrayListExtra(Intent.EXTRA_STREAM,
-                                                  self.parcelable)
-            self.send.addFlags(Intent.FLAG_GRANT_READ_URI_PERMISSION)
-            if app:
-                self.send.setPackage(app)
-                mActivity.startActivity(self.send)
-            else:
-                self.choose = Intent.createChooser(self.send,None)
-                mActivity.startActivity(self.choose)
+            intent = prepare(*args)
         except Exception as e:
-            Logger.warning('ShareSheet().share_file_list()')
-            Logger.warning(str(e))            
+            Logger.warning('ShareSheet().' + operation + '()')
+            Logger.warning(str(e))
+        finally:
+            detach()
+        self._start(operation, intent, future, callback)
+
+    @mainthread
+    def _start(self, operation, intent, future, callback):
+        started = False
+        if intent:
+            try:
+                mActivity.startActivity(intent)
+                started = True
+            except Exception as e:
+                Logger.warning('ShareSheet().' + operation + '()')
+                Logger.warning(str(e))
+        future.set_result(started)
+        if callback:
+            callback(started)
+
+    # The Intents, or None
+
+    @metrics.measure('share_file')
+    @scheduler.scheduled('interactive')
+    def _share_file_intent(self, shared_file, app):
+        with self._legacy_lock:
+            self._cleanup_legacy_uri_list()
+            if shared_file == None:
+                return None
+            uri = self._legacy_create_uri(shared_file)
+        if uri == None:
+            return None
+        MIME = self._get_MIME_type([uri])
+        parcelable = cast('android.os.Parcelable', uri)  
+        send = Intent()
+        send.setAction(self._intent('ACTION_SEND'))
+        send.setType(MIME)
+        send.putExtra(self._intent('EXTRA_STREAM'), parcelable)
+        send.addFlags(self._intent('FLAG_GRANT_READ_URI_PERMISSION'))
+        if app:
+            send.setPackage(app)
+            return send
+        return Intent.createChooser(send,None)
+
+    @metrics.measure('view_file')
+    @scheduler.scheduled('interactive')
+    def _view_file_intent(self, shared_file):
+        with self._legacy_lock:
+            self._cleanup_legacy_uri_list()
+            if shared_file == None:
+                return None
+            uri = self._legacy_create_uri(shared_file)
+        if uri == None:
+            return None
+        MIME = self._get_MIME_type([uri])
+        send = Intent()
+        send.setAction(self._intent('ACTION_VIEW'))
+        send.addFlags(self._intent('FLAG_GRANT_READ_URI_PERMISSION'))
+        send.setDataAndType(uri, MIME)
+        return send
+
+    @metrics.measure('share_file_list')
+    @scheduler.scheduled('interactive')
+    def _share_file_list_intent(self, shared_file_list, app):
+        if shared_file_list != None and len(shared_file_list) == 1:
+            return self._share_file_intent(shared_file_list[0], app)
+        with self._legacy_lock:
+            self._cleanup_legacy_uri_list()
+            if shared_file_list == None or len(shared_file_list) == 0:
+                return None
+            uri_list = self._legacy_create_uris(shared_file_list)
+        if len(uri_list) == 0:
+            return None
+        MIME = self._get_MIME_type(uri_list)
+        send = Intent()
+        send.setAction(self._intent('ACTION_SEND_MULTIPLE'))
+        send.setType(MIME)
+        parcelable = ArrayList()
+        for uri in uri_list:
+             parcelable.add(uri)
+        send.putParcelableArrayListExtra(self._intent('EXTRA_STREAM'),
+                                         parcelable)
+        send.addFlags(self._intent('FLAG_GRANT_READ_URI_PERMISSION'))
+        if app:
+            send.setPackage(app)
+            return send
+        return Intent.createChooser(send,None)
+
+    @metrics.measure('copy_and_share')
+    @scheduler.scheduled('interactive')
+    def _copy_and_share_intent(self, private_file_list, collection, app):
+        if not private_file_list:
+            return None
+        shared_file_list = get_session().storage.copy_many_to_shared(\
+            private_file_list, collection)
+        shared_file_list = [f for f in shared_file_list if f]
+        if not shared_file_list:
+            return None
+        return self._share_file_list_intent(shared_file_list, app)
+
+    # The common MIME type of uri_list, in one pass. Each uri's type is
+    # remembered, so only new uris are a ContentResolver call.
+    def _get_MIME_type(self, uri_list):
+        MIME_types = set()
+        cr = None
+        for uri in uri_list:
+            key = uri.toString()
+            MIME = self._MIME_cache.get(key)
+            if MIME == None:
+                if cr == None:
+                    cr = get_session().resolver
+                # '' is a remembered unknown type
+                MIME = cr.getType(uri) or ''
+                self._MIME_cache.put(key, MIME)
+            MIME_types.add(MIME)
+        return common_MIME_type(MIME_types)
+
+    # An Intent constant, read once
+    def _intent(self, name):
+        return get_session().static(Intent, name)
 
     ######################################################
     # Legacy MediaStore (Android < 10) interface
@@ -137,56 +281,141 @@ class ShareSheet():
                     self._legacy_destroy_uri(shared_file)
                     # create uri
                     file_name = basename(shared_file)
-                    self.display_name = file_name
-                    self.MIME_type =\
-                        SharedStorage().get_file_MIME_type(file_name)
+                    session = get_session()
+                    MIME_type =\
+                        session.storage.get_file_MIME_type(file_name)
                     cv = ContentValues()
-                    cv.put(MediaStoreMediaColumns.DISPLAY_NAME,
-                           self.display_name)
-                    cv.put(MediaStoreMediaColumns.MIME_TYPE,
-                           self.MIME_type)
-                    cv.put(MediaStoreMediaColumns.DATA, shared_file)
-                    root_uri = MediaStoreFiles.getContentUri('external')
-                    context = mActivity.getApplicationContext()
-                    uri = context.getContentResolver().insert(root_uri, cv)
+                    cv.put(mediastore.DISPLAY_NAME[0], file_name)
+                    cv.put(mediastore.MIME_TYPE[0], MIME_type)
+                    cv.put(mediastore.DATA[0], shared_file)
+                    uri = session.resolver.insert(session.root_uri('files'),
+                                                  cv)
                     uri = cast('android.net.Uri',uri)
                     self.legacy_uri_list.append(uri)
+                    self._MIME_cache.put(uri.toString(), MIME_type)
             else:
                 uri = cast('android.net.Uri',shared_file)
         return uri
 
-    # Destroy a previously created uri
-    # The referenced file is unchanged,
-    # and is still visible in the file system.
+    # Returns the uris of shared_file_list, in order.
+    # On Android < 10, one query and one delete for the old uris
+    # (per MAX_SQL_ARGS files), and one batch of inserts.
+    def _legacy_create_uris(self, shared_file_list):
+        if api_version > 28:
+            return [cast('android.net.Uri', f) for f in shared_file_list
+                    if f != None and type(f) != str]
+        paths = []
+        for f in shared_file_list:
+            if type(f) == str and exists(f) and f not in paths:
+                paths.append(f)
+        created = {}
+        if paths:
+            session = get_session()
+            cr = session.resolver
+            # If display_name still around, should (!) never happen
+            self._legacy_destroy_uris(cr, paths)
+            root_uri = session.root_uri('files')
+            ss = session.storage
+            values = []
+            MIME_types = []
+            operations = ArrayList()
+            for path in paths:
+                MIME_types.append(ss.get_file_MIME_type(basename(path)))
+                cv = ContentValues()
+                cv.put(mediastore.DISPLAY_NAME[0], basename(path))
+                cv.put(mediastore.MIME_TYPE[0], MIME_types[-1])
+                cv.put(mediastore.DATA[0], path)
+                values.append(cv)
+                operations.add(ContentProviderOperation.newInsert(root_uri).\
+                               withValues(cv).build())
+            try:
+                results = cr.applyBatch(session.static(MediaStore,
+                                                       'AUTHORITY'),
+                                        operations)
+                for path, result in zip(paths, results):
+                    created[path] = cast('android.net.Uri', result.uri)
+            except Exception as e:
+                Logger.warning('ShareSheet().share_file_list()')
+                Logger.warning(str(e))
+                # Some rows may have been inserted
+                self._legacy_destroy_uris(cr, paths)
+                for path, cv in zip(paths, values):
+                    try:
+                        created[path] =\
+                            cast('android.net.Uri', cr.insert(root_uri, cv))
+                    except Exception as e:
+                        Logger.warning('ShareSheet().share_file_list()')
+                        Logger.warning(str(e))
+            for path, MIME_type in zip(paths, MIME_types):
+                if path in created:
+                    self.legacy_uri_list.append(created[path])
+                    # So the share needs no getType()
+                    self._MIME_cache.put(created[path].toString(), MIME_type)
+        uri_list = []
+        for f in shared_file_list:
+            if type(f) == str:
+                if f in created:
+                    uri_list.append(created[f])
+            elif f != None:
+                uri_list.append(cast('android.net.Uri', f))
+        return uri_list
+
+    # Destroy the previously created uris, one delete per MAX_SQL_ARGS
+    # The referenced files are unchanged,
+    # and are still visible in the file system.
     def _cleanup_legacy_uri_list(self):
-        resolver = mActivity.getApplicationContext().getContentResolver()
-        for legacy_uri in self.legacy_uri_list:
-            resolver.delete(legacy_uri,None,None)
-        self.legacy_uri_list = []
+        with self._legacy_lock:
+            if not self.legacy_uri_list:
+                return
+            resolver = get_session().resolver
+            ids = []
+            for u in self.legacy_uri_list:
+                ids.append(str(ContentUris.parseId(u)))
+                self._MIME_cache.pop(u.toString())
+            self.legacy_uri_list = []
+            self._legacy_delete_ids(resolver, ids)
+
+    # Destroy the uris with the same display_name as each of paths,
+    # one query per MAX_SQL_ARGS names.
+    def _legacy_destroy_uris(self, cr, paths):
+        root_uri = get_session().root_uri('files')
+        names = sorted(set([basename(p) for p in paths]))
+        ids = []
+        for selection, args in mediastore.in_chunks(mediastore.DISPLAY_NAME,
+                                                    names):
+            rows = mediastore.query(cr, root_uri,
+                                    [mediastore.ID, mediastore.DISPLAY_NAME],
+                                    selection, args,
+                                    mediastore.ID[0] + ' ASC')
+            # As _legacy_destroy_uri(), the first uri with each name
+            found = set()
+            for id, name in rows:
+                if name not in found:
+                    found.add(name)
+                    ids.append(str(id))
+        self._legacy_delete_ids(cr, ids)
+
+    def _legacy_delete_ids(self, cr, ids):
+        root_uri = get_session().root_uri('files')
+        for selection, args in mediastore.in_chunks(mediastore.ID, ids):
+            cr.delete(root_uri, selection, args)
 
     # This destroys a uri with the same display_name 
     # The referenced file is unchanged,
     # and is still visible in the file system.
     def _legacy_destroy_uri(self, shared_file):
         file_name = basename(shared_file)
-        root_uri = MediaStoreFiles.getContentUri('external')
-        self.selection = MediaStoreMediaColumns.DISPLAY_NAME+"=?" 
-        self.args = [file_name]
-        context = mActivity.getApplicationContext()
-        cursor = context.getContentResolver().query(root_uri, None,
-                                                    self.selection,
-                                                    self.args, None)
+        root_uri = get_session().root_uri('files')
+        selection = mediastore.DISPLAY_NAME[0]+"=?" 
+        args = [file_name]
+        cr = get_session().resolver
+        rows = mediastore.query(cr, root_uri,
+                                [mediastore.ID, mediastore.DISPLAY_NAME],
+                                selection, args)
         uri = None
-        if cursor:
-            while cursor.moveToNext():
-                dn = MediaStoreMediaColumns.DISPLAY_NAME
-                index = cursor.getColumnIndex(dn)
-                fileName = cursor.getString(index)
-                if file_name == fileName:
-                    id_index = cursor.getColumnIndex('_id')
-                    id = cursor.getLong(id_index)
-                    uri = ContentUris.withAppendedId(root_uri,id)
-                    break
-            cursor.close()
+        for id, fileName in rows:
+            if file_name == fileName:
+                uri = ContentUris.withAppendedId(root_uri,id)
+                break
         if uri:
-            context.getContentResolver().delete(uri,None,None)
+            cr.delete(uri,None,None)
@@ -0,0 +1,164 @@
+from android import api_version
+from contextlib import contextmanager
+from .javaclass import JavaClass
+from .session import get_session
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# Thumbnails and media dimensions, read without copying the file, see
+# SharedStorage.get_thumbnail() and get_metadata().
+# A source is a dict with the file's content 'uri', or on Android < 10
+# perhaps its 'path', and its 'name' and 'MIME_type'.
+
+Bitmap = JavaClass('android.graphics.Bitmap')
+CompressFormat = JavaClass('android.graphics.Bitmap$CompressFormat')
+BitmapFactory = JavaClass('android.graphics.BitmapFactory')
+BitmapFactoryOptions = JavaClass('android.graphics.BitmapFactory$Options')
+MediaMetadataRetriever = JavaClass('android.media.MediaMetadataRetriever')
+FileOutputStream = JavaClass('java.io.FileOutputStream')
+Size = JavaClass('android.util.Size')
+
+# The values of the MediaMetadataRetriever constants
+METADATA_KEY_DURATION = 9
+METADATA_KEY_VIDEO_WIDTH = 18
+METADATA_KEY_VIDEO_HEIGHT = 19
+
+JPEG_QUALITY = 85
+
+
+# 'image', 'video', 'audio', or another MIME type root
+def media_kind(source):
+    return (source['MIME_type'] or '').split('/')[0].lower()
+
+
+# Write a thumbnail of the source, no more than size pixels wide or high,
+# to file_path as a JPEG, or if format is 'png' a PNG.
+# Android >= 10 the MediaStore (or documents provider) makes the thumbnail,
+# and keeps it. Else an image is decoded at a reduced size, and a video
+# frame is decoded. Raises an exception if there is no thumbnail.
+def write_thumbnail(cr, source, size, format, file_path):
+    bitmap = None
+    try:
+        if source['uri'] != None and api_version > 28:
+            bitmap = cr.loadThumbnail(source['uri'], Size(size, size), None)
+        elif media_kind(source) == 'image':
+            bitmap = _decode_sampled(cr, source, size)
+        elif media_kind(source) == 'video':
+            with _retriever(cr, source) as retriever:
+                bitmap = retriever.getFrameAtTime()
+        if not bitmap:
+            raise ValueError('No thumbnail for ' + str(source['name']))
+        scaled = _fit(bitmap, size)
+        if scaled is not bitmap:
+            bitmap.recycle()
+            bitmap = scaled
+        _compress(bitmap, format, file_path)
+    finally:
+        # The pixels are not Java heap, free them now
+        if bitmap:
+            bitmap.recycle()
+
+
+# Fill in the 'width', 'height', and 'duration' of metadata that are
+# None, from the file's header; images are not decoded.
+def read_metadata(cr, source, metadata):
+    kind = media_kind(source)
+    if kind == 'image' and metadata['width'] == None:
+        options = BitmapFactoryOptions()
+        options.inJustDecodeBounds = True
+        with _file_descriptor(cr, source) as fd:
+            _decode(source, fd, options)
+        if options.outWidth > 0:
+            metadata['width'] = options.outWidth
+            metadata['height'] = options.outHeight
+    elif kind in ['video', 'audio'] and metadata['duration'] == None:
+        with _retriever(cr, source) as retriever:
+            metadata['duration'] =\
+                _int(retriever.extractMetadata(METADATA_KEY_DURATION))
+            if kind == 'video' and metadata['width'] == None:
+                metadata['width'] =\
+                    _int(retriever.extractMetadata(METADATA_KEY_VIDEO_WIDTH))
+                metadata['height'] =\
+                    _int(retriever.extractMetadata(METADATA_KEY_VIDEO_HEIGHT))
+
+
+###################
+# Private
+###################
+
+# Decode with the largest power of 2 reduction that is at least size.
+# One file descriptor for both decodes, a decode does not move its offset.
+def _decode_sampled(cr, source, size):
+    options = BitmapFactoryOptions()
+    options.inJustDecodeBounds = True
+    with _file_descriptor(cr, source) as fd:
+        _decode(source, fd, options)
+        width = options.outWidth
+        height = options.outHeight
+        if width <= 0 or height <= 0:
+            return None
+        sample = 1
+        while max(width, height) // (sample * 2) >= size:
+            sample *= 2
+        options.inJustDecodeBounds = False
+        options.inSampleSize = sample
+        return _decode(source, fd, options)
+
+
+def _decode(source, fd, options):
+    if fd == None:
+        return BitmapFactory.decodeFile(source['path'], options)
+    return BitmapFactory.decodeFileDescriptor(fd, None, options)
+
+
+# Yields a java.io.FileDescriptor, or None for a path
+@contextmanager
+def _file_descriptor(cr, source):
+    if source['path']:
+        yield None
+        return
+    pfd = cr.openFileDescriptor(source['uri'], 'r')
+    try:
+        yield pfd.getFileDescriptor()
+    finally:
+        pfd.close()
+
+
+@contextmanager
+def _retriever(cr, source):
+    retriever = MediaMetadataRetriever()
+    try:
+        with _file_descriptor(cr, source) as fd:
+            retriever.setDataSource(source['path'] if fd == None else fd)
+            yield retriever
+    finally:
+        retriever.release()
+
+
+# A bitmap no more than size pixels wide or high, the same aspect ratio
+def _fit(bitmap, size):
+    width = bitmap.getWidth()
+    height = bitmap.getHeight()
+    if max(width, height) <= size:
+        return bitmap
+    scale = size / max(width, height)
+    return Bitmap.createScaledBitmap(bitmap, max(1, round(width * scale)),
+                                     max(1, round(height * scale)), True)
+
+
+def _compress(bitmap, format, file_path):
+    name = 'PNG' if format == 'png' else 'JPEG'
+    compress_format = get_session().static(CompressFormat, name)
+    stream = FileOutputStream(file_path)
+    try:
+        if not bitmap.compress(compress_format, JPEG_QUALITY, stream):
+            raise ValueError('Bitmap.compress() failed')
+    finally:
+        stream.close()
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
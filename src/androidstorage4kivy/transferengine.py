@@ -0,0 +1,201 @@
+from kivy.logger import Logger
+from kivy.clock import Clock
+from jnius import detach
+from threading import Thread, Lock
+from queue import Queue
+from .sharedstorage import SharedStorage
+from .javaclass import find_class
+from .scheduler import get_scheduler, ProgressListener, DirectExecutor
+
+# Source https://github.com/Android-for-Python/androidstorage4kivy
+
+# Run SharedStorage copies on a pool of worker threads.
+# Callbacks are scheduled with Kivy Clock, so they run on the main thread.
+# The copies are jobs of priority (see scheduler.py), by default 'bulk'.
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class TransferJob():
+
+    def __init__(self, operation, args, callback = None, progress = None):
+        self.operation = operation
+        self.args = args
+        self.callback = callback
+        self.progress = progress
+        self.result = None
+        self.bytes_transferred = 0
+        self.total_bytes = -1
+        self.cancelled = False
+        self.finished = False
+        self._lock = Lock()
+        self._signal = None
+        self._executor = None
+        self._listener = None
+        self._progress_scheduled = False
+
+    ###################
+    # Public methods
+    ###################
+
+    def cancel(self):
+        with self._lock:
+            if self.finished:
+                return
+            self.cancelled = True
+            signal = self._signal
+        if signal:
+            try:
+                signal.cancel()
+            except Exception as e:
+                Logger.warning('TransferJob.cancel():')
+                Logger.warning(str(e))
+
+    ###################
+    # Used by SharedStorage, on the worker thread
+    ###################
+
+    @property
+    def signal(self):
+        with self._lock:
+            if not self._signal:
+                self._signal = find_class('android.os.CancellationSignal')()
+                if self.cancelled:
+                    self._signal.cancel()
+            return self._signal
+
+    @property
+    def executor(self):
+        if not self._executor:
+            self._executor = DirectExecutor()
+        return self._executor
+
+    @property
+    def listener(self):
+        if not self._listener:
+            self._listener = ProgressListener(self)
+        return self._listener
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise TransferCancelled()
+
+    def set_total(self, total_bytes):
+        self.total_bytes = total_bytes
+
+    def set_progress(self, bytes_transferred):
+        self.bytes_transferred = bytes_transferred
+        if self.progress and not self._progress_scheduled:
+            # At most one pending progress report
+            self._progress_scheduled = True
+            Clock.schedule_once(self._report_progress)
+
+    ###################
+    # Private
+    ###################
+
+    def _report_progress(self, dt):
+        self._progress_scheduled = False
+        if self.progress and not self.cancelled:
+            self.progress(self)
+
+    def _report_result(self, dt):
+        if self.callback:
+            self.callback(self)
+
+
+class TransferEngine():
+
+    def __init__(self, max_workers = 2, priority = 'bulk', **kwargs):
+        super().__init__(**kwargs)
+        self.max_workers = max(1, max_workers)
+        self.priority = priority
+        self._queue = Queue()
+        self._threads = []
+        self._lock = Lock()
+
+    ###################
+    # Public methods
+    ###################
+
+    # callback(job) is called on completion, job.result is the return
+    # value of the SharedStorage method, None if cancelled.
+    # progress(job) reports job.bytes_transferred and job.total_bytes
+    # (-1 if unknown).
+
+    def copy_to_shared(self, private_file, collection = None,
+                       filepath = None, callback = None, progress = None):
+        return self._submit('_copy_to_shared',
+                            (private_file, collection, filepath),
+                            callback, progress)
+
+    def copy_from_shared(self, shared_file, callback = None, progress = None):
+        return self._submit('_copy_from_shared', (shared_file,),
+                            callback, progress)
+
+    # Resumable, see SharedStorage.copy_to_shared_resumable()
+    def copy_to_shared_resumable(self, private_file, collection = None,
+                                 filepath = None, return_hash = False,
+                                 callback = None, progress = None):
+        return self._submit('_copy_to_shared_resumable',
+                            (private_file, collection, filepath, return_hash),
+                            callback, progress)
+
+    def copy_from_shared_resumable(self, shared_file, return_hash = False,
+                                   callback = None, progress = None):
+        return self._submit('_copy_from_shared_resumable',
+                            (shared_file, return_hash), callback, progress)
+
+    def cancel(self, job):
+        if job:
+            job.cancel()
+
+    # Stop the worker threads, after the queued jobs are done.
+    def shutdown(self):
+        with self._lock:
+            for t in self._threads:
+                self._queue.put(None)
+            self._threads = []
+
+    ###################
+    # Private
+    ###################
+
+    def _submit(self, operation, args, callback, progress):
+        job = TransferJob(operation, args, callback, progress)
+        with self._lock:
+            if len(self._threads) < self.max_workers:
+                t = Thread(target = self._worker, daemon = True)
+                self._threads.append(t)
+                t.start()
+            self._queue.put(job)
+        return job
+
+    def _worker(self):
+        try:
+            while True:
+                job = self._queue.get()
+                if job == None:
+                    break
+                self._run(job)
+        finally:
+            # Threads that used the JVM must detach before they exit
+            detach()
+
+    def _run(self, job):
+        if not job.cancelled:
+            try:
+                ss = SharedStorage()
+                with get_scheduler().priority(self.priority):
+                    job.result = getattr(ss, job.operation)(*job.args, job)
+            except Exception as e:
+                if not job.cancelled:
+                    Logger.warning('TransferEngine._run():')
+                    Logger.warning(str(e))
+        with job._lock:
+            job.finished = True
+            if job.cancelled:
+                job.result = None
+        Clock.schedule_once(job._report_result)
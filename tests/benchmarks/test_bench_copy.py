@@ -0,0 +1,62 @@
+import os
+import pytest
+import fakedevice
+
+pytest.importorskip('pytest_benchmark')
+
+# The copy paths, for a BENCH_COPY_MB (default 100) MB file:
+#   FileUtils.copy()        Android >= 10
+#   StreamCopy              Android < 10 with faster_copy
+#   file descriptor copy    Android < 10, os.sendfile() or read/write
+#   Java stream loop        Android < 10, no file descriptor, no StreamCopy
+
+SIZE = int(os.environ.get('BENCH_COPY_MB', '100')) * 1024 * 1024
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'source.bin')
+    with open(path, 'wb') as f:
+        block = os.urandom(1024 * 1024)
+        for i in range(SIZE // len(block)):
+            f.write(block)
+    return path
+
+
+def copy_stream(source, destination):
+    from androidstorage4kivy.sharedstorage import SharedStorage,\
+        FileInputStream, FileOutputStream
+    rs = FileInputStream(source)
+    ws = FileOutputStream(destination)
+    try:
+        SharedStorage()._copy_stream(rs, ws)
+    finally:
+        ws.close()
+        rs.close()
+    assert os.path.getsize(destination) == SIZE
+
+
+def copy_fd(source, destination):
+    from androidstorage4kivy import SharedStorage
+    with open(source, 'rb') as rs, open(destination, 'wb') as ws:
+        SharedStorage()._copy_fd(rs.fileno(), ws.fileno())
+    assert os.path.getsize(destination) == SIZE
+
+
+@pytest.mark.parametrize('api_version, stream_copy, copy',
+                         [(30, False, copy_stream),
+                          (28, True, copy_stream),
+                          (28, False, copy_fd),
+                          (28, False, copy_stream)],
+                         ids = ['FileUtils', 'StreamCopy', 'fd',
+                                'java_loop'])
+def test_copy_paths(benchmark, tmp_path, source, api_version, stream_copy,
+                    copy):
+    fakedevice.install(api_version, str(tmp_path / 'device'), stream_copy)
+    destination = str(tmp_path / 'destination.bin')
+    try:
+        benchmark.pedantic(copy, (source, destination), rounds = 3)
+        benchmark.extra_info['MB_per_s'] = round(
+            SIZE / benchmark.stats.stats.mean / 1024 / 1024)
+    finally:
+        fakedevice.uninstall()
@@ -0,0 +1,34 @@
+import os
+import sys
+import subprocess
+import pytest
+from os.path import dirname, join, abspath
+
+pytest.importorskip('pytest_benchmark')
+
+# Package import time, in a new interpreter each round.
+
+TESTS = dirname(dirname(abspath(__file__)))
+PYTHONPATH = os.pathsep.join([join(dirname(TESTS), 'src'),
+                              join(TESTS, 'fakes')])
+IMPORTS = {'package' : 'import androidstorage4kivy',
+           'SharedStorage' : 'from androidstorage4kivy import SharedStorage',
+           'all' : 'from androidstorage4kivy import SharedStorage, ' +
+           'ShareSheet, Chooser, TransferEngine'}
+
+
+def run(statement):
+    code = 'import fakedevice.state as s\n' + statement +\
+        '\nprint(s.counters["autoclass"])'
+    env = dict(os.environ, PYTHONPATH = PYTHONPATH)
+    out = subprocess.run([sys.executable, '-c', code], env = env,
+                         check = True, capture_output = True, text = True)
+    return int(out.stdout.split()[-1])
+
+
+@pytest.mark.parametrize('name', list(IMPORTS))
+def test_import(benchmark, name):
+    autoclass_calls = benchmark.pedantic(run, (IMPORTS[name],), rounds = 5)
+    # Java classes are found on first use, not on import
+    assert autoclass_calls == 0
+    benchmark.extra_info['autoclass_calls'] = autoclass_calls
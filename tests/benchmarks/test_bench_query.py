@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# A MediaStore listing with only the columns used, and with every column.
+
+
+@pytest.fixture
+def collection(scoped_device):
+    from androidstorage4kivy import SharedStorage
+    SharedStorage().copy_many_to_shared([scoped_device.make_private_file(
+        'f' + str(i) + '.txt', 10) for i in range(1000)])
+    from androidstorage4kivy.session import get_session
+    return get_session().root_uri('files')
+
+
+def record_rows(benchmark, device, rounds):
+    counters = device.counters
+    for key in ('query_rows', 'query_cells', 'query_bytes'):
+        benchmark.extra_info[key] = counters[key] // rounds
+
+
+def test_query_projection(benchmark, scoped_device, collection):
+    from androidstorage4kivy import mediastore
+    cr = scoped_device.resolver
+    scoped_device.reset_counters()
+    rows = benchmark.pedantic(mediastore.query,
+                              (cr, collection,
+                               [mediastore.ID, mediastore.DISPLAY_NAME]),
+                              rounds = 5)
+    assert len(rows) == 1000
+    record_rows(benchmark, scoped_device, 5)
+
+
+def test_query_all_columns(benchmark, scoped_device, collection):
+    cr = scoped_device.resolver
+
+    # As the package queried before mediastore.query()
+    def query():
+        rows = []
+        cursor = cr.query(collection, None, None, None, None)
+        while cursor.moveToNext():
+            id = cursor.getLong(cursor.getColumnIndex('_id'))
+            name = cursor.getString(cursor.getColumnIndex('_display_name'))
+            rows.append((id, name))
+        cursor.close()
+        return rows
+
+    scoped_device.reset_counters()
+    rows = benchmark.pedantic(query, rounds = 5)
+    assert len(rows) == 1000
+    record_rows(benchmark, scoped_device, 5)
@@ -0,0 +1,285 @@
+import os
+import shutil
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# SharedStorage throughput, on Android 9 (legacy) and Android 11 (scoped).
+# extra_info records the JNI and Binder calls of one round.
+
+MB = 1024 * 1024
+
+
+def record_calls(benchmark, device, rounds):
+    counters = device.counters
+    benchmark.extra_info['jni_calls'] = counters['jni'] // rounds
+    benchmark.extra_info['binder_calls'] = counters['binder'] // rounds
+
+
+def test_copy_to_shared(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('movie.mp4', 8 * MB)
+    device.reset_counters()
+    benchmark.pedantic(ss.copy_to_shared, (private_file,), rounds = 5)
+    record_calls(benchmark, device, 5)
+
+
+def test_copy_to_shared_small_files(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    files = [device.make_private_file('f' + str(i) + '.txt', 1000)
+             for i in range(100)]
+
+    def copy_all():
+        for f in files:
+            ss.copy_to_shared(f)
+
+    device.reset_counters()
+    benchmark.pedantic(copy_all, rounds = 3)
+    record_calls(benchmark, device, 3)
+
+
+# 1,000 file export, one file at a time
+def test_export_1000_files(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    files = [device.make_private_file('f' + str(i) + '.txt', 100)
+             for i in range(1000)]
+
+    def copy_all():
+        for f in files:
+            ss.copy_to_shared(f)
+
+    device.reset_counters()
+    benchmark.pedantic(copy_all, rounds = 1)
+    record_calls(benchmark, device, 1)
+
+
+# 1,000 file export, one batch
+def test_export_1000_files_many(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    files = [device.make_private_file('f' + str(i) + '.txt', 100)
+             for i in range(1000)]
+    device.reset_counters()
+    benchmark.pedantic(ss.copy_many_to_shared, (files,), rounds = 1)
+    record_calls(benchmark, device, 1)
+
+
+def test_copy_from_shared_cold(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = ss.copy_to_shared(device.make_private_file('movie.mp4',
+                                                             8 * MB))
+    cache_dir = ss.get_cache_dir()
+
+    def empty_cache():
+        from androidstorage4kivy.cacheindex import get_cache_index
+        shutil.rmtree(cache_dir)
+        os.mkdir(cache_dir)
+        get_cache_index(cache_dir)._entries.clear()
+
+    device.reset_counters()
+    benchmark.pedantic(ss.copy_from_shared, (shared_file,),
+                       setup = empty_cache, rounds = 5)
+    record_calls(benchmark, device, 5)
+
+
+def test_copy_from_shared_warm(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = ss.copy_to_shared(device.make_private_file('movie.mp4',
+                                                             8 * MB))
+    ss.copy_from_shared(shared_file)
+    device.reset_counters()
+    benchmark.pedantic(ss.copy_from_shared, (shared_file,), rounds = 20)
+    record_calls(benchmark, device, 20)
+
+
+# The same, with a metrics listener
+def test_copy_from_shared_warm_metrics(benchmark, device):
+    from androidstorage4kivy import SharedStorage, metrics
+    ss = SharedStorage()
+    shared_file = ss.copy_to_shared(device.make_private_file('movie.mp4',
+                                                             8 * MB))
+    ss.copy_from_shared(shared_file)
+    with metrics.listening(metrics.MetricsAggregator()):
+        benchmark.pedantic(ss.copy_from_shared, (shared_file,), rounds = 20)
+
+
+def test_delete_shared(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('notes.txt', 1000)
+    shared = []
+
+    def create():
+        shared[:] = [ss.copy_to_shared(private_file)]
+        return (shared[0],), {}
+
+    benchmark.pedantic(ss.delete_shared, setup = create, rounds = 20)
+
+
+def test_list_shared(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    ss.copy_many_to_shared([device.make_private_file(
+        'f' + str(i) + '.txt', 10) for i in range(1000)])
+    device.reset_counters()
+    infos = benchmark.pedantic(lambda: list(ss.list_shared('Documents')),
+                               rounds = 3)
+    assert len(infos) == 1000
+    record_calls(benchmark, device, 3)
+
+
+# Chunked, checkpointed and hashed; compare with test_copy_to_shared
+def test_copy_to_shared_resumable(benchmark, device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('movie.mp4', 8 * MB)
+    device.reset_counters()
+    benchmark.pedantic(ss.copy_to_shared_resumable, (private_file,),
+                       rounds = 5)
+    record_calls(benchmark, device, 5)
+
+
+# Clean up a 1,000 file export, one file at a time, in one batch,
+# and as a tree
+@pytest.mark.parametrize('how', ['each', 'many', 'tree'])
+def test_delete_1000_files(benchmark, device, how):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    files = [device.make_private_file('f' + str(i) + '.txt', 10)
+             for i in range(1000)]
+    paths = ['Documents/FakeApp/f' + str(i) + '.txt' for i in range(1000)]
+
+    def export():
+        ss.clear_uri_cache()
+        ss.copy_many_to_shared(files)
+        device.reset_counters()
+        return (), {}
+
+    def delete():
+        if how == 'each':
+            for path in paths:
+                ss.delete_shared(path)
+        elif how == 'many':
+            ss.delete_shared_many(paths)
+        else:
+            ss.delete_shared_tree('Documents')
+
+    benchmark.pedantic(delete, setup = export, rounds = 3)
+    record_calls(benchmark, device, 1)
+    assert list(ss.list_shared('Documents')) == []
+
+
+# A repeated export of unchanged files, rewritten or skipped
+@pytest.mark.parametrize('skip_unchanged', [False, True],
+                         ids = ['rewrite', 'skip'])
+def test_reexport_unchanged(benchmark, device, skip_unchanged):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    files = [device.make_private_file('f' + str(i) + '.bin', 256 * 1024)
+             for i in range(100)]
+    ss.copy_many_to_shared(files, skip_unchanged = True)
+    device.reset_counters()
+    benchmark.pedantic(ss.copy_many_to_shared, (files, None, skip_unchanged),
+                       rounds = 3)
+    record_calls(benchmark, device, 3)
+
+
+# Mirror a 1,000 file tree, then again after 10 files changed
+@pytest.mark.parametrize('changed', [1000, 10], ids = ['all', 'resync'])
+def test_sync_tree_1000_files(benchmark, device, changed):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    names = ['d' + str(i % 10) + '/f' + str(i) + '.txt' for i in range(1000)]
+    files = [device.make_private_file('exports/' + n, 1000) for n in names]
+    private_dir = files[0][:-len(names[0]) - 1]
+
+    def export():
+        if changed == 1000:
+            ss.delete_shared_tree('Documents')
+        else:
+            ss.sync_tree(private_dir, 'Documents', 'exports')
+            for n in names[:changed]:
+                device.make_private_file('exports/' + n, 999)
+        device.reset_counters()
+        return (private_dir, 'Documents', 'exports'), {}
+
+    summary = benchmark.pedantic(ss.sync_tree, setup = export, rounds = 3)
+    record_calls(benchmark, device, 1)
+    assert len(summary['copied']) == changed
+
+
+# A gallery of 500 images, previewed by copying each file or from a
+# thumbnail. extra_info['bytes_per_item'] is the cache bytes per image.
+@pytest.mark.parametrize('how', ['copy', 'thumbnail'])
+def test_gallery_500_previews(benchmark, device, how):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_files = ss.copy_many_to_shared([device.make_private_media(
+        'p' + str(i) + '.jpg', 3000, 2000, size = 256 * 1024)
+        for i in range(500)])
+    cache_dir = ss.get_cache_dir()
+    thumbnail_dir = os.path.join(os.path.dirname(cache_dir), 'Thumbnails')
+    directory = cache_dir if how == 'copy' else thumbnail_dir
+
+    def empty_cache():
+        from androidstorage4kivy.cacheindex import get_cache_index
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.mkdir(directory)
+        get_cache_index(directory)._entries.clear()
+        device.reset_counters()
+        return (), {}
+
+    def preview_all():
+        if how == 'copy':
+            return [ss.copy_from_shared(f) for f in shared_files]
+        return [ss.get_thumbnail(f, 256) for f in shared_files]
+
+    previews = benchmark.pedantic(preview_all, setup = empty_cache,
+                                  rounds = 3)
+    record_calls(benchmark, device, 1)
+    assert all(previews)
+    benchmark.extra_info['bytes_per_item'] =\
+        sum([os.path.getsize(p) for p in previews]) // len(previews)
+
+
+# copy_from_shared() while a TransferEngine exports 8 MB files, bulk
+# copies unlimited or throttled to 20 MB/s. extra_info has the scheduler's
+# interactive wait p95 and the time bulk copies slept, in ms.
+@pytest.mark.parametrize('bulk_mb_per_s', [None, 20],
+                         ids = ['unthrottled', 'throttled'])
+def test_interactive_during_export(benchmark, device, bulk_mb_per_s):
+    from androidstorage4kivy import SharedStorage, TransferEngine
+    from androidstorage4kivy.scheduler import get_scheduler
+    ss = SharedStorage()
+    scheduler = get_scheduler()
+    if bulk_mb_per_s:
+        scheduler.bulk_bytes_per_second = bulk_mb_per_s * MB
+    shared_file = ss.copy_to_shared(device.make_private_file('photo.jpg', MB))
+    engine = TransferEngine()
+    jobs = [engine.copy_to_shared(device.make_private_file(
+        'movie' + str(i) + '.mp4', 8 * MB)) for i in range(8)]
+
+    def empty_cache():
+        shutil.rmtree(ss.get_cache_dir())
+        os.mkdir(ss.get_cache_dir())
+        return (shared_file,), {}
+
+    try:
+        scheduler.reset_stats()
+        benchmark.pedantic(ss.copy_from_shared, setup = empty_cache,
+                           rounds = 10)
+        stats = scheduler.stats()
+        benchmark.extra_info['interactive_wait_p95_ms'] =\
+            round(stats['interactive']['wait_p95'] * 1000, 3)
+        benchmark.extra_info['bulk_throttled_ms'] =\
+            round(stats['bulk']['throttled'] * 1000)
+    finally:
+        for job in jobs:
+            job.cancel()
+        engine.shutdown()
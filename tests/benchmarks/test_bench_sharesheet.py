@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# ShareSheet preparation, to startActivity().
+
+
+def test_share_file_list(benchmark, device):
+    from androidstorage4kivy import SharedStorage, ShareSheet
+    ss = SharedStorage()
+    files = ss.copy_many_to_shared([device.make_private_file(
+        'f' + str(i) + '.jpg', 1000) for i in range(300)])
+    share_sheet = ShareSheet()
+    device.reset_counters()
+
+    # Until the ShareSheet is started
+    def share():
+        started = len(device.started)
+        share_sheet.share_file_list(files)
+        device.run_until(lambda: len(device.started) > started)
+
+    benchmark.pedantic(share, rounds = 3)
+    counters = device.counters
+    benchmark.extra_info['jni_calls'] = counters['jni'] // 3
+    benchmark.extra_info['binder_calls'] = counters['binder'] // 3
+    assert len(device.started) == 3
+
+
+def test_share_file(benchmark, device):
+    from androidstorage4kivy import SharedStorage, ShareSheet
+    shared_file = SharedStorage().copy_to_shared(
+        device.make_private_file('a.jpg', 1000))
+    share_sheet = ShareSheet()
+    benchmark(share_sheet.share_file, shared_file)
+
+
+# Copy 100 private files and share them, until the ShareSheet is started
+def test_copy_and_share(benchmark, device):
+    from androidstorage4kivy import ShareSheet
+    files = [device.make_private_file('f' + str(i) + '.jpg', 1000)
+             for i in range(100)]
+    share_sheet = ShareSheet()
+
+    def copy_and_share():
+        future = share_sheet.copy_and_share(files)
+        device.run_until(future.done)
+        return future.result()
+
+    assert benchmark.pedantic(copy_and_share, rounds = 3)
+
+
+# A long export and share loop. extra_info records the JNI and Binder
+# calls and the Java objects created in one round, and the Java objects
+# still held after all rounds.
+def test_share_export_loop(benchmark, device):
+    from androidstorage4kivy import SharedStorage, ShareSheet
+    from fakedevice import state
+    files = [device.make_private_file('f' + str(i) + '.jpg', 1000)
+             for i in range(20)]
+    ss = SharedStorage()
+    share_sheet = ShareSheet()
+    held = state.live_objects()
+
+    def export_and_share():
+        for f in files:
+            shared_file = ss.copy_to_shared(f)
+            share_sheet.share_file(shared_file, 'org.other.app')
+            share_sheet.share_plain_text('Exported ' + f)
+        ss.copy_from_shared(shared_file)
+        # As if the started activities have returned
+        device.started.clear()
+
+    device.reset_counters()
+    benchmark.pedantic(export_and_share, rounds = 5)
+    counters = device.counters
+    benchmark.extra_info['jni_calls'] = counters['jni'] // 5
+    benchmark.extra_info['binder_calls'] = counters['binder'] // 5
+    benchmark.extra_info['java_objects'] = counters['java_objects'] // 5
+    benchmark.extra_info['java_objects_held'] = state.live_objects() - held
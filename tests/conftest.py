@@ -0,0 +1,40 @@
+import sys
+from os.path import dirname, join, abspath
+
+# Run the package off-device: the fake android, jnius and kivy modules
+# (see fakes/fakedevice) are imported before any installed ones.
+TESTS = dirname(abspath(__file__))
+FAKES = join(TESTS, 'fakes')
+SRC = join(dirname(TESTS), 'src')
+for path in (SRC, FAKES):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import pytest
+import fakedevice
+
+# Android 9 (legacy storage) and Android 11 (scoped storage)
+API_VERSIONS = [28, 30]
+
+
+# A new fake device per test. Parametrize with indirect = True to
+# choose the api_version.
+@pytest.fixture(params = API_VERSIONS, ids = lambda api: 'api' + str(api))
+def device(request, tmp_path):
+    d = fakedevice.install(request.param, str(tmp_path))
+    yield d
+    fakedevice.uninstall()
+
+
+@pytest.fixture
+def scoped_device(tmp_path):
+    d = fakedevice.install(30, str(tmp_path))
+    yield d
+    fakedevice.uninstall()
+
+
+@pytest.fixture
+def legacy_device(tmp_path):
+    d = fakedevice.install(28, str(tmp_path))
+    yield d
+    fakedevice.uninstall()
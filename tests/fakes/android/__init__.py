@@ -0,0 +1,11 @@
+import os
+import fakedevice
+
+# Fake python-for-android 'android' module, see fakedevice.
+# fakedevice.install() sets api_version.
+
+api_version = int(os.environ.get('FAKE_API_VERSION', '30'))
+mActivity = fakedevice.ActivityProxy()
+activity = fakedevice.activity_events
+autoclass = fakedevice.autoclass
+cast = fakedevice.cast
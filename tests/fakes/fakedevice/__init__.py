@@ -0,0 +1,13 @@
+# A headless simulator of the android and jnius api used by
+# androidstorage4kivy. The fake android, jnius and kivy modules in the
+# parent directory use it.
+#
+#     device = fakedevice.install(30, tmp_dir)   # Android 11
+#     from androidstorage4kivy import SharedStorage
+#
+# install() imports the package again, as api_version is read on import.
+
+from .javaobject import JavaObject, JavaException
+from .device import Device, install, uninstall, reload_package, autoclass,\
+    cast, activity_events, ActivityProxy
+from .state import counters, reset_counters
@@ -0,0 +1,767 @@
+import os
+import mimetypes
+from . import state
+from . import media
+from .javaobject import JavaObject, JavaException
+
+# Fake Java classes, the subset of the Android api used by the package.
+
+try:
+    from os import sendfile
+except ImportError:
+    sendfile = None
+
+EXTERNAL = 'content://media/external/'
+# FileUtils.copy() reports progress every COPY_CHECKPOINT_BYTES
+COPY_CHECKPOINT_BYTES = 512 * 1024
+
+
+def _device():
+    if state.device == None:
+        raise RuntimeError('No fake device, call fakedevice.install()')
+    return state.device
+
+
+class String(JavaObject):
+
+    def __new__(cls, value = ''):
+        return str(value)
+
+
+class Integer(JavaObject):
+
+    @staticmethod
+    def valueOf(value):
+        return int(value)
+
+
+class Uri(JavaObject):
+
+    def __init__(self, string):
+        self._string = string
+
+    @staticmethod
+    def parse(string):
+        return Uri(string)
+
+    def getScheme(self):
+        if '://' in self._string:
+            return self._string.split('://')[0]
+        return None
+
+    def getAuthority(self):
+        return self._string.split('://')[-1].split('/')[0]
+
+    def getPath(self):
+        rest = self._string.split('://')[-1]
+        if self._string.startswith('file://'):
+            return rest
+        return '/' + rest.split('/', 1)[-1]
+
+    def getLastPathSegment(self):
+        return self._string.rstrip('/').split('/')[-1]
+
+    def toString(self):
+        return self._string
+
+    def __eq__(self, other):
+        return isinstance(other, Uri) and other._string == self._string
+
+    def __hash__(self):
+        return hash(self._string)
+
+    def __repr__(self):
+        return 'Uri(' + self._string + ')'
+
+
+class File(JavaObject):
+
+    def __init__(self, path):
+        self._path = path
+
+    def getAbsolutePath(self):
+        return self._path
+
+    def getPath(self):
+        return self._path
+
+    def toString(self):
+        return self._path
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+
+class Environment(JavaObject):
+    DIRECTORY_ALARMS = 'Alarms'
+    DIRECTORY_AUDIOBOOKS = 'Audiobooks'
+    DIRECTORY_DCIM = 'DCIM'
+    DIRECTORY_DOCUMENTS = 'Documents'
+    DIRECTORY_DOWNLOADS = 'Download'
+    DIRECTORY_MOVIES = 'Movies'
+    DIRECTORY_MUSIC = 'Music'
+    DIRECTORY_NOTIFICATIONS = 'Notifications'
+    DIRECTORY_PICTURES = 'Pictures'
+    DIRECTORY_PODCASTS = 'Podcasts'
+    DIRECTORY_RECORDINGS = 'Recordings'
+    DIRECTORY_RINGTONES = 'Ringtones'
+    DIRECTORY_SCREENSHOTS = 'Screenshots'
+
+    @staticmethod
+    def getExternalStorageDirectory():
+        return File(_device()._storage_dir)
+
+
+class MediaColumns(JavaObject):
+    _ID = '_id'
+    DATA = '_data'
+    DISPLAY_NAME = '_display_name'
+    MIME_TYPE = 'mime_type'
+    SIZE = '_size'
+    DATE_MODIFIED = 'date_modified'
+    RELATIVE_PATH = 'relative_path'
+    IS_PENDING = 'is_pending'
+    GENERATION_MODIFIED = 'generation_modified'
+
+
+class MediaStore(JavaObject):
+    AUTHORITY = 'media'
+
+    # Android >= 11, the user is asked to confirm, see Device.answer_request()
+    @staticmethod
+    def createDeleteRequest(resolver, uris):
+        from .resolver import ContentResolver
+        if _device()._api_version < 30:
+            raise JavaException('java.lang.NoSuchMethodError: ' +
+                                'createDeleteRequest')
+        # As pyjnius, a Java argument must be a Java object
+        if not isinstance(resolver, ContentResolver):
+            raise JavaException('Invalid instance of ' + repr(resolver) +
+                                ', want android/content/ContentResolver')
+        state.count('binder')
+        state.count('binder.createDeleteRequest')
+        return PendingIntent('delete', list(uris._items))
+
+
+# Also its IntentSender
+class PendingIntent(JavaObject):
+
+    def __init__(self, kind, uris):
+        self._kind = kind
+        self._uris = uris
+
+    def getIntentSender(self):
+        return self
+
+
+class MediaStoreFiles(JavaObject):
+
+    @staticmethod
+    def getContentUri(volume):
+        return Uri('content://media/' + volume + '/file')
+
+
+class MediaStoreDownloads(JavaObject):
+    EXTERNAL_CONTENT_URI = Uri(EXTERNAL + 'downloads')
+
+
+class MediaStoreAudioMedia(JavaObject):
+    EXTERNAL_CONTENT_URI = Uri(EXTERNAL + 'audio/media')
+
+
+class MediaStoreImagesMedia(JavaObject):
+    EXTERNAL_CONTENT_URI = Uri(EXTERNAL + 'images/media')
+
+
+class MediaStoreVideoMedia(JavaObject):
+    EXTERNAL_CONTENT_URI = Uri(EXTERNAL + 'video/media')
+
+
+class ContentUris(JavaObject):
+
+    @staticmethod
+    def withAppendedId(uri, id):
+        return Uri(uri._string.rstrip('/') + '/' + str(id))
+
+    @staticmethod
+    def parseId(uri):
+        return int(uri._string.rstrip('/').split('/')[-1])
+
+
+class ContentValues(JavaObject):
+
+    def __init__(self):
+        self._values = {}
+
+    def put(self, key, value):
+        self._values[key] = value
+
+    def get(self, key):
+        return self._values.get(key)
+
+    def containsKey(self, key):
+        return key in self._values
+
+    def size(self):
+        return len(self._values)
+
+
+class ContentProviderResult(JavaObject):
+
+    def __init__(self, uri = None, count = None):
+        self.uri = uri
+        self.count = count
+
+
+class ContentProviderOperation(JavaObject):
+
+    def __init__(self, kind, uri):
+        self._kind = kind
+        self._uri = uri
+        self._values = {}
+        self._selection = None
+        self._args = None
+
+    @staticmethod
+    def newInsert(uri):
+        return ContentProviderOperation('insert', uri)
+
+    @staticmethod
+    def newUpdate(uri):
+        return ContentProviderOperation('update', uri)
+
+    @staticmethod
+    def newDelete(uri):
+        return ContentProviderOperation('delete', uri)
+
+    # The builder is the operation
+    def withValues(self, cv):
+        self._values.update(cv._values)
+        return self
+
+    def withValue(self, key, value):
+        self._values[key] = value
+        return self
+
+    def withSelection(self, selection, args):
+        self._selection = selection
+        self._args = args
+        return self
+
+    def build(self):
+        return self
+
+
+class ArrayList(JavaObject):
+
+    def __init__(self, items = None):
+        self._items = list(items or [])
+
+    def add(self, item):
+        self._items.append(item)
+        return True
+
+    def get(self, index):
+        return self._items[index]
+
+    def size(self):
+        return len(self._items)
+
+    def isEmpty(self):
+        return not self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Bundle(JavaObject):
+
+    def __init__(self):
+        self._values = {}
+
+    def putString(self, key, value):
+        self._values[key] = value
+
+    def putStringArray(self, key, value):
+        self._values[key] = list(value)
+
+    def putInt(self, key, value):
+        self._values[key] = int(value)
+
+    def putLong(self, key, value):
+        self._values[key] = int(value)
+
+    def getString(self, key):
+        return self._values.get(key)
+
+    def getInt(self, key, default = 0):
+        return self._values.get(key, default)
+
+    def getStringArray(self, key):
+        return self._values.get(key)
+
+
+class CancellationSignal(JavaObject):
+
+    def __init__(self):
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def isCanceled(self):
+        return self._cancelled
+
+    def throwIfCanceled(self):
+        if self._cancelled:
+            raise JavaException('android.os.OperationCanceledException')
+
+
+class MimeTypeMap(JavaObject):
+    # Where Android differs from Python's table
+    _android = {'ogg' : 'audio/ogg',
+                'mp3' : 'audio/mpeg',
+                'm4a' : 'audio/mp4',
+                'mkv' : 'video/x-matroska',
+                'csv' : 'text/comma-separated-values',
+                'webp' : 'image/webp'}
+    _singleton = None
+
+    @staticmethod
+    def getSingleton():
+        if MimeTypeMap._singleton == None:
+            MimeTypeMap._singleton = MimeTypeMap()
+        return MimeTypeMap._singleton
+
+    def getMimeTypeFromExtension(self, extension):
+        return MimeTypeMap._lookup(extension)
+
+    @staticmethod
+    def _lookup(extension):
+        if not extension:
+            return None
+        extension = extension.lower()
+        if extension in MimeTypeMap._android:
+            return MimeTypeMap._android[extension]
+        return mimetypes.types_map.get('.' + extension)
+
+    def hasExtension(self, extension):
+        return self.getMimeTypeFromExtension(extension) != None
+
+
+# java.io streams, and the streams ContentResolver opens
+
+class InputStream(JavaObject):
+
+    def __init__(self, file, on_close = None):
+        self._file = file
+        self._on_close = on_close
+
+    def read(self, buffer, offset = 0, length = None):
+        if length == None:
+            length = len(buffer) - offset
+        if length == 0:
+            return 0
+        view = memoryview(buffer)[offset:offset + length]
+        num = self._file.readinto(view)
+        if not num:
+            return -1
+        return num
+
+    def available(self):
+        return 0
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            if self._on_close:
+                self._on_close()
+
+
+class OutputStream(JavaObject):
+
+    def __init__(self, file, on_close = None):
+        self._file = file
+        self._on_close = on_close
+
+    def write(self, buffer, offset = 0, length = None):
+        if type(buffer) == int:
+            self._file.write(bytes([buffer]))
+            return
+        if length == None:
+            length = len(buffer) - offset
+        self._file.write(memoryview(buffer)[offset:offset + length])
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            if self._on_close:
+                self._on_close()
+
+
+class FileInputStream(InputStream):
+
+    def __init__(self, path):
+        try:
+            super().__init__(open(str(path), 'rb'))
+        except OSError as e:
+            raise JavaException('java.io.FileNotFoundException: ' + str(e))
+
+
+class FileOutputStream(OutputStream):
+
+    def __init__(self, path, append = False):
+        try:
+            super().__init__(open(str(path), 'ab' if append else 'wb'))
+        except OSError as e:
+            raise JavaException('java.io.FileNotFoundException: ' + str(e))
+
+
+class _Runnable():
+
+    def __init__(self, function):
+        self._function = function
+
+    def run(self):
+        self._function()
+
+
+# Copies in the kernel when both streams are files, as Android does
+class FileUtils(JavaObject):
+
+    @staticmethod
+    def copy(rs, ws, signal = None, executor = None, listener = None):
+        ws._file.flush()
+        total = 0
+        use_sendfile = sendfile != None
+        buffer = bytearray(64 * 1024)
+        while True:
+            if signal and signal._cancelled:
+                raise JavaException('android.os.OperationCanceledException')
+            num = 0
+            if use_sendfile:
+                try:
+                    num = sendfile(ws._file.fileno(), rs._file.fileno(),
+                                   None, COPY_CHECKPOINT_BYTES)
+                except (OSError, ValueError, AttributeError):
+                    use_sendfile = False
+                    continue
+            else:
+                while num < COPY_CHECKPOINT_BYTES:
+                    n = rs._file.readinto(buffer)
+                    if not n:
+                        break
+                    ws._file.write(memoryview(buffer)[:n])
+                    num += n
+            if num == 0:
+                break
+            total += num
+            if listener and executor:
+                progress = total
+                executor.execute(_Runnable(
+                    lambda: listener.onProgress(progress)))
+        return total
+
+
+# The optional faster_copy class (Android < 10), the constructor copies
+class StreamCopy(JavaObject):
+
+    def __init__(self, rs, ws):
+        buffer = bytearray(1024 * 1024)
+        while True:
+            num = rs._file.readinto(buffer)
+            if not num:
+                break
+            ws._file.write(memoryview(buffer)[:num])
+
+
+class FileDescriptor(JavaObject):
+
+    def __init__(self, fd):
+        self._fd = fd
+
+
+class Size(JavaObject):
+
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+
+    def getWidth(self):
+        return self._width
+
+    def getHeight(self):
+        return self._height
+
+
+class BitmapCompressFormat(JavaObject):
+
+    def __init__(self, png):
+        self._png = png
+
+
+BitmapCompressFormat.JPEG = BitmapCompressFormat(False)
+BitmapCompressFormat.PNG = BitmapCompressFormat(True)
+
+
+# A decoded image, the pixels are not simulated
+class Bitmap(JavaObject):
+
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+        self._recycled = False
+
+    @staticmethod
+    def createScaledBitmap(src, width, height, filter):
+        return Bitmap(width, height)
+
+    def getWidth(self):
+        return self._width
+
+    def getHeight(self):
+        return self._height
+
+    # Writes a fake image, a JPEG is 1 byte per 8 pixels, a PNG 1 per 2
+    def compress(self, format, quality, stream):
+        if self._recycled:
+            raise JavaException('java.lang.IllegalStateException: recycled')
+        pixels = self._width * self._height
+        if format._png:
+            size = pixels // 2
+        else:
+            size = pixels // 8
+        stream.write(media.encode(self._width, self._height, size = size))
+        return True
+
+    def recycle(self):
+        self._recycled = True
+
+    def isRecycled(self):
+        return self._recycled
+
+
+class BitmapFactoryOptions(JavaObject):
+
+    def __init__(self):
+        self.inJustDecodeBounds = False
+        self.inSampleSize = 1
+        self.outWidth = -1
+        self.outHeight = -1
+
+
+# Decodes fake images (see media.py), a bounds decode reads the header,
+# a decode reads the file. counters['media_bytes_read'] counts both.
+class BitmapFactory(JavaObject):
+
+    @staticmethod
+    def decodeFile(path, options = None):
+        return BitmapFactory._decode(path, options)
+
+    @staticmethod
+    def decodeFileDescriptor(fd, out_padding = None, options = None):
+        return BitmapFactory._decode('/proc/self/fd/' + str(fd._fd), options)
+
+    # The options fields are read and set as Java would, without JNI calls
+    @staticmethod
+    def _decode(path, options):
+        fields = vars(options) if options != None else {}
+        bounds = fields.get('inJustDecodeBounds', False)
+        try:
+            if bounds:
+                info = media.read_header(path)
+                state.count('media_bytes_read', media.HEADER.size)
+            else:
+                info = media.read_all(path)
+                state.count('media_bytes_read', os.path.getsize(path))
+        except OSError:
+            info = None
+        if not info or not info[0] or not info[1]:
+            fields['outWidth'] = fields['outHeight'] = -1
+            return None
+        width, height, duration = info
+        sample = max(1, fields.get('inSampleSize', 1))
+        fields['outWidth'] = width // sample
+        fields['outHeight'] = height // sample
+        if bounds:
+            return None
+        return Bitmap(width // sample, height // sample)
+
+
+METADATA_KEY_DURATION = 9
+METADATA_KEY_VIDEO_WIDTH = 18
+METADATA_KEY_VIDEO_HEIGHT = 19
+
+
+# Reads the header of fake media (see media.py)
+class MediaMetadataRetriever(JavaObject):
+    METADATA_KEY_DURATION = METADATA_KEY_DURATION
+    METADATA_KEY_VIDEO_WIDTH = METADATA_KEY_VIDEO_WIDTH
+    METADATA_KEY_VIDEO_HEIGHT = METADATA_KEY_VIDEO_HEIGHT
+
+    def __init__(self):
+        self._info = None
+
+    def setDataSource(self, source):
+        if isinstance(source, FileDescriptor):
+            path = '/proc/self/fd/' + str(source._fd)
+        else:
+            path = str(source)
+        info = media.read_header(path)
+        state.count('media_bytes_read', media.HEADER.size)
+        if not info:
+            raise JavaException('java.lang.RuntimeException: ' +
+                                'setDataSource failed')
+        self._info = info
+
+    def extractMetadata(self, key):
+        if self._info == None:
+            raise JavaException('java.lang.IllegalStateException')
+        width, height, duration = self._info
+        value = {METADATA_KEY_DURATION : duration,
+                 METADATA_KEY_VIDEO_WIDTH : width,
+                 METADATA_KEY_VIDEO_HEIGHT : height}.get(key)
+        if not value:
+            return None
+        return str(value)
+
+    def getFrameAtTime(self, time_us = -1, option = 0):
+        if self._info == None or not self._info[0]:
+            return None
+        return Bitmap(self._info[0], self._info[1])
+
+    def release(self):
+        self._info = None
+
+
+class ClipDataItem(JavaObject):
+
+    def __init__(self, uri):
+        self._uri = uri
+
+    def getUri(self):
+        return self._uri
+
+
+class ClipData(JavaObject):
+
+    def __init__(self, uris):
+        self._items = [ClipDataItem(u) for u in uris]
+
+    def getItemCount(self):
+        return len(self._items)
+
+    def getItemAt(self, index):
+        return self._items[index]
+
+
+class Intent(JavaObject):
+    ACTION_CHOOSER = 'android.intent.action.CHOOSER'
+    ACTION_GET_CONTENT = 'android.intent.action.GET_CONTENT'
+    ACTION_SEND = 'android.intent.action.SEND'
+    ACTION_SEND_MULTIPLE = 'android.intent.action.SEND_MULTIPLE'
+    ACTION_VIEW = 'android.intent.action.VIEW'
+    EXTRA_ALLOW_MULTIPLE = 'android.intent.extra.ALLOW_MULTIPLE'
+    EXTRA_INTENT = 'android.intent.extra.INTENT'
+    EXTRA_STREAM = 'android.intent.extra.STREAM'
+    EXTRA_TEXT = 'android.intent.extra.TEXT'
+    FLAG_GRANT_READ_URI_PERMISSION = 1
+
+    def __init__(self, action = None):
+        self._action = action
+        self._type = None
+        self._data = None
+        self._clip_data = None
+        self._package = None
+        self._flags = 0
+        self._extras = {}
+
+    @staticmethod
+    def createChooser(target, title):
+        intent = Intent(Intent.ACTION_CHOOSER)
+        intent._extras[Intent.EXTRA_INTENT] = target
+        return intent
+
+    def setAction(self, action):
+        self._action = action
+        return self
+
+    def getAction(self):
+        return self._action
+
+    def setType(self, MIME_type):
+        self._type = MIME_type
+        return self
+
+    def getType(self):
+        return self._type
+
+    def setDataAndType(self, data, MIME_type):
+        self._data = data
+        self._type = MIME_type
+        return self
+
+    def getData(self):
+        return self._data
+
+    def getClipData(self):
+        return self._clip_data
+
+    def setPackage(self, package):
+        self._package = package
+        return self
+
+    def addFlags(self, flags):
+        self._flags |= flags
+        return self
+
+    def putExtra(self, key, value):
+        self._extras[key] = value
+        return self
+
+    def putParcelableArrayListExtra(self, key, value):
+        self._extras[key] = list(value)
+        return self
+
+
+# autoclass() names
+CLASSES = {
+    'android.content.ClipData' : ClipData,
+    'android.content.ContentProviderOperation' : ContentProviderOperation,
+    'android.content.ContentProviderResult' : ContentProviderResult,
+    'android.content.ContentUris' : ContentUris,
+    'android.content.ContentValues' : ContentValues,
+    'android.content.Intent' : Intent,
+    'android.graphics.Bitmap' : Bitmap,
+    'android.graphics.Bitmap$CompressFormat' : BitmapCompressFormat,
+    'android.graphics.BitmapFactory' : BitmapFactory,
+    'android.graphics.BitmapFactory$Options' : BitmapFactoryOptions,
+    'android.media.MediaMetadataRetriever' : MediaMetadataRetriever,
+    'android.net.Uri' : Uri,
+    'android.os.Bundle' : Bundle,
+    'android.os.CancellationSignal' : CancellationSignal,
+    'android.os.Environment' : Environment,
+    'android.os.FileUtils' : FileUtils,
+    'android.provider.MediaStore' : MediaStore,
+    'android.provider.MediaStore$Audio$Media' : MediaStoreAudioMedia,
+    'android.provider.MediaStore$Downloads' : MediaStoreDownloads,
+    'android.provider.MediaStore$Files' : MediaStoreFiles,
+    'android.provider.MediaStore$Images$Media' : MediaStoreImagesMedia,
+    'android.provider.MediaStore$MediaColumns' : MediaColumns,
+    'android.provider.MediaStore$Video$Media' : MediaStoreVideoMedia,
+    'android.util.Size' : Size,
+    'android.webkit.MimeTypeMap' : MimeTypeMap,
+    'java.io.File' : File,
+    'java.io.FileDescriptor' : FileDescriptor,
+    'java.io.FileInputStream' : FileInputStream,
+    'java.io.FileOutputStream' : FileOutputStream,
+    'java.lang.Integer' : Integer,
+    'java.lang.String' : String,
+    'java.util.ArrayList' : ArrayList,
+}
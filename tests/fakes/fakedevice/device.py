@@ -0,0 +1,280 @@
+import os
+import sys
+import importlib
+from os.path import join
+from time import sleep, time
+from . import state
+from . import media
+from .javaobject import JavaObject, JavaException
+from .classes import CLASSES, File, Intent, ClipData, StreamCopy
+from .resolver import FakeContentResolver, ContentResolver
+
+PACKAGE = 'org.test.fakeapp'
+APP_TITLE = 'FakeApp'
+# The package under test, reloaded when the api_version changes
+PACKAGE_UNDER_TEST = 'androidstorage4kivy'
+
+
+class ApplicationInfo(JavaObject):
+
+    def __init__(self):
+        self.labelRes = 0
+        self.nonLocalizedLabel = File(APP_TITLE)
+
+
+# mActivity, also used as the application Context
+class Activity(JavaObject):
+
+    def __init__(self, device):
+        self._device = device
+
+    def getApplicationContext(self):
+        return self
+
+    def getContentResolver(self):
+        return self._device._resolver
+
+    def getExternalCacheDir(self):
+        return File(self._device._cache_dir)
+
+    def getFilesDir(self):
+        return File(self._device._files_dir)
+
+    def getApplicationInfo(self):
+        return ApplicationInfo()
+
+    def getPackageName(self):
+        return PACKAGE
+
+    def getString(self, resource):
+        return APP_TITLE
+
+    def startActivity(self, intent):
+        state.count('binder')
+        state.count('binder.startActivity')
+        self._device.started.append(intent)
+
+    def startActivityForResult(self, intent, request_code):
+        state.count('binder')
+        state.count('binder.startActivityForResult')
+        self._device.started.append(intent)
+        self._device.requests.append(request_code)
+
+    def startIntentSenderForResult(self, sender, request_code, fill_in_intent,
+                                   flags_mask, flags_values, extra_flags):
+        state.count('binder')
+        state.count('binder.startIntentSenderForResult')
+        self._device.started.append(sender)
+        self._device.requests.append(request_code)
+
+
+# android.activity, bind(on_activity_result = callback)
+class ActivityEvents():
+
+    def __init__(self):
+        self._callbacks = []
+
+    def bind(self, on_activity_result = None, **kwargs):
+        if on_activity_result:
+            self._callbacks.append(on_activity_result)
+
+    def unbind(self, on_activity_result = None, **kwargs):
+        if on_activity_result in self._callbacks:
+            self._callbacks.remove(on_activity_result)
+
+    def _clear(self):
+        self._callbacks = []
+
+
+activity_events = ActivityEvents()
+
+
+# The installed Device's Activity, so `from android import mActivity`
+# works across installs.
+class ActivityProxy():
+
+    def __getattr__(self, name):
+        if state.device == None:
+            raise RuntimeError('No fake device, call fakedevice.install()')
+        return getattr(state.device._activity, name)
+
+
+class Device():
+
+    def __init__(self, api_version, directory, stream_copy = False):
+        self._api_version = api_version
+        self._package = PACKAGE
+        self._storage_dir = join(directory, 'storage')
+        self._cache_dir = join(directory, 'cache')
+        self._files_dir = join(directory, 'files')
+        for d in (self._storage_dir, self._cache_dir, self._files_dir):
+            os.makedirs(d, exist_ok = True)
+        self._stream_copy = stream_copy
+        self._resolver = FakeContentResolver(self)
+        self._activity = Activity(self)
+        # Intents passed to startActivity(), and request codes
+        self.started = []
+        self.requests = []
+
+    ###################
+    # For tests
+    ###################
+
+    @property
+    def api_version(self):
+        return self._api_version
+
+    @property
+    def resolver(self):
+        return self._resolver
+
+    @property
+    def storage_dir(self):
+        return self._storage_dir
+
+    @property
+    def files_dir(self):
+        return self._files_dir
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def counters(self):
+        return state.snapshot()
+
+    def reset_counters(self):
+        state.reset_counters()
+
+    # A private file, filled with size bytes (or data)
+    def make_private_file(self, name, size = 0, data = None):
+        path = join(self._files_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        if data == None:
+            data = os.urandom(min(size, 1024 * 1024))
+            with open(path, 'wb') as f:
+                written = 0
+                while written < size:
+                    chunk = data[:size - written]
+                    f.write(chunk)
+                    written += len(chunk)
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+        return path
+
+    # A fake image, video, or audio file (see media.py), size bytes long
+    def make_private_media(self, name, width, height, duration = 0,
+                           size = 0):
+        return self.make_private_file(name, data = media.encode(
+            width, height, duration, size))
+
+    # A shared file owned by another app (Android >= 10 MediaStore)
+    def add_foreign_media(self, relative_path, name, data = b''):
+        return self._resolver._add_media(relative_path, name, data,
+                                         owner = 'org.other.app')
+
+    # A file served by a documents provider, for example a Chooser result
+    def add_document(self, name, data = b'', file_descriptor = True):
+        path = join(self._storage_dir, '.documents', name)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return self._resolver._add_document(path, file_descriptor)
+
+    # The MediaStore rows, as dicts
+    def media_rows(self):
+        return self._resolver._rows()
+
+    # Queries ignore QUERY_ARG_LIMIT and QUERY_ARG_OFFSET, as some
+    # providers do
+    def ignore_query_limit(self):
+        self._resolver._honor_limit = False
+
+    # Fail the next ContentResolver.applyBatch()
+    def fail_next_apply_batch(self):
+        self._resolver._fail_apply_batch =\
+            JavaException('android.content.OperationApplicationException')
+
+    # Deliver the result of startActivityForResult()
+    def activity_result(self, uris, request_code = None, result_code = -1):
+        if request_code == None:
+            request_code = self.requests[-1]
+        intent = Intent()
+        if len(uris) == 1:
+            intent._data = uris[0]
+        else:
+            intent._clip_data = ClipData(uris)
+        for callback in list(activity_events._callbacks):
+            callback(request_code, result_code, intent)
+
+    # The user answers the last startIntentSenderForResult(), for example
+    # a MediaStore.createDeleteRequest()
+    def answer_request(self, granted = True):
+        sender = self.started[-1]
+        if granted and sender._kind == 'delete':
+            self._resolver._delete_uris(sender._uris)
+        for callback in list(activity_events._callbacks):
+            callback(self.requests[-1], -1 if granted else 0, None)
+
+    # Run Kivy Clock callbacks until predicate() is True
+    def run_until(self, predicate, timeout = 10):
+        from kivy.clock import Clock
+        end = time() + timeout
+        while True:
+            Clock.tick()
+            if predicate():
+                return True
+            if time() > end:
+                return False
+            sleep(0.001)
+
+    def _close(self):
+        self._resolver._close()
+
+
+def autoclass(name):
+    state.count('autoclass')
+    if name == 'org.kivy.sharedstorage.StreamCopy':
+        if state.device != None and state.device._stream_copy:
+            return StreamCopy
+    elif name == 'android.content.ContentResolver':
+        return ContentResolver
+    elif name in CLASSES:
+        return CLASSES[name]
+    raise JavaException('Class not found ' + repr(name))
+
+
+def cast(name, value):
+    return value
+
+
+# Install a new Device, and import the package under test for its
+# api_version. directory holds the device's storage.
+def install(api_version, directory, stream_copy = False):
+    uninstall()
+    import android
+    from kivy.clock import Clock
+    state.device = Device(api_version, directory, stream_copy)
+    state.reset_counters()
+    android.api_version = api_version
+    Clock._clear()
+    activity_events._clear()
+    reload_package()
+    return state.device
+
+
+def uninstall():
+    if state.device != None:
+        state.device._close()
+        state.device = None
+
+
+# api_version is read when the package is imported
+def reload_package():
+    for name in list(sys.modules):
+        if name == PACKAGE_UNDER_TEST or\
+           name.startswith(PACKAGE_UNDER_TEST + '.'):
+            del sys.modules[name]
+    return importlib.import_module(PACKAGE_UNDER_TEST)
@@ -0,0 +1,34 @@
+from . import state
+
+# Base classes for the fake Java classes.
+# Each public attribute read (a method call or field read, which is a JNI
+# call in pyjnius) and each constructor call is counted as 'jni'.
+# Names starting with '_' are the simulator's own, and are not counted.
+# Each object is a JNI reference while Python holds it, state.live_objects()
+# is how many are held.
+
+
+class JavaException(Exception):
+    pass
+
+
+class JavaMeta(type):
+
+    def __getattribute__(cls, name):
+        if name[0] != '_':
+            state.count('jni')
+        return type.__getattribute__(cls, name)
+
+    def __call__(cls, *args, **kwargs):
+        state.count('jni')
+        obj = type.__call__(cls, *args, **kwargs)
+        state.track(obj)
+        return obj
+
+
+class JavaObject(metaclass = JavaMeta):
+
+    def __getattribute__(self, name):
+        if name[0] != '_':
+            state.count('jni')
+        return object.__getattribute__(self, name)
@@ -0,0 +1,40 @@
+import struct
+
+# Simulated media files. A fake image, video, or audio file starts with a
+# header that has its width, height, and duration (milliseconds); the
+# rest is padding, so the file can be as large as a real one. The fake
+# decoders (BitmapFactory, MediaMetadataRetriever, loadThumbnail) and the
+# MediaStore scanner read the header.
+
+MAGIC = b'FAKEMEDIA'
+HEADER = struct.Struct('>9sIIQ')
+
+
+# Returns the bytes of a media file of size bytes (at least the header)
+def encode(width, height, duration = 0, size = 0):
+    header = HEADER.pack(MAGIC, width, height, duration)
+    return header + bytes(max(0, size - len(header)))
+
+
+# Returns (width, height, duration) from the start of a file, or None
+def decode(data):
+    if len(data) < HEADER.size:
+        return None
+    magic, width, height, duration = HEADER.unpack(data[:HEADER.size])
+    if magic != MAGIC:
+        return None
+    return width, height, duration
+
+
+def read_header(path):
+    try:
+        with open(path, 'rb') as f:
+            return decode(f.read(HEADER.size))
+    except OSError:
+        return None
+
+
+# A decode reads the whole file
+def read_all(path):
+    with open(path, 'rb') as f:
+        return decode(f.read())
@@ -0,0 +1,658 @@
+import os
+import sqlite3
+from os.path import join, exists, dirname, basename, getsize, getmtime
+from threading import RLock
+from time import time
+from . import state
+from . import media
+from .javaobject import JavaObject, JavaException
+from .classes import Uri, ContentProviderResult, InputStream, OutputStream,\
+    MimeTypeMap, FileDescriptor, Bitmap, Bundle
+
+# A ContentResolver backed by SQLite and a directory.
+# Serves the MediaStore collections, and a documents provider for files
+# shared by other apps (for example picked with the Chooser).
+
+EXTERNAL = 'content://media/external/'
+COLLECTIONS = {EXTERNAL + 'file' : 'file',
+               EXTERNAL + 'images/media' : 'images',
+               EXTERNAL + 'video/media' : 'video',
+               EXTERNAL + 'audio/media' : 'audio',
+               EXTERNAL + 'downloads' : 'downloads'}
+# Default RELATIVE_PATH for an insert that has none
+DEFAULT_PATHS = {'file' : 'Documents/',
+                 'images' : 'Pictures/',
+                 'video' : 'Movies/',
+                 'audio' : 'Music/',
+                 'downloads' : 'Download/'}
+DOCUMENTS_AUTHORITY = 'com.android.externalstorage.documents'
+
+COLUMNS = ['_id', '_display_name', 'mime_type', 'relative_path', '_data',
+           '_size', 'date_modified', 'generation_modified', 'is_pending',
+           'owner_package_name', 'width', 'height', 'duration', 'datetaken']
+# Columns that only exist on newer Android versions
+COLUMN_API = {'relative_path' : 29, 'is_pending' : 29,
+              'owner_package_name' : 29, 'generation_modified' : 30,
+              'width' : 29, 'height' : 29, 'duration' : 29,
+              'datetaken' : 29}
+DOCUMENT_COLUMNS = ['_display_name', '_size', 'mime_type']
+
+SCHEMA = '''CREATE TABLE files (
+    _id INTEGER PRIMARY KEY AUTOINCREMENT,
+    _display_name TEXT,
+    mime_type TEXT,
+    relative_path TEXT,
+    _data TEXT,
+    _size INTEGER,
+    date_modified INTEGER,
+    generation_modified INTEGER,
+    is_pending INTEGER DEFAULT 0,
+    collection TEXT,
+    owner_package_name TEXT,
+    width INTEGER,
+    height INTEGER,
+    duration INTEGER,
+    datetaken INTEGER,
+    external INTEGER DEFAULT 0)'''
+
+
+QUERY_ARG_LIMIT = 'android:query-arg-limit'
+QUERY_ARG_OFFSET = 'android:query-arg-offset'
+QUERY_ARG_SQL_SELECTION = 'android:query-arg-sql-selection'
+QUERY_ARG_SQL_SELECTION_ARGS = 'android:query-arg-sql-selection-args'
+QUERY_ARG_SQL_SORT_ORDER = 'android:query-arg-sql-sort-order'
+EXTRA_HONORED_ARGS = 'android.content.extra.HONORED_ARGS'
+
+
+class ContentResolver(JavaObject):
+    QUERY_ARG_LIMIT = QUERY_ARG_LIMIT
+    QUERY_ARG_OFFSET = QUERY_ARG_OFFSET
+    QUERY_ARG_SQL_SELECTION = QUERY_ARG_SQL_SELECTION
+    QUERY_ARG_SQL_SELECTION_ARGS = QUERY_ARG_SQL_SELECTION_ARGS
+    QUERY_ARG_SQL_SORT_ORDER = QUERY_ARG_SQL_SORT_ORDER
+    EXTRA_HONORED_ARGS = EXTRA_HONORED_ARGS
+
+
+class Cursor(JavaObject):
+
+    def __init__(self, columns, rows, extras = None):
+        self._columns = columns
+        self._rows = rows
+        self._extras = extras or Bundle()
+        self._position = -1
+        self._closed = False
+
+    def getExtras(self):
+        return self._extras
+
+    def getCount(self):
+        return len(self._rows)
+
+    def getColumnNames(self):
+        return list(self._columns)
+
+    def getColumnIndex(self, name):
+        if name in self._columns:
+            return self._columns.index(name)
+        return -1
+
+    def getColumnIndexOrThrow(self, name):
+        if name not in self._columns:
+            raise JavaException('java.lang.IllegalArgumentException: ' + name)
+        return self._columns.index(name)
+
+    def moveToNext(self):
+        if self._position < len(self._rows):
+            self._position += 1
+        return self._position < len(self._rows)
+
+    def moveToFirst(self):
+        self._position = 0
+        return len(self._rows) > 0
+
+    def moveToPosition(self, position):
+        self._position = position
+        return 0 <= position < len(self._rows)
+
+    def isNull(self, index):
+        return self._rows[self._position][index] == None
+
+    def getLong(self, index):
+        value = self._rows[self._position][index]
+        return int(value or 0)
+
+    def getInt(self, index):
+        value = self._rows[self._position][index]
+        return int(value or 0)
+
+    def getString(self, index):
+        value = self._rows[self._position][index]
+        return None if value == None else str(value)
+
+    def isClosed(self):
+        return self._closed
+
+    def close(self):
+        self._closed = True
+
+
+class ParcelFileDescriptor(JavaObject):
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def getFd(self):
+        return self._fd
+
+    def getFileDescriptor(self):
+        return FileDescriptor(self._fd)
+
+    def detachFd(self):
+        fd = self._fd
+        self._fd = None
+        return fd
+
+    def close(self):
+        if self._fd != None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class FakeContentResolver(ContentResolver):
+
+    def __init__(self, device):
+        self._device = device
+        self._lock = RLock()
+        self._db = sqlite3.connect(':memory:', check_same_thread = False)
+        self._db.execute(SCHEMA)
+        self._generation = 0
+        # Rows with a file descriptor open for writing, refreshed on query
+        self._dirty = set()
+        # uri string -> path, the documents provider
+        self._documents = {}
+        self._documents_without_fd = set()
+        # Set to an exception to fail the next applyBatch()
+        self._fail_apply_batch = None
+        # False for a provider that ignores QUERY_ARG_LIMIT and
+        # QUERY_ARG_OFFSET, and does not report EXTRA_HONORED_ARGS
+        self._honor_limit = True
+
+    ###################
+    # ContentResolver
+    ###################
+
+    def query(self, uri, projection, *rest):
+        self._binder('query')
+        if len(rest) == 2:
+            # query(uri, projection, Bundle queryArgs, CancellationSignal)
+            query_args = rest[0]._values if rest[0] != None else {}
+            selection = query_args.get(QUERY_ARG_SQL_SELECTION)
+            args = query_args.get(QUERY_ARG_SQL_SELECTION_ARGS)
+            sort_order = query_args.get(QUERY_ARG_SQL_SORT_ORDER)
+            limit = query_args.get(QUERY_ARG_LIMIT)
+            offset = query_args.get(QUERY_ARG_OFFSET, 0)
+        else:
+            selection, args, sort_order = (list(rest) + [None] * 3)[:3]
+            limit = None
+            offset = 0
+        if uri._string in self._documents:
+            return self._query_document(uri, projection)
+        collection, id = self._parse(uri)
+        columns = list(projection) if projection else self._api_columns()
+        for c in columns:
+            if c not in self._api_columns():
+                raise JavaException('java.lang.IllegalArgumentException: ' +
+                                    'Invalid column ' + c)
+        with self._lock:
+            self._refresh()
+            where, where_args = self._where(collection, id, selection, args)
+            sql = 'SELECT ' + ','.join(columns) + ' FROM files WHERE ' + where
+            if sort_order:
+                sql += ' ORDER BY ' + sort_order
+            extras = None
+            if limit != None and self._honor_limit:
+                sql += ' LIMIT ' + str(int(limit)) +\
+                    ' OFFSET ' + str(int(offset))
+                extras = Bundle()
+                extras.putStringArray(EXTRA_HONORED_ARGS,
+                                      [k for k in query_args
+                                       if k.startswith('android:query-arg')])
+            try:
+                rows = self._db.execute(sql, where_args).fetchall()
+            except sqlite3.Error as e:
+                raise JavaException('android.database.sqlite.SQLiteException: '
+                                    + str(e))
+        self._count_rows(columns, rows)
+        return Cursor(columns, rows, extras)
+
+    def insert(self, uri, cv):
+        self._binder('insert')
+        with self._lock:
+            return self._insert(uri, dict(cv._values))
+
+    def bulkInsert(self, uri, cv_array):
+        self._binder('bulkInsert')
+        with self._lock:
+            for cv in cv_array:
+                self._insert(uri, dict(cv._values))
+        return len(cv_array)
+
+    def update(self, uri, cv, selection, args):
+        self._binder('update')
+        collection, id = self._parse(uri)
+        with self._lock:
+            return self._update(collection, id, dict(cv._values),
+                                selection, args)
+
+    def delete(self, uri, selection, args):
+        self._binder('delete')
+        collection, id = self._parse(uri)
+        with self._lock:
+            return self._delete(collection, id, selection, args)
+
+    def applyBatch(self, authority, operations):
+        self._binder('applyBatch')
+        if self._fail_apply_batch:
+            e = self._fail_apply_batch
+            self._fail_apply_batch = None
+            raise e
+        results = []
+        with self._lock:
+            for op in operations._items:
+                if op._kind == 'insert':
+                    results.append(
+                        ContentProviderResult(uri = self._insert(op._uri,
+                                                                 op._values)))
+                    continue
+                collection, id = self._parse(op._uri)
+                if op._kind == 'update':
+                    count = self._update(collection, id, op._values,
+                                         op._selection, op._args)
+                else:
+                    count = self._delete(collection, id,
+                                         op._selection, op._args)
+                results.append(ContentProviderResult(count = count))
+        return results
+
+    def getType(self, uri):
+        self._binder('getType')
+        if uri._string in self._documents:
+            return self._document_type(uri._string)
+        collection, id = self._parse(uri)
+        if id == None:
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT mime_type FROM files WHERE _id=?',
+                                   (id,)).fetchone()
+        return row[0] if row else None
+
+    def openInputStream(self, uri):
+        self._binder('openInputStream')
+        path = self._path(uri)
+        try:
+            return InputStream(open(path, 'rb'))
+        except OSError as e:
+            raise JavaException('java.io.FileNotFoundException: ' + str(e))
+
+    def openOutputStream(self, uri, mode = 'w'):
+        self._binder('openOutputStream')
+        path = self._path(uri, writable = True)
+        collection, id = self._parse(uri)
+        python_mode = 'ab' if 'a' in mode else\
+            ('wb' if 't' in mode or mode == 'w' else 'r+b')
+        try:
+            f = open(path, python_mode)
+        except OSError as e:
+            raise JavaException('java.io.FileNotFoundException: ' + str(e))
+        return OutputStream(f, on_close = lambda: self._touch(id))
+
+    def openFileDescriptor(self, uri, mode):
+        self._binder('openFileDescriptor')
+        if uri._string in self._documents_without_fd:
+            raise JavaException('java.io.FileNotFoundException: ' +
+                                'no file descriptor')
+        writable = 'w' in mode
+        path = self._path(uri, writable = writable)
+        flags = {'r' : os.O_RDONLY,
+                 'w' : os.O_WRONLY | os.O_CREAT,
+                 'wt' : os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                 'wa' : os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                 'rw' : os.O_RDWR | os.O_CREAT,
+                 'rwt' : os.O_RDWR | os.O_CREAT | os.O_TRUNC}.get(mode)
+        if flags == None:
+            raise JavaException('java.lang.IllegalArgumentException: ' +
+                                'Bad mode ' + mode)
+        try:
+            fd = os.open(path, flags)
+        except OSError as e:
+            raise JavaException('java.io.FileNotFoundException: ' + str(e))
+        if writable and uri._string not in self._documents:
+            with self._lock:
+                self._dirty.add(self._parse(uri)[1])
+        return ParcelFileDescriptor(fd)
+
+    # Android >= 10, a thumbnail that fits in size, of a fake image or
+    # video (see media.py) or the album art of fake audio
+    def loadThumbnail(self, uri, size, signal):
+        if self._device._api_version < 29:
+            raise JavaException('java.lang.NoSuchMethodError: ' +
+                                'loadThumbnail')
+        self._binder('loadThumbnail')
+        path = self._path(uri)
+        info = media.read_all(path) if exists(path) else None
+        state.count('media_bytes_read', getsize(path) if info else 0)
+        if not info or not info[0] or not info[1]:
+            raise JavaException('java.io.IOException: No thumbnail for ' +
+                                uri._string)
+        width, height, duration = info
+        scale = min(1, size._width / width, size._height / height)
+        return Bitmap(max(1, int(width * scale)), max(1, int(height * scale)))
+
+    ###################
+    # Simulator
+    ###################
+
+    # A file in another app's shared storage, as Android >= 10 has it
+    def _add_media(self, relative_path, name, data = b'', owner = None,
+                   collection = 'file', MIME_type = None):
+        with self._lock:
+            uri = self._insert(Uri(self._collection_uri(collection)),
+                               {'_display_name' : name,
+                                'relative_path' : relative_path,
+                                'mime_type' : MIME_type or
+                                self._mime_type(name)},
+                               owner = owner)
+            path = self._db.execute('SELECT _data FROM files WHERE _id=?',
+                                    (self._id(uri),)).fetchone()[0]
+            with open(path, 'wb') as f:
+                f.write(data)
+            self._touch(self._id(uri))
+        return uri
+
+    # A file from a documents provider, with or without a file descriptor
+    def _add_document(self, path, file_descriptor = True):
+        with self._lock:
+            uri = Uri('content://' + DOCUMENTS_AUTHORITY + '/document/' +
+                      str(len(self._documents) + 1))
+            self._documents[uri._string] = path
+            if not file_descriptor:
+                self._documents_without_fd.add(uri._string)
+        return uri
+
+    # Delete, whoever owns the files
+    def _delete_uris(self, uris):
+        with self._lock:
+            for uri in uris:
+                collection, id = self._parse(uri)
+                row = self._db.execute('SELECT _data FROM files WHERE _id=?',
+                                       (id,)).fetchone()
+                if row and row[0] and exists(row[0]):
+                    os.remove(row[0])
+                self._db.execute('DELETE FROM files WHERE _id=?', (id,))
+
+    def _rows(self, where = '1', args = ()):
+        with self._lock:
+            self._refresh()
+            cursor = self._db.execute('SELECT ' + ','.join(COLUMNS) +
+                                      ',collection FROM files WHERE ' +
+                                      where, args)
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def _close(self):
+        self._db.close()
+
+    ###################
+    # Private
+    ###################
+
+    def _binder(self, name):
+        state.count('binder')
+        state.count('binder.' + name)
+
+    def _count_rows(self, columns, rows):
+        state.count('query_rows', len(rows))
+        state.count('query_cells', len(rows) * len(columns))
+        state.count('query_bytes',
+                    sum([len(str(v)) if v != None else 0
+                         for row in rows for v in row]))
+
+    def _api_columns(self):
+        api = self._device._api_version
+        return [c for c in COLUMNS if COLUMN_API.get(c, 0) <= api]
+
+    def _collection_uri(self, collection):
+        for uri, name in COLLECTIONS.items():
+            if name == collection:
+                return uri
+
+    # Returns (collection, id or None)
+    def _parse(self, uri):
+        string = uri._string.rstrip('/')
+        if string in COLLECTIONS:
+            return COLLECTIONS[string], None
+        head, tail = string.rsplit('/', 1)
+        if head in COLLECTIONS and tail.isdigit():
+            return COLLECTIONS[head], int(tail)
+        raise JavaException('java.lang.IllegalArgumentException: ' +
+                            'Unknown URL ' + uri._string)
+
+    def _id(self, uri):
+        return self._parse(uri)[1]
+
+    def _where(self, collection, id, selection, args):
+        where = []
+        where_args = []
+        if collection != 'file':
+            where.append('collection=?')
+            where_args.append(collection)
+        if id != None:
+            where.append('_id=?')
+            where_args.append(id)
+        else:
+            # Pending files are not listed
+            where.append('is_pending=0')
+        if selection:
+            where.append('(' + selection + ')')
+            where_args += list(args or [])
+        return ' AND '.join(where), where_args
+
+    def _insert(self, uri, values, owner = None):
+        collection, id = self._parse(uri)
+        if id != None:
+            raise JavaException('java.lang.UnsupportedOperationException: ' +
+                                'Invalid URI ' + uri._string)
+        device = self._device
+        name = values.get('_display_name') or 'untitled'
+        external = 0
+        if device._api_version > 28:
+            relative_path = values.get('relative_path') or\
+                DEFAULT_PATHS[collection]
+            relative_path = relative_path.strip('/') + '/'
+            name = self._unique_name(relative_path, name)
+            path = join(device._storage_dir, relative_path, name)
+            os.makedirs(dirname(path), exist_ok = True)
+            open(path, 'wb').close()
+        else:
+            relative_path = None
+            path = values.get('_data')
+            if path:
+                external = 1
+            else:
+                path = join(device._storage_dir, DEFAULT_PATHS[collection],
+                            name)
+                os.makedirs(dirname(path), exist_ok = True)
+                open(path, 'wb').close()
+        self._generation += 1
+        cursor = self._db.execute(
+            'INSERT INTO files (_display_name, mime_type, relative_path, ' +
+            '_data, _size, date_modified, generation_modified, is_pending, ' +
+            'collection, owner_package_name, external) VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+            (name, values.get('mime_type') or self._mime_type(name),
+             relative_path, path,
+             getsize(path) if exists(path) else 0, int(time()),
+             self._generation, int(values.get('is_pending') or 0),
+             collection, owner or device._package, external))
+        return Uri(uri._string.rstrip('/') + '/' + str(cursor.lastrowid))
+
+    # MediaStore adds ' (N)' to a name that is already used
+    def _unique_name(self, relative_path, name):
+        taken = set([r[0] for r in self._db.execute(
+            'SELECT _display_name FROM files WHERE relative_path=?',
+            (relative_path,))])
+        if name not in taken:
+            return name
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while stem + ' (' + str(n) + ')' + ext in taken:
+            n += 1
+        return stem + ' (' + str(n) + ')' + ext
+
+    def _update(self, collection, id, values, selection, args):
+        where, where_args = self._where(collection, id, selection, args)
+        if id != None:
+            # An update by id can publish a pending row
+            where = where.replace('is_pending=0', '1')
+        where, where_args = self._check_owner(id, where, where_args)
+        columns = [c for c in values if c in COLUMNS and c != '_id']
+        if not columns:
+            return 0
+        if id != None and ('_display_name' in values or
+                           'relative_path' in values):
+            values = dict(values)
+            values['_data'] = self._move(id, values)
+            columns.append('_data')
+        self._generation += 1
+        sql = 'UPDATE files SET ' + ','.join([c + '=?' for c in columns]) +\
+            ',generation_modified=? WHERE ' + where
+        cursor = self._db.execute(sql, [values[c] for c in columns] +
+                                  [self._generation] + where_args)
+        return cursor.rowcount
+
+    # Android >= 10, a changed name or relative path moves the file.
+    # Returns the new path.
+    def _move(self, id, values):
+        row = self._db.execute('SELECT _display_name, relative_path, _data ' +
+                               'FROM files WHERE _id=?', (id,)).fetchone()
+        if not row or self._device._api_version < 29:
+            return row[2] if row else None
+        name, relative_path, path = row
+        relative_path = (values.get('relative_path') or
+                         relative_path).strip('/') + '/'
+        new_path = join(self._device._storage_dir, relative_path,
+                        values.get('_display_name') or name)
+        if new_path != path:
+            if exists(new_path):
+                raise JavaException('java.lang.IllegalStateException: ' +
+                                    'Failed to rename to ' + new_path)
+            os.makedirs(dirname(new_path), exist_ok = True)
+            os.rename(path, new_path)
+        return new_path
+
+    def _delete(self, collection, id, selection, args):
+        where, where_args = self._where(collection, id, selection, args)
+        if id != None:
+            where = where.replace('is_pending=0', '1')
+        where, where_args = self._check_owner(id, where, where_args)
+        rows = self._db.execute('SELECT _id, _data, external FROM files ' +
+                                'WHERE ' + where, where_args).fetchall()
+        for row_id, path, external in rows:
+            # A row inserted with _data (Android < 10) only references a file
+            if not external and path and exists(path):
+                os.remove(path)
+            self._dirty.discard(row_id)
+        self._db.execute('DELETE FROM files WHERE ' + where, where_args)
+        return len(rows)
+
+    # Android >= 10, an app can only change the files it owns.
+    # A change to one uri raises, a change by selection only applies to
+    # the files the app owns. Returns the where clause.
+    def _check_owner(self, id, where, where_args):
+        if self._device._api_version <= 28:
+            return where, where_args
+        if id == None:
+            return where + ' AND owner_package_name=?',\
+                where_args + [self._device._package]
+        rows = self._db.execute('SELECT owner_package_name FROM files ' +
+                                'WHERE ' + where,
+                                where_args).fetchall()
+        for owner, in rows:
+            if owner != self._device._package:
+                raise JavaException('android.app.RecoverableSecurityException'
+                                    + ': not owned by this app')
+        return where, where_args
+
+    def _path(self, uri, writable = False):
+        if uri._string in self._documents:
+            if writable:
+                raise JavaException('java.lang.SecurityException: read only')
+            return self._documents[uri._string]
+        collection, id = self._parse(uri)
+        if id == None:
+            raise JavaException('java.io.FileNotFoundException: ' +
+                                uri._string)
+        with self._lock:
+            row = self._db.execute('SELECT _data, owner_package_name ' +
+                                   'FROM files WHERE _id=?', (id,)).fetchone()
+        if not row:
+            raise JavaException('java.io.FileNotFoundException: ' +
+                                uri._string)
+        path, owner = row
+        if writable and self._device._api_version > 28 and\
+           owner != self._device._package:
+            raise JavaException('java.lang.SecurityException: ' +
+                                'not owned by this app')
+        return path
+
+    # Record a changed file
+    def _touch(self, id):
+        if id == None:
+            return
+        with self._lock:
+            row = self._db.execute('SELECT _data FROM files WHERE _id=?',
+                                   (id,)).fetchone()
+            if not row or not row[0] or not exists(row[0]):
+                return
+            self._generation += 1
+            date_modified = int(getmtime(row[0]))
+            # As the media scanner, read the media's dimensions
+            info = media.read_header(row[0])
+            if info:
+                width, height, duration = info
+                date_taken = date_modified * 1000
+            else:
+                width = height = duration = date_taken = None
+            self._db.execute('UPDATE files SET _size=?, date_modified=?, ' +
+                             'generation_modified=?, width=?, height=?, ' +
+                             'duration=?, datetaken=? WHERE _id=?',
+                             (getsize(row[0]), date_modified,
+                              self._generation, width or None,
+                              height or None, duration or None, date_taken,
+                              id))
+
+    def _refresh(self):
+        dirty = self._dirty
+        self._dirty = set()
+        for id in dirty:
+            self._touch(id)
+
+    def _query_document(self, uri, projection):
+        path = self._documents[uri._string]
+        columns = list(projection) if projection else DOCUMENT_COLUMNS
+        values = {'_display_name' : basename(path),
+                  '_size' : getsize(path) if exists(path) else None,
+                  'mime_type' : self._document_type(uri._string)}
+        for c in columns:
+            if c not in values:
+                raise JavaException('java.lang.IllegalArgumentException: ' +
+                                    'Invalid column ' + c)
+        rows = [tuple([values[c] for c in columns])]
+        self._count_rows(columns, rows)
+        return Cursor(columns, rows)
+
+    def _document_type(self, uri_string):
+        return self._mime_type(self._documents[uri_string])
+
+    def _mime_type(self, name):
+        extension = os.path.splitext(name)[1][1:]
+        return MimeTypeMap._lookup(extension) or 'application/octet-stream'
@@ -0,0 +1,53 @@
+from collections import Counter
+from threading import Lock
+from weakref import WeakSet
+import gc
+
+# Shared state of the simulator: the installed Device, and call counters.
+#   counters['autoclass']      Java classes found
+#   counters['jni']            Java method calls, field reads, constructors
+#   counters['binder']         ContentResolver and Activity calls
+#   counters['binder.<name>']  per ContentResolver method
+#   counters['query_rows'], counters['query_cells'], counters['query_bytes']
+#                              what the queries returned
+#   counters['java_objects']   Java objects created
+#   counters['media_bytes_read']
+#                              bytes read by the fake media decoders
+# and the Java objects that are held by Python, see live_objects()
+
+device = None
+counters = Counter()
+_lock = Lock()
+_live = WeakSet()
+
+
+def count(key, n = 1):
+    with _lock:
+        counters[key] += n
+
+
+def reset_counters():
+    with _lock:
+        counters.clear()
+
+
+def snapshot():
+    with _lock:
+        return Counter(counters)
+
+
+def track(obj):
+    with _lock:
+        counters['java_objects'] += 1
+        try:
+            _live.add(obj)
+        except TypeError:
+            # A str, as java.lang.String
+            pass
+
+
+# The number of Java objects still referenced, after garbage collection
+def live_objects():
+    gc.collect()
+    with _lock:
+        return len(_live)
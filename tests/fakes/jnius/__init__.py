@@ -0,0 +1,25 @@
+import fakedevice
+
+# Fake pyjnius, see fakedevice.
+
+autoclass = fakedevice.autoclass
+cast = fakedevice.cast
+JavaException = fakedevice.JavaException
+
+
+class PythonJavaClass():
+    __javainterfaces__ = []
+    __javacontext__ = 'system'
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+def java_method(signature, name = None):
+    def decorator(function):
+        return function
+    return decorator
+
+
+def detach():
+    pass
@@ -0,0 +1 @@
+# Fake Kivy, the modules androidstorage4kivy imports.
@@ -0,0 +1,24 @@
+class App():
+    _running_app = None
+
+    def __init__(self):
+        self._callbacks = {}
+
+    @staticmethod
+    def get_running_app():
+        if App._running_app == None:
+            App._running_app = App()
+        return App._running_app
+
+    def bind(self, **kwargs):
+        for event, callback in kwargs.items():
+            self._callbacks.setdefault(event, []).append(callback)
+
+    def unbind(self, **kwargs):
+        for event, callback in kwargs.items():
+            if callback in self._callbacks.get(event, []):
+                self._callbacks[event].remove(callback)
+
+    def dispatch(self, event, *args):
+        for callback in list(self._callbacks.get(event, [])):
+            callback(self, *args)
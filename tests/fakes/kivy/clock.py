@@ -0,0 +1,38 @@
+from threading import Lock
+from functools import wraps
+
+# Callbacks run when the test calls Clock.tick(), on the test's thread,
+# as the Kivy main thread would run them.
+
+
+class _Clock():
+
+    def __init__(self):
+        self._pending = []
+        self._lock = Lock()
+
+    def schedule_once(self, callback, timeout = 0):
+        with self._lock:
+            self._pending.append(callback)
+
+    def tick(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        for callback in pending:
+            callback(0)
+        return len(pending)
+
+    def _clear(self):
+        with self._lock:
+            self._pending = []
+
+
+Clock = _Clock()
+
+
+def mainthread(function):
+    @wraps(function)
+    def delayed(*args, **kwargs):
+        Clock.schedule_once(lambda dt: function(*args, **kwargs))
+    return delayed
@@ -0,0 +1,10 @@
+class _Window():
+
+    def __init__(self):
+        self.viewport_updates = 0
+
+    def update_viewport(self):
+        self.viewport_updates += 1
+
+
+Window = _Window()
@@ -0,0 +1,3 @@
+import logging
+
+Logger = logging.getLogger('kivy')
@@ -0,0 +1,28 @@
+
+def test_choose_multiple(device):
+    from androidstorage4kivy import Chooser
+    chosen = []
+    chooser = Chooser(callback = chosen.append)
+    chooser.choose_content('image/*', multiple = True)
+    uris = [device.add_document('a.jpg', b'a'), device.add_document('b.jpg')]
+    device.activity_result(uris)
+    assert chosen == [uris]
+
+
+def test_choose_with_prefetch(device):
+    from androidstorage4kivy import Chooser
+    from androidstorage4kivy.scheduler import get_scheduler
+    prefetched = []
+    chooser = Chooser(prefetch = True,
+                      prefetch_callback = prefetched.append)
+    chooser.choose_content()
+    uri = device.add_document('a.txt', b'chosen')
+    device.activity_result([uri])
+    assert device.run_until(lambda: prefetched)
+    private_file, = prefetched[0]
+    with open(private_file, 'rb') as f:
+        assert f.read() == b'chosen'
+    # Not queued behind background exports
+    assert get_scheduler().stats()['interactive']['completed'] == 1
+    assert get_scheduler().stats()['bulk']['completed'] == 0
+    chooser.engine.shutdown()
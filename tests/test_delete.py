@@ -0,0 +1,109 @@
+import os
+
+
+def export(device, names):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    return ss.copy_many_to_shared([device.make_private_file(n, 10)
+                                   for n in names])
+
+
+def test_delete_shared_many(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared = export(device, ['f' + str(i) + '.txt' for i in range(50)] +
+                    ['p' + str(i) + '.jpg' for i in range(50)])
+    paths = ['Documents/FakeApp/f' + str(i) + '.txt' for i in range(25)] +\
+        ['Pictures/FakeApp/p' + str(i) + '.jpg' for i in range(25)]
+    device.reset_counters()
+    report = ss.delete_shared_many(paths + shared[25:50] + [
+        'Documents/FakeApp/missing.txt'])
+    assert len(report) == 76
+    assert report['Documents/FakeApp/missing.txt'] == 'not_found'
+    assert set([report[p] for p in paths]) == {'deleted'}
+    if device.api_version > 28:
+        # One query and one delete per collection, none for each file
+        counters = device.counters
+        assert counters['binder.delete'] == 2
+        assert counters['binder.query'] <= 4
+    names = set([i.name for i in ss.list_shared('Documents')] +
+                [i.name for i in ss.list_shared('Pictures')])
+    assert names == set(['p' + str(i) + '.jpg' for i in range(25, 50)])
+
+
+def test_delete_shared_many_uri_cache(scoped_device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    export(scoped_device, ['a.txt'])
+    ss.delete_shared_many(['Documents/FakeApp/a.txt'])
+    export(scoped_device, ['a.txt'])
+    # Not the deleted uri
+    assert ss.copy_from_shared('Documents/FakeApp/a.txt')
+
+
+def test_delete_shared_many_not_owned(scoped_device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    export(scoped_device, ['mine.txt'])
+    scoped_device.add_foreign_media('Documents/FakeApp/', 'theirs.txt')
+    confirmed = []
+    report = ss.delete_shared_many(['Documents/FakeApp/mine.txt',
+                                    'Documents/FakeApp/theirs.txt'],
+                                   callback = confirmed.append)
+    assert report == {'Documents/FakeApp/mine.txt' : 'deleted',
+                      'Documents/FakeApp/theirs.txt' : 'requested'}
+    assert scoped_device.counters['binder.createDeleteRequest'] == 1
+    scoped_device.answer_request(granted = True)
+    assert scoped_device.run_until(lambda: confirmed)
+    assert confirmed == [True]
+    assert scoped_device.media_rows() == []
+
+
+def test_delete_request_while_measured(scoped_device):
+    from androidstorage4kivy import SharedStorage, metrics
+    ss = SharedStorage()
+    scoped_device.add_foreign_media('Documents/FakeApp/', 'theirs.txt')
+    events = []
+    with metrics.listening(events.append):
+        report = ss.delete_shared_many(['Documents/FakeApp/theirs.txt'])
+        assert report == {'Documents/FakeApp/theirs.txt' : 'requested'}
+        assert scoped_device.counters['binder.createDeleteRequest'] == 1
+        scoped_device.add_foreign_media('Documents/FakeApp/', 'other.txt')
+        assert ss.delete_shared_tree('Documents') ==\
+            {'Documents/FakeApp/theirs.txt' : 'requested',
+             'Documents/FakeApp/other.txt' : 'requested'}
+    assert len(scoped_device.started) == 2
+
+
+def test_delete_shared_tree(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    ss.copy_many_to_shared([
+        (device.make_private_file('a.txt', 10), 'keep/a.txt'),
+        (device.make_private_file('b.txt', 10), 'export/b.txt'),
+        (device.make_private_file('c.txt', 10), 'export/deep/c.txt')])
+    device.reset_counters()
+    report = ss.delete_shared_tree('Documents', 'export')
+    assert report == {'Documents/FakeApp/export/b.txt' : 'deleted',
+                      'Documents/FakeApp/export/deep/c.txt' : 'deleted'}
+    if device.api_version > 28:
+        assert device.counters['binder.query'] == 1
+        assert device.counters['binder.delete'] == 1
+    else:
+        assert not os.path.exists(os.path.join(device.storage_dir,
+                                               'Documents/FakeApp/export'))
+    assert [i.path for i in ss.list_shared('Documents')] ==\
+        ['Documents/FakeApp/keep/a.txt']
+
+
+def test_delete_shared_tree_not_owned(scoped_device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    export(scoped_device, ['mine.txt'])
+    scoped_device.add_foreign_media('Documents/FakeApp/', 'theirs.txt')
+    report = ss.delete_shared_tree('Documents')
+    assert report == {'Documents/FakeApp/mine.txt' : 'deleted',
+                      'Documents/FakeApp/theirs.txt' : 'requested'}
+    scoped_device.answer_request(granted = False)
+    assert [r['_display_name'] for r in scoped_device.media_rows()] ==\
+        ['theirs.txt']
@@ -0,0 +1,71 @@
+import logging
+
+
+def test_events(device):
+    from androidstorage4kivy import SharedStorage, metrics
+    ss = SharedStorage()
+    private_file = device.make_private_file('a.txt', 5000)
+    events = []
+    with metrics.listening(events.append):
+        shared_file = ss.copy_to_shared(private_file)
+        ss.copy_from_shared(shared_file)
+    ss.delete_shared(shared_file)
+    assert [e.operation for e in events] ==\
+        ['copy_to_shared', 'copy_from_shared']
+    copy_to, copy_from = events
+    assert copy_to.succeeded and copy_from.succeeded
+    assert copy_to.bytes == 5000 and copy_from.bytes == 5000
+    assert copy_to.duration > 0
+    if device.api_version > 28:
+        assert copy_to.copy_path == 'FileUtils'
+        # query, insert, openOutputStream
+        assert copy_to.resolver_calls == 3
+    else:
+        assert copy_to.copy_path == 'shutil'
+        assert copy_to.resolver_calls == 0
+
+
+def test_nested_operations_report_once(device):
+    from androidstorage4kivy import SharedStorage, ShareSheet, metrics
+    ss = SharedStorage()
+    files = ss.copy_many_to_shared([device.make_private_file('a.png', 10),
+                                    device.make_private_file('b.png', 10)])
+    events = []
+    with metrics.listening(events.append):
+        ShareSheet().share_file_list(files)
+        assert device.run_until(lambda: events)
+    assert [e.operation for e in events] == ['share_file_list']
+    assert events[0].succeeded
+    assert events[0].resolver_calls >= 1
+
+
+def test_failed_operation(device):
+    from androidstorage4kivy import SharedStorage, metrics
+    events = []
+    with metrics.listening(events.append):
+        SharedStorage().copy_from_shared('Documents/FakeApp/missing.txt')
+    assert len(events) == 1 and not events[0].succeeded
+
+
+def test_aggregator(device, caplog):
+    from androidstorage4kivy import SharedStorage, metrics
+    ss = SharedStorage()
+    aggregator = metrics.MetricsAggregator()
+    with metrics.listening(aggregator):
+        for i in range(10):
+            ss.copy_to_shared(device.make_private_file(str(i) + '.txt', 100))
+    report = aggregator.report()['copy_to_shared']
+    assert report['count'] == 10
+    assert report['bytes'] == 1000
+    assert 0 < report['p50_ms'] <= report['p95_ms']
+    with caplog.at_level(logging.INFO, logger = 'kivy'):
+        aggregator.log_report()
+    assert 'Metrics: copy_to_shared count=10' in caplog.text
+
+
+def test_no_listener(device):
+    from androidstorage4kivy import metrics
+    assert metrics._listeners == []
+    assert not metrics.measuring()
+    cr = device.resolver
+    assert metrics.track_resolver(cr) is cr
@@ -0,0 +1,182 @@
+import os
+import hashlib
+
+CHUNK = 64 * 1024
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Stops a copy after some bytes, as if the app was stopped
+class Interrupt():
+    cancelled = False
+
+    def __init__(self, after):
+        self.after = after
+
+    def check_cancelled(self):
+        pass
+
+    def set_total(self, total_bytes):
+        pass
+
+    def set_progress(self, bytes_transferred):
+        if bytes_transferred >= self.after:
+            raise OSError('stopped')
+
+
+def storage(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    ss.resumable_chunk_size = CHUNK
+    return ss
+
+
+# A new process reads the checkpoints from storage
+def restart():
+    from androidstorage4kivy import jsonstore
+    jsonstore._stores.clear()
+
+
+def copied_bytes(function, *args):
+    from androidstorage4kivy import metrics
+    events = []
+    with metrics.listening(events.append):
+        result = function(*args)
+    return result, events[-1].bytes
+
+
+def test_copy_resumable_round_trip(device):
+    ss = storage(device)
+    data = os.urandom(5 * CHUNK + 100)
+    private_file = device.make_private_file('movie.mp4', data = data)
+    shared_file, digest = ss.copy_to_shared_resumable(private_file,
+                                                      return_hash = True)
+    assert digest == hashlib.sha256(data).hexdigest()
+    cache_file, digest = ss.copy_from_shared_resumable(shared_file,
+                                                       return_hash = True)
+    assert read(cache_file) == data
+    assert digest == hashlib.sha256(data).hexdigest()
+    # From the cache, the hash is still returned
+    assert ss.copy_from_shared_resumable(shared_file, True) ==\
+        (cache_file, digest)
+
+
+def test_copy_to_shared_resumes(device):
+    ss = storage(device)
+    data = os.urandom(10 * CHUNK)
+    private_file = device.make_private_file('movie.mp4', data = data)
+    assert ss._copy_to_shared_resumable(private_file, None, None, False,
+                                        Interrupt(4 * CHUNK)) == None
+    # Not visible until complete
+    assert list(ss.list_shared('Movies')) == []
+    restart()
+    shared_file, copied = copied_bytes(ss.copy_to_shared_resumable,
+                                       private_file)
+    assert copied == 6 * CHUNK
+    assert read(ss.copy_from_shared(shared_file)) == data
+    assert [i.size for i in ss.list_shared('Movies')] == [10 * CHUNK]
+
+
+def test_changed_source_restarts(device):
+    ss = storage(device)
+    private_file = device.make_private_file('movie.mp4', 10 * CHUNK)
+    ss._copy_to_shared_resumable(private_file, None, None, False,
+                                 Interrupt(4 * CHUNK))
+    data = os.urandom(8 * CHUNK)
+    private_file = device.make_private_file('movie.mp4', data = data)
+    os.utime(private_file, (1, 1))
+    shared_file, copied = copied_bytes(ss.copy_to_shared_resumable,
+                                       private_file)
+    assert copied == 8 * CHUNK
+    assert read(ss.copy_from_shared(shared_file)) == data
+
+
+def test_damaged_partial_restarts(legacy_device):
+    ss = storage(legacy_device)
+    data = os.urandom(10 * CHUNK)
+    private_file = legacy_device.make_private_file('movie.mp4', data = data)
+    ss._copy_to_shared_resumable(private_file, None, None, False,
+                                 Interrupt(4 * CHUNK))
+    partial = [os.path.join(d, f)
+               for d, _, files in os.walk(legacy_device.storage_dir)
+               for f in files if f.endswith('.partial')][0]
+    with open(partial, 'r+b') as f:
+        f.seek(4 * CHUNK - 10)
+        f.write(b'0123456789')
+    shared_file, copied = copied_bytes(ss.copy_to_shared_resumable,
+                                       private_file)
+    assert copied == 10 * CHUNK
+    assert read(ss.copy_from_shared(shared_file)) == data
+    assert not os.path.exists(partial)
+
+
+def test_copy_from_shared_resumes(device):
+    ss = storage(device)
+    data = os.urandom(10 * CHUNK)
+    shared_file = ss.copy_to_shared(device.make_private_file('movie.mp4',
+                                                             data = data))
+    assert ss._copy_from_shared_resumable(shared_file, False,
+                                          Interrupt(3 * CHUNK)) == None
+    restart()
+    (cache_file, digest), copied = copied_bytes(
+        ss.copy_from_shared_resumable, shared_file, True)
+    assert copied == 7 * CHUNK
+    assert read(cache_file) == data
+    assert digest == hashlib.sha256(data).hexdigest()
+
+
+def test_discard_checkpoints(device):
+    ss = storage(device)
+    private_file = device.make_private_file('movie.mp4', 10 * CHUNK)
+    ss._copy_to_shared_resumable(private_file, None, None, False,
+                                 Interrupt(4 * CHUNK))
+    assert ss.discard_checkpoints() == 1
+    if device.api_version > 28:
+        assert device.media_rows() == []
+    assert not [f for d, _, files in os.walk(device.storage_dir)
+                for f in files if f.endswith('.partial')]
+    _, copied = copied_bytes(ss.copy_to_shared_resumable, private_file)
+    assert copied == 10 * CHUNK
+
+
+def test_existing_file_kept_until_complete(device):
+    ss = storage(device)
+    original = os.urandom(3 * CHUNK)
+    shared_file = ss.copy_to_shared(
+        device.make_private_file('movie.mp4', data = original))
+    data = os.urandom(10 * CHUNK)
+    private_file = device.make_private_file('movie.mp4', data = data)
+    # Interrupted, then abandoned
+    ss._copy_to_shared_resumable(private_file, None, None, False,
+                                 Interrupt(4 * CHUNK))
+    assert read(ss.copy_from_shared(shared_file)) == original
+    assert ss.discard_checkpoints() == 1
+    # Cancelled
+    cancel = Interrupt(4 * CHUNK)
+    cancel.cancelled = True
+    ss._copy_to_shared_resumable(private_file, None, None, False, cancel)
+    assert read(ss.copy_from_shared(shared_file)) == original
+    assert [i.size for i in ss.list_shared('Movies')] == [3 * CHUNK]
+    # Complete
+    shared_file = ss.copy_to_shared_resumable(private_file)
+    assert read(ss.copy_from_shared(shared_file)) == data
+    assert [(i.name, i.size) for i in ss.list_shared('Movies')] ==\
+        [('movie.mp4', 10 * CHUNK)]
+    if device.api_version > 28:
+        assert len(device.media_rows()) == 1
+
+
+def test_transfer_engine_resumable(device):
+    from androidstorage4kivy import TransferEngine
+    data = os.urandom(3 * 1024 * 1024)
+    private_file = device.make_private_file('movie.mp4', data = data)
+    engine = TransferEngine()
+    done = []
+    engine.copy_to_shared_resumable(private_file, return_hash = True,
+                                    callback = done.append)
+    assert device.run_until(lambda: done)
+    assert done[0].result[1] == hashlib.sha256(data).hexdigest()
+    engine.shutdown()
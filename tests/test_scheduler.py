@@ -0,0 +1,241 @@
+import threading
+from time import monotonic, sleep
+
+MB = 1024 * 1024
+
+
+# Run function(*args) on a thread, results are appended to results
+def start(function, *args, results = None):
+    def target():
+        value = function(*args)
+        if results != None:
+            results.append(value)
+    t = threading.Thread(target = target, daemon = True)
+    t.start()
+    return t
+
+
+# function(*args) called by a background thread, not the main (UI) thread
+def background(function, *args):
+    results = []
+    start(function, *args, results = results).join()
+    return results[0] if results else None
+
+
+def wait_for(predicate, timeout = 5):
+    end = monotonic() + timeout
+    while not predicate():
+        if monotonic() > end:
+            return False
+        sleep(0.001)
+    return True
+
+
+def test_limit(device):
+    from androidstorage4kivy.scheduler import IOScheduler
+    s = IOScheduler({'bulk' : 1})
+    running = []
+    peak = []
+    release = threading.Event()
+
+    def job(self, n):
+        running.append(n)
+        peak.append(len(running))
+        release.wait()
+        running.remove(n)
+        return n
+
+    threads = [start(s.run, 'bulk', job, (None, i), {}) for i in range(3)]
+    assert wait_for(lambda: s.stats()['bulk']['queue_depth'] == 2)
+    assert s.stats()['bulk']['running'] == 1
+    release.set()
+    for t in threads:
+        t.join()
+    assert max(peak) == 1
+    stats = s.stats()['bulk']
+    assert stats['completed'] == 3 and stats['max_queue_depth'] == 2
+    assert stats['wait_max'] > 0
+
+
+def test_higher_priority_first(device):
+    from androidstorage4kivy.scheduler import IOScheduler
+    s = IOScheduler({'interactive' : 1, 'bulk' : 1})
+    order = []
+    release = threading.Event()
+
+    def job(self, name):
+        order.append(name)
+        if name == 'first':
+            release.wait()
+
+    start(s.run, 'interactive', job, (None, 'first'), {})
+    assert wait_for(lambda: order == ['first'])
+    start(s.run, 'interactive', job, (None, 'second'), {})
+    assert wait_for(lambda: s.stats()['interactive']['queue_depth'] == 1)
+    t = start(s.run, 'bulk', job, (None, 'bulk'), {})
+    # The bulk class has a free slot, but an interactive job is waiting
+    sleep(0.05)
+    assert order == ['first']
+    release.set()
+    t.join()
+    assert order == ['first', 'second', 'bulk']
+
+
+def test_identical_jobs_deduplicated(device):
+    from androidstorage4kivy.scheduler import IOScheduler
+    s = IOScheduler({'bulk' : 1})
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def blocker():
+        release.wait()
+
+    def copy(self, name):
+        calls.append(name)
+        return name + '.copy'
+
+    start(s.run, 'bulk', blocker, (), {})
+    assert wait_for(lambda: s.stats()['bulk']['running'] == 1)
+    threads = [start(s.run, 'bulk', copy, (None, 'a'), {}, results = results)
+               for i in range(3)]
+    assert wait_for(lambda: s.stats()['bulk']['deduplicated'] == 2)
+    release.set()
+    for t in threads:
+        t.join()
+    assert calls == ['a']
+    assert results == ['a.copy'] * 3
+
+
+def test_duplicate_promotes_waiting_job(device):
+    from androidstorage4kivy.scheduler import IOScheduler
+    s = IOScheduler({'bulk' : 1})
+    release = threading.Event()
+    start(s.run, 'bulk', release.wait, (), {})
+    assert wait_for(lambda: s.stats()['bulk']['running'] == 1)
+    results = []
+
+    def upper(self, name):
+        return name.upper()
+
+    threads = [start(s.run, p, upper, (None, 'x'), {}, results = results)
+               for p in ['bulk', 'interactive']]
+    # Runs now, as an interactive job
+    assert wait_for(lambda: len(results) == 2)
+    assert s.stats()['interactive']['completed'] == 1
+    assert s.stats()['bulk']['queue_depth'] == 0
+    release.set()
+    for t in threads:
+        t.join()
+
+
+def test_nested_operation_is_part_of_the_job(device):
+    from androidstorage4kivy.scheduler import IOScheduler
+    s = IOScheduler({'bulk' : 1})
+
+    def inner():
+        return 'inner'
+
+    def outer():
+        return s.run('bulk', inner, (), {})
+
+    assert background(s.run, 'bulk', outer, (), {}) == 'inner'
+    assert s.stats()['bulk']['completed'] == 1
+
+
+def test_priority_override(device):
+    from androidstorage4kivy import SharedStorage
+    from androidstorage4kivy.scheduler import get_scheduler
+    ss = SharedStorage()
+    private_file = device.make_private_file('a.txt', 10)
+    background(ss.copy_to_shared, private_file)
+
+    def copy_interactive():
+        with get_scheduler().priority('interactive'):
+            return ss.copy_to_shared(private_file)
+
+    shared_file = background(copy_interactive)
+    background(ss.copy_from_shared, shared_file)
+    background(ss.get_thumbnail, shared_file)
+    stats = get_scheduler().stats()
+    assert stats['bulk']['completed'] == 1
+    assert stats['interactive']['completed'] == 2
+    assert stats['prefetch']['completed'] == 1
+
+
+def test_bulk_throttle(device):
+    from androidstorage4kivy import SharedStorage
+    from androidstorage4kivy.scheduler import get_scheduler
+    ss = SharedStorage()
+    get_scheduler().bulk_bytes_per_second = 4 * MB
+    private_file = device.make_private_file('movie.mp4', MB)
+    begin = monotonic()
+    shared_file = background(ss.copy_to_shared, private_file)
+    assert monotonic() - begin >= 0.2
+    assert get_scheduler().stats()['bulk']['throttled'] >= 0.2
+    # Interactive copies are not throttled
+    begin = monotonic()
+    assert background(ss.copy_from_shared, shared_file)
+    assert monotonic() - begin < 0.2
+    with open(ss.copy_from_shared(shared_file), 'rb') as f, \
+         open(private_file, 'rb') as g:
+        assert f.read() == g.read()
+
+
+def test_throttled_transfer_cancels(device):
+    from androidstorage4kivy import TransferEngine
+    from androidstorage4kivy.scheduler import get_scheduler
+    get_scheduler().bulk_bytes_per_second = 100 * 1024
+    engine = TransferEngine()
+    done = []
+    job = engine.copy_to_shared(device.make_private_file('big.bin', 2 * MB),
+                                callback = done.append)
+    assert wait_for(lambda: get_scheduler().stats()['bulk']['running'] == 1)
+    begin = monotonic()
+    job.cancel()
+    assert device.run_until(lambda: done)
+    assert monotonic() - begin < 2
+    assert job.result == None
+    engine.shutdown()
+
+
+def test_transfer_engine_priority(device):
+    from androidstorage4kivy import SharedStorage, TransferEngine
+    from androidstorage4kivy.scheduler import get_scheduler
+    shared_file = SharedStorage().copy_to_shared(
+        device.make_private_file('a.txt', 10))
+    get_scheduler().reset_stats()
+    done = []
+    engine = TransferEngine()
+    engine.copy_from_shared(shared_file, callback = done.append)
+    interactive = TransferEngine(priority = 'interactive')
+    interactive.copy_from_shared(shared_file, callback = done.append)
+    assert device.run_until(lambda: len(done) == 2)
+    stats = get_scheduler().stats()
+    assert stats['bulk']['completed'] == 1
+    assert stats['interactive']['completed'] == 1
+    engine.shutdown()
+    interactive.shutdown()
+
+
+def test_main_thread_is_interactive(device):
+    from androidstorage4kivy import SharedStorage
+    from androidstorage4kivy.scheduler import get_scheduler
+    ss = SharedStorage()
+    private_file = device.make_private_file('a.txt', 10)
+    release = threading.Event()
+    get_scheduler().set_limit('bulk', 1)
+    start(get_scheduler().run, 'bulk', release.wait, (), {})
+    assert wait_for(lambda: get_scheduler().stats()['bulk']['running'] == 1)
+    # Not queued behind the background bulk job
+    assert ss.copy_to_shared(private_file)
+    stats = get_scheduler().stats()
+    assert stats['interactive']['completed'] == 1
+    assert stats['bulk']['queue_depth'] == 0
+    # A background thread's copy is bulk
+    t = start(ss.copy_to_shared, private_file)
+    assert wait_for(lambda:
+                    get_scheduler().stats()['bulk']['queue_depth'] == 1)
+    release.set()
+    t.join()
+    assert get_scheduler().stats()['bulk']['completed'] == 2
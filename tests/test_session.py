@@ -0,0 +1,55 @@
+
+def test_session_is_shared(device):
+    from androidstorage4kivy.session import get_session
+    session = get_session()
+    assert get_session() is session
+    assert session.storage is session.storage
+    assert session.package_name == 'org.test.fakeapp'
+
+
+def test_static_fields_read_once(device):
+    from androidstorage4kivy.session import get_session
+    from androidstorage4kivy.sharedstorage import Environment
+    session = get_session()
+    pictures = session.static(Environment, 'DIRECTORY_PICTURES')
+    files = session.root_uri('files')
+    device.reset_counters()
+    assert session.static(Environment, 'DIRECTORY_PICTURES') == pictures
+    assert session.root_uri('files') is files
+    assert device.counters['jni'] == 0
+
+
+def test_no_java_objects_kept(device):
+    from androidstorage4kivy import SharedStorage, ShareSheet
+    from fakedevice import JavaObject
+    ss = SharedStorage()
+    share_sheet = ShareSheet()
+    shared_file = ss.copy_to_shared(device.make_private_file('a.txt', 10))
+    share_sheet.share_plain_text('hello')
+    share_sheet.share_file(shared_file)
+    share_sheet.view_file(shared_file)
+    assert device.started
+    for instance in (ss, share_sheet):
+        assert not [v for v in vars(instance).values()
+                    if isinstance(v, JavaObject)]
+
+
+def test_legacy_share_uses_no_new_storage(legacy_device):
+    from androidstorage4kivy import SharedStorage, ShareSheet
+    from androidstorage4kivy import sharedstorage
+    from androidstorage4kivy.session import get_session
+    shared_file = SharedStorage().copy_to_shared(
+        legacy_device.make_private_file('a.txt', 10))
+    get_session().storage
+    created = []
+    init = sharedstorage.SharedStorage.__init__
+    sharedstorage.SharedStorage.__init__ =\
+        lambda self, *args: created.append(self) or init(self, *args)
+    try:
+        share_sheet = ShareSheet()
+        share_sheet.share_file(shared_file)
+        share_sheet.share_file_list([shared_file])
+    finally:
+        sharedstorage.SharedStorage.__init__ = init
+    assert legacy_device.started
+    assert created == []
@@ -0,0 +1,200 @@
+import os
+import pytest
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_copy_round_trip(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('notes.txt', data = b'hello')
+    shared_file = ss.copy_to_shared(private_file)
+    assert shared_file
+    cache_file = ss.copy_from_shared(shared_file)
+    assert read(cache_file) == b'hello'
+
+
+def test_copy_to_shared_replaces(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('notes.txt', data = b'one')
+    ss.copy_to_shared(private_file)
+    private_file = device.make_private_file('notes.txt', data = b'two two')
+    shared_file = ss.copy_to_shared(private_file)
+    assert read(ss.copy_from_shared(shared_file)) == b'two two'
+    if device.api_version > 28:
+        rows = device.media_rows()
+        assert [r['_display_name'] for r in rows] == ['notes.txt']
+        assert rows[0]['_size'] == 7
+
+
+def test_copy_to_shared_collection_and_filepath(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('song.mp3', 100)
+    shared_file = ss.copy_to_shared(private_file, 'Podcasts', 'a/b/x.mp3')
+    info = list(ss.list_shared('Podcasts'))
+    assert [i.path for i in info] == ['Podcasts/FakeApp/a/b/x.mp3']
+    assert info[0].size == 100
+    assert ss.delete_shared(shared_file)
+    assert list(ss.list_shared('Podcasts')) == []
+
+
+def test_copy_from_shared_is_cached(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = ss.copy_to_shared(device.make_private_file('a.txt', 1000))
+    first = ss.copy_from_shared(shared_file)
+    mtime = os.stat(first).st_mtime_ns
+    assert ss.copy_from_shared(shared_file) == first
+    assert os.stat(first).st_mtime_ns == mtime
+
+
+def test_cache_hit_does_not_save_index(device):
+    from androidstorage4kivy import SharedStorage
+    from androidstorage4kivy.cacheindex import INDEX_NAME
+    ss = SharedStorage()
+    shared_file = ss.copy_to_shared(device.make_private_file('a.txt', 10))
+    ss.copy_from_shared(shared_file)
+    index_file = os.path.join(ss.get_cache_dir(), INDEX_NAME)
+    mtime = os.stat(index_file).st_mtime_ns
+    for i in range(3):
+        ss.copy_from_shared(shared_file)
+    assert os.stat(index_file).st_mtime_ns == mtime
+
+
+def test_cached_uri_of_deleted_row(scoped_device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    ss.copy_to_shared(scoped_device.make_private_file('a.txt',
+                                                      data = b'first'))
+    shared_file = 'Documents/FakeApp/a.txt'
+    assert read(ss.copy_from_shared(shared_file)) == b'first'
+    # Deleted and created again, not by this SharedStorage
+    resolver = scoped_device.resolver
+    resolver.delete(ss._get_uri(shared_file), None, None)
+    resolver._add_media('Documents/FakeApp/', 'a.txt', b'second')
+    assert read(ss.copy_from_shared(shared_file)) == b'second'
+    resolver.delete(ss._get_uri(shared_file), None, None)
+    resolver._add_media('Documents/FakeApp/', 'a.txt', b'third')
+    assert ss.get_metadata(shared_file)['size'] == 5
+
+
+def test_copy_many_to_shared(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    files = [device.make_private_file('f' + str(i) + '.txt', data = b'x' * i)
+             for i in range(20)]
+    device.reset_counters()
+    shared_files = ss.copy_many_to_shared(files)
+    assert all(shared_files)
+    if device.api_version > 28:
+        counters = device.counters
+        assert counters['binder.applyBatch'] == 1
+        assert counters['binder.query'] == 1
+    for i, shared_file in enumerate(shared_files):
+        assert read(ss.copy_from_shared(shared_file)) == b'x' * i
+
+
+def test_copy_many_to_shared_apply_batch_fails(scoped_device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    files = [scoped_device.make_private_file('f' + str(i) + '.txt', 10)
+             for i in range(5)]
+    scoped_device.fail_next_apply_batch()
+    assert all(ss.copy_many_to_shared(files))
+    assert len(scoped_device.media_rows()) == 5
+
+
+def test_foreign_file_gets_a_new_version(scoped_device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    scoped_device.add_foreign_media('Documents/FakeApp/', 'a.txt', b'theirs')
+    shared_file = ss.copy_to_shared(
+        scoped_device.make_private_file('a.txt', data = b'mine'))
+    assert read(ss.copy_from_shared(shared_file)) == b'mine'
+    names = sorted([r['_display_name'] for r in scoped_device.media_rows()])
+    assert names == ['a (1).txt', 'a.txt']
+
+
+def test_create_and_open_shared(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    with ss.create_shared('data.csv') as f:
+        f.write(b'1,2,3\n')
+    assert f.shared_file
+    with ss.open_shared(f.shared_file) as g:
+        assert g.read() == b'1,2,3\n'
+
+
+def test_create_shared_not_published_on_error(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    with pytest.raises(ValueError):
+        with ss.create_shared('data.csv') as f:
+            f.write(b'partial')
+            raise ValueError()
+    assert list(ss.list_shared('Documents')) == []
+    assert device.media_rows() == []
+
+
+def test_create_shared_replaces_only_when_complete(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    with ss.create_shared('data.csv') as f:
+        f.write(b'original')
+    with pytest.raises(ValueError):
+        with ss.create_shared('data.csv') as g:
+            g.write(b'partial')
+            raise ValueError()
+    with ss.open_shared('Documents/FakeApp/data.csv') as h:
+        assert h.read() == b'original'
+    with ss.create_shared('data.csv') as g:
+        g.write(b'new')
+    with ss.open_shared('Documents/FakeApp/data.csv') as h:
+        assert h.read() == b'new'
+    if device.api_version > 28:
+        assert [(r['_display_name'], r['is_pending'])
+                for r in device.media_rows()] == [('data.csv', 0)]
+
+
+def test_list_shared_pages(scoped_device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    for i in range(25):
+        ss.copy_to_shared(scoped_device.make_private_file(
+            'f%02d.txt' % i, 10))
+    scoped_device.reset_counters()
+    names = [i.name for i in ss.list_shared('Documents', page_size = 10)]
+    assert names == ['f%02d.txt' % i for i in range(25)]
+    assert scoped_device.counters['binder.query'] == 3
+
+
+@pytest.mark.parametrize('count', [25, 10, 5])
+def test_list_shared_limit_ignored(scoped_device, count):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    for i in range(count):
+        ss.copy_to_shared(scoped_device.make_private_file(
+            'f%02d.txt' % i, 10))
+    scoped_device.ignore_query_limit()
+    names = [i.name for i in ss.list_shared('Documents', page_size = 10)]
+    assert names == ['f%02d.txt' % i for i in range(count)]
+
+
+def test_copy_document_without_file_descriptor(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    uri = device.add_document('photo.jpg', b'jpeg' * 1000,
+                              file_descriptor = False)
+    assert read(ss.copy_from_shared(uri)) == b'jpeg' * 1000
+
+
+def test_api_version_switch(device):
+    import android
+    from androidstorage4kivy import sharedstorage
+    assert sharedstorage.api_version == device.api_version
+    assert android.api_version == device.api_version
@@ -0,0 +1,164 @@
+
+def shared_files(device, count, extension = '.png'):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    return [ss.copy_to_shared(device.make_private_file(
+        'f' + str(i) + extension, 10)) for i in range(count)]
+
+
+def test_share_file(device):
+    from androidstorage4kivy import ShareSheet
+    shared_file, = shared_files(device, 1, '.txt')
+    ShareSheet().share_file(shared_file)
+    chooser = device.started[-1]
+    send = chooser._extras[chooser.EXTRA_INTENT]
+    assert send._action == send.ACTION_SEND
+    assert send._type == 'text/plain'
+    assert send._extras[send.EXTRA_STREAM]
+
+
+def test_share_file_list(device):
+    from androidstorage4kivy import ShareSheet
+    files = shared_files(device, 5)
+    device.reset_counters()
+    ShareSheet().share_file_list(files)
+    assert device.run_until(lambda: device.started)
+    chooser = device.started[-1]
+    send = chooser._extras[chooser.EXTRA_INTENT]
+    assert send._action == send.ACTION_SEND_MULTIPLE
+    assert len(send._extras[send.EXTRA_STREAM]) == 5
+    if device.api_version <= 28:
+        # One query, one delete, one batch insert
+        counters = device.counters
+        assert counters['binder.query'] == 1
+        assert counters['binder.applyBatch'] == 1
+        assert counters['binder.insert'] == 0
+
+
+def test_share_file_with_app(device):
+    from androidstorage4kivy import ShareSheet
+    shared_file, = shared_files(device, 1)
+    ShareSheet().share_file(shared_file, 'org.other.app')
+    assert device.started[-1]._package == 'org.other.app'
+
+
+def test_view_file(device):
+    from androidstorage4kivy import ShareSheet
+    shared_file, = shared_files(device, 1, '.txt')
+    ShareSheet().view_file(shared_file)
+    view = device.started[-1]
+    assert view._action == view.ACTION_VIEW
+    assert view._type == 'text/plain'
+
+
+def test_legacy_uris_are_cleaned_up(legacy_device):
+    from androidstorage4kivy import ShareSheet
+    files = shared_files(legacy_device, 3)
+    share_sheet = ShareSheet()
+    share_sheet.share_file_list(files)
+    assert legacy_device.run_until(lambda: legacy_device.started)
+    assert len(legacy_device.media_rows()) == 3
+    legacy_device.reset_counters()
+    share_sheet.share_plain_text('hello')
+    assert legacy_device.media_rows() == []
+    assert legacy_device.counters['binder.delete'] == 1
+    # The shared files are still there
+    from os.path import exists
+    assert all([exists(f) for f in files])
+
+
+def test_legacy_apply_batch_fails(legacy_device):
+    from androidstorage4kivy import ShareSheet
+    files = shared_files(legacy_device, 3)
+    legacy_device.fail_next_apply_batch()
+    ShareSheet().share_file_list(files)
+    assert legacy_device.run_until(lambda: legacy_device.started)
+    chooser = legacy_device.started[-1]
+    send = chooser._extras[chooser.EXTRA_INTENT]
+    assert len(send._extras[send.EXTRA_STREAM]) == 3
+    assert len(legacy_device.media_rows()) == 3
+
+
+def test_share_file_async(device):
+    from androidstorage4kivy import ShareSheet
+    shared_file, = shared_files(device, 1, '.txt')
+    results = []
+    future = ShareSheet().share_file_async(shared_file,
+                                           callback = results.append)
+    assert device.run_until(future.done)
+    assert future.result() == True
+    assert results == [True]
+    chooser = device.started[-1]
+    send = chooser._extras[chooser.EXTRA_INTENT]
+    assert send._action == send.ACTION_SEND
+
+
+def test_view_file_async(device):
+    from androidstorage4kivy import ShareSheet
+    shared_file, = shared_files(device, 1, '.txt')
+    future = ShareSheet().view_file_async(shared_file)
+    assert device.run_until(future.done)
+    assert future.result() == True
+    assert device.started[-1]._action == device.started[-1].ACTION_VIEW
+
+
+def test_async_nothing_to_share(device):
+    from androidstorage4kivy import ShareSheet
+    results = []
+    future = ShareSheet().share_file_list_async([], callback = results.append)
+    assert device.run_until(future.done)
+    assert future.result() == False
+    assert results == [False]
+    assert device.started == []
+
+
+def test_copy_and_share(device):
+    from androidstorage4kivy import ShareSheet
+    files = [device.make_private_file('c' + str(i) + '.png', 10)
+             for i in range(3)]
+    future = ShareSheet().copy_and_share(files, app = 'org.other.app')
+    assert device.run_until(future.done)
+    assert future.result() == True
+    send = device.started[-1]
+    assert send._package == 'org.other.app'
+    assert send._action == send.ACTION_SEND_MULTIPLE
+    assert len(send._extras[send.EXTRA_STREAM]) == 3
+
+
+def test_common_MIME_type():
+    from androidstorage4kivy.sharesheet import common_MIME_type
+    assert common_MIME_type(['image/png', 'image/png']) == 'image/png'
+    assert common_MIME_type(['image/png', 'image/jpeg']) == 'image/*'
+    assert common_MIME_type(['image/png', 'text/plain']) == '*/*'
+    assert common_MIME_type(['', None]) == '*/*'
+    assert common_MIME_type(['image/png', '']) == '*/*'
+    assert common_MIME_type(['image/png', None]) == '*/*'
+    assert common_MIME_type(['Image/PNG', 'image/jpeg']) == 'image/*'
+    assert common_MIME_type(['IMAGE/png', 'image/PNG']) == 'image/png'
+
+
+def share_type(device, files):
+    from androidstorage4kivy import ShareSheet
+    future = ShareSheet().share_file_list_async(files)
+    assert device.run_until(future.done)
+    chooser = device.started[-1]
+    return chooser._extras[chooser.EXTRA_INTENT]._type
+
+
+def test_share_file_list_MIME_type(device):
+    images = shared_files(device, 2, '.png') +\
+        [shared_files(device, 1, '.jpg')[0]]
+    assert share_type(device, images) == 'image/*'
+    text = shared_files(device, 1, '.txt')
+    assert share_type(device, images + text) == '*/*'
+
+
+def test_share_file_list_MIME_type_remembered(device):
+    files = shared_files(device, 3, '.png')
+    device.reset_counters()
+    assert share_type(device, files) == 'image/png'
+    assert device.counters['binder.getType'] ==\
+        (0 if device.api_version <= 28 else 3)
+    device.reset_counters()
+    assert share_type(device, files) == 'image/png'
+    assert device.counters['binder.getType'] == 0
@@ -0,0 +1,64 @@
+import os
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_copy_to_shared_skip_unchanged(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('asset.bin', 100000)
+    shared_file, skipped = ss.copy_to_shared(private_file,
+                                             skip_unchanged = True)
+    assert shared_file and not skipped
+    assert ss.copy_to_shared(private_file, skip_unchanged = True) ==\
+        (shared_file, True)
+    # Changed contents, same size
+    data = os.urandom(100000)
+    private_file = device.make_private_file('asset.bin', data = data)
+    assert ss.copy_to_shared(private_file, skip_unchanged = True) ==\
+        (shared_file, False)
+    assert read(ss.copy_from_shared(shared_file)) == data
+
+
+def test_skip_unchanged_without_index(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('asset.bin', 1000)
+    shared_file = ss.copy_to_shared(private_file)
+    # Same contents, found by hashing the shared file
+    assert ss.copy_to_shared(private_file, skip_unchanged = True) ==\
+        (shared_file, True)
+
+
+def test_skip_unchanged_touched_private_file(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_file = device.make_private_file('asset.bin', 1000)
+    shared_file, _ = ss.copy_to_shared(private_file, skip_unchanged = True)
+    os.utime(private_file, (1, 1))
+    assert ss.copy_to_shared(private_file, skip_unchanged = True) ==\
+        (shared_file, True)
+
+
+def test_copy_many_to_shared_skip_unchanged(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    files = [device.make_private_file('f' + str(i) + '.txt', 1000)
+             for i in range(20)]
+    results, skipped = ss.copy_many_to_shared(files, skip_unchanged = True)
+    assert all(results) and skipped == []
+    changed = device.make_private_file('f3.txt', 999)
+    device.reset_counters()
+    again, skipped = ss.copy_many_to_shared(files, skip_unchanged = True)
+    assert again == results
+    assert skipped == [f for f in files if f != changed]
+    if device.api_version > 28:
+        counters = device.counters
+        # Metadata only, one write
+        assert counters['binder.openOutputStream'] == 1
+        assert counters['binder.openFileDescriptor'] == 0
+        assert counters['binder.query'] <= 3
+    assert read(ss.copy_from_shared(again[3])) == read(changed)
@@ -0,0 +1,93 @@
+import os
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Returns the private directory
+def make_tree(device, names, size = 1000):
+    paths = [device.make_private_file('exports/' + name, size)
+             for name in names]
+    return paths[0][:-len(names[0]) - 1]
+
+
+def shared_names(ss, subpath = 'exports'):
+    return sorted([i.path for i in ss.list_shared('Documents', subpath)])
+
+
+def test_sync_tree(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    names = ['a.txt', 'b.txt', 'sub/c.txt', 'sub/deeper/d.txt']
+    private_dir = make_tree(device, names)
+    summary = ss.sync_tree(private_dir, 'Documents', 'exports')
+    assert sorted(summary['copied']) == sorted(names)
+    assert summary['failed'] == [] and summary['unchanged'] == []
+    assert shared_names(ss) == ['Documents/FakeApp/exports/' + n
+                                for n in sorted(names)]
+    shared_file = next(iter(i.shared_file
+                            for i in ss.list_shared('Documents', 'exports/sub')
+                            if i.name == 'c.txt'))
+    assert read(ss.copy_from_shared(shared_file)) ==\
+        read(os.path.join(private_dir, 'sub/c.txt'))
+
+
+def test_sync_tree_only_changes(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    names = ['f' + str(i) + '.txt' for i in range(20)]
+    private_dir = make_tree(device, names)
+    ss.sync_tree(private_dir, 'Documents', 'exports')
+    device.make_private_file('exports/f3.txt', 999)
+    device.make_private_file('exports/new.txt', 10)
+    device.reset_counters()
+    summary = ss.sync_tree(private_dir, 'Documents', 'exports',
+                           max_workers = 1)
+    assert sorted(summary['copied']) == ['f3.txt', 'new.txt']
+    assert len(summary['unchanged']) == 19
+    if device.api_version > 28:
+        counters = device.counters
+        # One listing, then only the two files are written
+        assert counters['binder.openOutputStream'] == 2
+        assert counters['binder.openFileDescriptor'] == 0
+        assert counters['binder.query'] <= 4
+
+
+def test_sync_tree_delete_extraneous(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_dir = make_tree(device, ['a.txt', 'sub/b.txt', 'sub/c.txt'])
+    ss.sync_tree(private_dir, 'Documents', 'exports')
+    os.remove(os.path.join(private_dir, 'sub/b.txt'))
+    summary = ss.sync_tree(private_dir, 'Documents', 'exports')
+    assert summary['deleted'] == []
+    assert len(shared_names(ss)) == 3
+    summary = ss.sync_tree(private_dir, 'Documents', 'exports',
+                           delete_extraneous = True)
+    assert summary['deleted'] == ['sub/b.txt']
+    assert sorted(summary['unchanged']) == ['a.txt', 'sub/c.txt']
+    assert shared_names(ss) == ['Documents/FakeApp/exports/a.txt',
+                                'Documents/FakeApp/exports/sub/c.txt']
+
+
+def test_sync_tree_ignores_other_collections(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    private_dir = make_tree(device, ['a.txt', 'photo.jpg'])
+    summary = ss.sync_tree(private_dir, 'Documents', 'exports',
+                           delete_extraneous = True)
+    assert summary['copied'] == ['a.txt']
+    assert summary['ignored'] == ['photo.jpg']
+    assert list(ss.list_shared('Pictures')) == []
+
+
+def test_sync_tree_one_worker(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    names = ['f' + str(i) + '.txt' for i in range(10)]
+    private_dir = make_tree(device, names)
+    summary = ss.sync_tree(private_dir, 'Documents', max_workers = 1)
+    assert sorted(summary['copied']) == sorted(names)
+    assert len(shared_names(ss, None)) == 10
@@ -0,0 +1,163 @@
+import os
+import logging
+from fakedevice import media
+
+MB = 1024 * 1024
+
+
+def share_media(device, ss, name, width, height, duration = 0, size = MB):
+    return ss.copy_to_shared(device.make_private_media(name, width, height,
+                                                       duration, size))
+
+
+def test_get_thumbnail(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = share_media(device, ss, 'photo.jpg', 4000, 3000,
+                              size = 4 * MB)
+    thumbnail = ss.get_thumbnail(shared_file, 256)
+    assert thumbnail.endswith('photo.jpg')
+    with open(thumbnail, 'rb') as f:
+        width, height, duration = media.decode(f.read())
+    assert max(width, height) <= 256
+    assert (width, height) == (256, 192)
+    # Kilobytes, not the 4 MB of a copy
+    assert os.path.getsize(thumbnail) < 16 * 1024
+    assert 'Thumbnails' in thumbnail and\
+        not thumbnail.startswith(ss.get_cache_dir())
+
+
+def test_get_thumbnail_png(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = share_media(device, ss, 'photo.jpg', 400, 300)
+    thumbnail = ss.get_thumbnail(shared_file, 100, 'png')
+    assert thumbnail.endswith('photo.png')
+    with open(thumbnail, 'rb') as f:
+        assert media.decode(f.read())[:2] == (100, 75)
+
+
+def test_get_thumbnail_cached(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = share_media(device, ss, 'photo.jpg', 4000, 3000)
+    thumbnail = ss.get_thumbnail(shared_file)
+    device.reset_counters()
+    assert ss.get_thumbnail(shared_file) == thumbnail
+    assert device.counters['media_bytes_read'] == 0
+    # Another size is another thumbnail
+    assert ss.get_thumbnail(shared_file, 64) != thumbnail
+    # A changed file is decoded again
+    shared_file = ss.copy_to_shared(device.make_private_media('photo.jpg',
+                                                              300, 400))
+    thumbnail = ss.get_thumbnail(shared_file)
+    with open(thumbnail, 'rb') as f:
+        assert media.decode(f.read())[:2] == (192, 256)
+
+
+def test_get_thumbnail_sampled_decode(legacy_device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = share_media(legacy_device, ss, 'photo.jpg', 4000, 3000)
+    legacy_device.reset_counters()
+    assert ss.get_thumbnail(shared_file, 256)
+    # The bounds, then one decode at 1/8 size
+    assert legacy_device.counters['media_bytes_read'] ==\
+        media.HEADER.size + MB
+
+
+def test_get_thumbnail_video(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = share_media(device, ss, 'clip.mp4', 1920, 1080, 5000)
+    with open(ss.get_thumbnail(shared_file, 128), 'rb') as f:
+        assert media.decode(f.read())[:2] == (128, 72)
+
+
+def test_get_thumbnail_not_media(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = ss.copy_to_shared(device.make_private_file('notes.txt',
+                                                             100))
+    assert ss.get_thumbnail(shared_file) == None
+    assert ss.get_thumbnail(None) == None
+
+
+def test_get_thumbnail_failure_logged(device, caplog):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = ss.copy_to_shared(device.make_private_file('notes.txt',
+                                                             100))
+    with caplog.at_level(logging.WARNING, logger = 'kivy'):
+        assert ss.get_thumbnail(shared_file) == None
+    assert 'SharedStorage.get_thumbnail():' in caplog.text
+    assert 'copy_from_shared' not in caplog.text
+
+
+def test_get_thumbnail_document(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    uri = device.add_document('picked.jpg', media.encode(800, 600,
+                                                         size = 1000))
+    with open(ss.get_thumbnail(uri, 80), 'rb') as f:
+        assert media.decode(f.read())[:2] == (80, 60)
+
+
+def test_thumbnail_cache_bounded(device):
+    from androidstorage4kivy import SharedStorage
+    from androidstorage4kivy.cacheindex import get_cache_index
+    ss = SharedStorage()
+    ss.thumbnail_cache_max_bytes = 20 * 1024
+    thumbnails = [ss.get_thumbnail(share_media(device, ss, 'p' + str(i) +
+                                               '.jpg', 1000, 1000, size = 100))
+                  for i in range(10)]
+    index = get_cache_index(os.path.dirname(os.path.dirname(thumbnails[0])))
+    assert index.total_bytes() <= 20 * 1024
+    assert os.path.exists(thumbnails[-1])
+    assert not os.path.exists(thumbnails[0])
+
+
+def test_get_metadata(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    shared_file = share_media(device, ss, 'photo.jpg', 4000, 3000,
+                              size = 1000)
+    device.reset_counters()
+    metadata = ss.get_metadata(shared_file)
+    assert metadata['name'] == 'photo.jpg'
+    assert metadata['size'] == 1000
+    assert metadata['MIME_type'] == 'image/jpeg'
+    assert metadata['date_modified'] > 0
+    assert (metadata['width'], metadata['height']) == (4000, 3000)
+    assert metadata['duration'] == None
+    if device.api_version > 28:
+        # All from the MediaStore
+        assert device.counters['media_bytes_read'] == 0
+        assert metadata['date_taken'] > 0
+    else:
+        # The header only
+        assert device.counters['media_bytes_read'] == media.HEADER.size
+
+
+def test_get_metadata_video_and_audio(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    metadata = ss.get_metadata(share_media(device, ss, 'clip.mp4', 1280, 720,
+                                           61000, size = 1000))
+    assert (metadata['width'], metadata['height'], metadata['duration']) ==\
+        (1280, 720, 61000)
+    metadata = ss.get_metadata(share_media(device, ss, 'song.mp3', 0, 0,
+                                           180000, size = 1000))
+    assert metadata['MIME_type'] == 'audio/mpeg'
+    assert metadata['duration'] == 180000
+    assert metadata['width'] == None
+
+
+def test_get_metadata_not_media(device):
+    from androidstorage4kivy import SharedStorage
+    ss = SharedStorage()
+    metadata = ss.get_metadata(ss.copy_to_shared(
+        device.make_private_file('notes.txt', 100)))
+    assert metadata['size'] == 100
+    assert metadata['width'] == None and metadata['duration'] == None
+    assert ss.get_metadata('Documents/FakeApp/missing.txt') == None
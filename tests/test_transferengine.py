@@ -0,0 +1,42 @@
+
+def test_copy_to_shared_with_progress(device):
+    from androidstorage4kivy import TransferEngine
+    engine = TransferEngine()
+    private_file = device.make_private_file('movie.mp4', 3 * 1024 * 1024)
+    progress = []
+    done = []
+    job = engine.copy_to_shared(private_file,
+                                callback = done.append,
+                                progress = lambda j:
+                                progress.append(j.bytes_transferred))
+    assert device.run_until(lambda: done)
+    assert done == [job]
+    assert job.result
+    assert progress and progress[-1] == 3 * 1024 * 1024
+    engine.shutdown()
+
+
+def test_copy_from_shared_in_parallel(device):
+    from androidstorage4kivy import SharedStorage, TransferEngine
+    ss = SharedStorage()
+    shared_files = [ss.copy_to_shared(device.make_private_file(
+        'f' + str(i) + '.txt', 1000)) for i in range(8)]
+    engine = TransferEngine(max_workers = 4)
+    done = []
+    for shared_file in shared_files:
+        engine.copy_from_shared(shared_file, callback = done.append)
+    assert device.run_until(lambda: len(done) == 8)
+    assert len(set([job.result for job in done])) == 8
+    engine.shutdown()
+
+
+def test_cancel(device):
+    from androidstorage4kivy import SharedStorage
+    from androidstorage4kivy.transferengine import TransferJob
+    private_file = device.make_private_file('big.bin', 1024 * 1024)
+    job = TransferJob('_copy_to_shared', ())
+    job.cancel()
+    assert SharedStorage()._copy_to_shared(private_file, None, None,
+                                           job) == None
+    # No partial shared file is left
+    assert list(SharedStorage().list_shared('Documents')) == []